@@ -78,6 +78,8 @@ CREATE TABLE IF NOT EXISTS orders (
     quantity DECIMAL(38, 18) NOT NULL CHECK (quantity > 0),
     price DECIMAL(38, 18), -- NULL for market orders
     stop_price DECIMAL(38, 18), -- For stop orders
+    display_quantity DECIMAL(38, 18) CHECK (display_quantity > 0), -- Visible slice of iceberg orders
+    max_cost DECIMAL(38, 18) CHECK (max_cost > 0), -- Quote reserved by a buy without a limit price
     
     -- Execution state
     filled_quantity DECIMAL(38, 18) DEFAULT 0.0 CHECK (filled_quantity >= 0),
@@ -88,10 +90,12 @@ CREATE TABLE IF NOT EXISTS orders (
     status VARCHAR(50) NOT NULL DEFAULT 'OPEN' CHECK (status IN ('OPEN', 'PARTIALLY_FILLED', 'FILLED', 'CANCELLED', 'REJECTED', 'EXPIRED')),
     
     -- Time controls
+    time_in_force VARCHAR(10) NOT NULL DEFAULT 'GTC' CHECK (time_in_force IN ('GTC', 'IOC', 'FOK')),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     expires_at TIMESTAMP,
     filled_at TIMESTAMP,
+    triggered_at TIMESTAMP, -- When a stop order's stop price was reached
     
     -- DAML contract metadata
     contract_id VARCHAR(255) UNIQUE,
@@ -103,17 +107,31 @@ CREATE TABLE IF NOT EXISTS orders (
 );
 
 CREATE INDEX idx_orders_account ON orders(account_id);
-CREATE INDEX idx_orders_party ON orders(party_id);
+CREATE INDEX idx_orders_party ON orders(party_id, created_at DESC, order_id DESC);
 CREATE INDEX idx_orders_pair ON orders(pair);
 CREATE INDEX idx_orders_status ON orders(status);
 CREATE INDEX idx_orders_side ON orders(side);
 CREATE INDEX idx_orders_created ON orders(created_at DESC);
+-- Matching engine (trading-service/matching_engine.py). The partial index
+-- predicates must match the engine's queries exactly, so only live orders,
+-- a small slice of the table, are ever scanned.
+CREATE INDEX idx_orders_live_book ON orders(pair, side, price, created_at)
+    WHERE status IN ('OPEN', 'PARTIALLY_FILLED');
+CREATE INDEX idx_orders_live_takers ON orders(pair, created_at)
+    WHERE status IN ('OPEN', 'PARTIALLY_FILLED')
+      AND (order_type IN ('MARKET', 'STOP') OR time_in_force IN ('IOC', 'FOK'));
+CREATE INDEX idx_orders_updated ON orders(updated_at);
 
 -- ============================================
 -- TRADES (Maps to AtomicTrade.daml)
 -- ============================================
+-- Range partitioned by month of matched_at; see PARTITION MAINTENANCE.
+-- Unique keys have to include the partition key.
 CREATE TABLE IF NOT EXISTS trades (
-    trade_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    trade_id UUID NOT NULL DEFAULT uuid_generate_v4(),
+    -- Execution order: increases with every trade, including within a batch
+    -- that shares matched_at; settlement updates leave it as it is
+    trade_seq BIGSERIAL NOT NULL,
     
     -- Maker and Taker
     maker_order_id UUID NOT NULL REFERENCES orders(order_id),
@@ -137,23 +155,26 @@ CREATE TABLE IF NOT EXISTS trades (
     is_atomic BOOLEAN GENERATED ALWAYS AS (asset_transferred AND payment_transferred) STORED,
     
     -- Timestamps
-    matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    matched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     executed_at TIMESTAMP,
     
     -- DAML contract metadata
-    contract_id VARCHAR(255) UNIQUE,
+    contract_id VARCHAR(255),
     template_id VARCHAR(255) DEFAULT 'AtomicTrade',
     
     -- Fees
     maker_fee DECIMAL(38, 18) DEFAULT 0.0,
     taker_fee DECIMAL(38, 18) DEFAULT 0.0,
-    fee_asset VARCHAR(50) DEFAULT 'USDT'
-);
+    fee_asset VARCHAR(50) DEFAULT 'USDT',
+
+    PRIMARY KEY (trade_id, matched_at),
+    UNIQUE (contract_id, matched_at)
+) PARTITION BY RANGE (matched_at);
 
 CREATE INDEX idx_trades_maker_order ON trades(maker_order_id);
 CREATE INDEX idx_trades_taker_order ON trades(taker_order_id);
-CREATE INDEX idx_trades_maker_party ON trades(maker_party_id);
-CREATE INDEX idx_trades_taker_party ON trades(taker_party_id);
+CREATE INDEX idx_trades_maker_party ON trades(maker_party_id, matched_at DESC, trade_id DESC);
+CREATE INDEX idx_trades_taker_party ON trades(taker_party_id, matched_at DESC, trade_id DESC);
 CREATE INDEX idx_trades_pair ON trades(pair);
 CREATE INDEX idx_trades_matched ON trades(matched_at DESC);
 CREATE INDEX idx_trades_settlement ON trades(settlement_status);
@@ -161,8 +182,9 @@ CREATE INDEX idx_trades_settlement ON trades(settlement_status);
 -- ============================================
 -- TRANSACTIONS (Audit trail for all balance changes)
 -- ============================================
+-- Range partitioned by month of created_at; see PARTITION MAINTENANCE
 CREATE TABLE IF NOT EXISTS transactions (
-    transaction_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    transaction_id UUID NOT NULL DEFAULT uuid_generate_v4(),
     account_id UUID NOT NULL REFERENCES trading_accounts(account_id),
     party_id VARCHAR(255) NOT NULL REFERENCES parties(party_id),
     
@@ -174,20 +196,22 @@ CREATE TABLE IF NOT EXISTS transactions (
     
     -- References
     order_id UUID REFERENCES orders(order_id),
-    trade_id UUID REFERENCES trades(trade_id),
+    trade_id UUID, -- trades is keyed by (trade_id, matched_at), so no foreign key
     
     -- Metadata
     description TEXT,
     tx_hash VARCHAR(255), -- For blockchain compatibility
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     
     -- DAML compatibility
     contract_id VARCHAR(255),
-    ledger_offset BIGINT -- For Canton Ledger API compatibility
-);
+    ledger_offset BIGINT, -- For Canton Ledger API compatibility
+
+    PRIMARY KEY (transaction_id, created_at)
+) PARTITION BY RANGE (created_at);
 
 CREATE INDEX idx_transactions_account ON transactions(account_id);
-CREATE INDEX idx_transactions_party ON transactions(party_id);
+CREATE INDEX idx_transactions_party ON transactions(party_id, created_at DESC, transaction_id DESC);
 CREATE INDEX idx_transactions_type ON transactions(tx_type);
 CREATE INDEX idx_transactions_created ON transactions(created_at DESC);
 CREATE INDEX idx_transactions_asset ON transactions(asset_symbol);
@@ -236,6 +260,62 @@ CREATE TABLE IF NOT EXISTS market_data (
 
 CREATE INDEX idx_market_data_pair ON market_data(pair);
 
+-- ============================================
+-- CANDLES (Closed OHLCV bars per pair and resolution)
+-- ============================================
+CREATE TABLE IF NOT EXISTS candles (
+    pair VARCHAR(50) NOT NULL,
+    resolution VARCHAR(8) NOT NULL CHECK (resolution IN ('1s', '1m', '5m', '1h', '1d')),
+    open_time TIMESTAMP NOT NULL,
+
+    open DECIMAL(38, 18) NOT NULL,
+    high DECIMAL(38, 18) NOT NULL,
+    low DECIMAL(38, 18) NOT NULL,
+    close DECIMAL(38, 18) NOT NULL,
+    volume DECIMAL(38, 18) NOT NULL, -- Base quantity traded
+    trade_count INTEGER NOT NULL,
+
+    PRIMARY KEY (pair, resolution, open_time)
+);
+
+-- ============================================
+-- PAIR_LEASES (Which trading-service replica matches each pair)
+-- ============================================
+-- Only used with MATCHING_PAIR_LEASES enabled (trading-service/leases.py).
+-- A lease is held while expires_at is ahead of the database clock; replicas
+-- heartbeat in matching_replicas so the pairs can be shared out evenly.
+CREATE TABLE IF NOT EXISTS pair_leases (
+    pair VARCHAR(50) PRIMARY KEY,
+    owner VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matching_replicas (
+    replica_id VARCHAR(255) PRIMARY KEY,
+    heartbeat_at TIMESTAMP NOT NULL
+);
+
+-- ============================================
+-- EVENT_OUTBOX (Order and trade events awaiting Kafka)
+-- ============================================
+-- Only written with KAFKA_BOOTSTRAP_SERVERS set (trading-service/events.py).
+-- Rows go in with the order or fill that raised them and are deleted once
+-- trading-service/outbox.py has had them acknowledged, in (txid, event_id)
+-- order and only once no transaction that could still write before them is
+-- running.
+CREATE TABLE IF NOT EXISTS event_outbox (
+    event_id BIGSERIAL PRIMARY KEY,
+    -- Writing transaction; event_ids are handed out before commit, so they
+    -- can become visible out of order
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    topic VARCHAR(255) NOT NULL,
+    event_key VARCHAR(255) NOT NULL,
+    payload BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_event_outbox_txid ON event_outbox(txid, event_id);
+
 -- ============================================
 -- TRIGGERS (Auto-update timestamps)
 -- ============================================
@@ -258,6 +338,60 @@ CREATE TRIGGER update_balances_updated_at BEFORE UPDATE ON balances
 CREATE TRIGGER update_orders_updated_at BEFORE UPDATE ON orders
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Wake the matching engine on order entry, amendment and cancellation.
+-- Writers that hand their changes to the engine themselves (its own fill
+-- updates, order entry) set cantondex.writer and are not echoed back.
+-- updated_at is sent with all six fractional digits: JSON's own rendering
+-- drops trailing zeros, which Python before 3.11 cannot parse.
+CREATE OR REPLACE FUNCTION notify_order_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF coalesce(current_setting('cantondex.writer', true), '') = '' THEN
+        PERFORM pg_notify('order_changes', json_build_object(
+            'order_id', NEW.order_id, 'pair', NEW.pair,
+            'updated_at', to_char(NEW.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+        )::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_orders_changed AFTER INSERT OR UPDATE ON orders
+    FOR EACH ROW EXECUTE FUNCTION notify_order_change();
+
+-- ============================================
+-- PARTITION MAINTENANCE
+-- ============================================
+
+-- Create any missing monthly partitions of a table partitioned by range
+-- over a timestamp, from `months_back` months before the current month to
+-- `months_ahead` after it, returning the names created. There is no
+-- default partition, so rows outside every partition are rejected; the
+-- trading service calls this periodically (archival.py) to stay ahead.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(
+    parent TEXT, months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0
+)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    month TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) - make_interval(months => months_back);
+    last_month TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) + make_interval(months => months_ahead);
+    partition TEXT;
+BEGIN
+    WHILE month <= last_month LOOP
+        partition := parent || to_char(month, '"_y"YYYY"m"MM');
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           partition, parent, month, month + interval '1 month');
+            RETURN NEXT partition;
+        END IF;
+        month := month + interval '1 month';
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_monthly_partitions('trades', 3, 1);
+SELECT ensure_monthly_partitions('transactions', 3, 1);
+
 -- ============================================
 -- INITIAL DATA (For demo purposes)
 -- ============================================
@@ -0,0 +1,174 @@
+"""
+CantonDEX Partition Archival
+Creates monthly trade and transaction partitions ahead of time and moves old ones to compressed cold storage
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+from database import acquire, close_db_pool
+
+logger = logging.getLogger(__name__)
+
+# Tables range partitioned by month (see ensure_monthly_partitions in schema.sql)
+PARTITIONED_TABLES = ('trades', 'transactions')
+
+# Months of partitions kept ready beyond the current one
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "3600"))
+
+# Where archived partitions are written as gzipped CSV; archival is off when unset
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")
+# Whole months kept online before the current one
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+
+# Keeps service instances from maintaining partitions at the same time
+MAINTENANCE_LOCK_ID = 7_214_301
+
+# Partition names, e.g. trades_y2026m01; also valid as a PostgreSQL regex
+PARTITION_PATTERN = "^({})_y([0-9]{{4}})m([0-9]{{2}})$".format("|".join(PARTITIONED_TABLES))
+_PARTITION_NAME = re.compile(PARTITION_PATTERN)
+
+
+def partition_month(name: str) -> Optional[Tuple[str, date]]:
+    """The parent table and month of a partition named like trades_y2026m01"""
+    match = _PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    table, year, month = match.groups()
+    return table, date(int(year), int(month), 1)
+
+
+def archive_cutoff(today: date, months: int = ARCHIVE_AFTER_MONTHS) -> date:
+    """First day of the oldest month kept online"""
+    index = today.year * 12 + today.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def ensure_partitions(conn) -> List[str]:
+    """Create any missing partitions up to PARTITION_MONTHS_AHEAD, returning their names"""
+    created = []
+    for table in PARTITIONED_TABLES:
+        rows = await conn.fetch("SELECT ensure_monthly_partitions($1, $2)", table, PARTITION_MONTHS_AHEAD)
+        created += [row[0] for row in rows]
+    return created
+
+
+async def archivable_partitions(conn, cutoff: date) -> List[Tuple[str, str, str]]:
+    """
+    Month tables wholly before the cutoff, oldest first, as (parent, name, state).
+
+    State is 'attached', 'detaching' for a concurrent detach that was
+    interrupted, or 'detached' for a table detached by an earlier run that
+    did not get as far as archiving it.
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname, i.inhrelid IS NOT NULL AS attached, coalesce(i.inhdetachpending, false) AS pending
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.relkind = 'r' AND c.relnamespace = 'public'::regnamespace AND c.relname ~ $1
+    """, PARTITION_PATTERN)
+    found = []
+    for row in rows:
+        table, month = partition_month(row['relname'])
+        if month < cutoff:
+            state = 'detaching' if row['pending'] else 'attached' if row['attached'] else 'detached'
+            found.append((month, table, row['relname'], state))
+    return [(table, name, state) for _, table, name, state in sorted(found)]
+
+
+def _fsync_dir(path: str):
+    """Make a rename into `path` durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+async def archive_partition(conn, table: str, partition: str, state: str = 'attached') -> str:
+    """
+    Detach a partition, write it to ARCHIVE_DIR as gzipped CSV and drop it.
+
+    The detach is concurrent, so inserts into the parent are not blocked.
+    The file is written under a temporary name, synced, renamed into place
+    and the directory synced, and the table is dropped only after that, so
+    a crash never loses rows the archive does not hold. Every step can be
+    re-run after a crash. Returns the archive path.
+    """
+    if state == 'detaching':
+        await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}" FINALIZE')
+    elif state == 'attached':
+        # Cannot run inside a transaction block
+        await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}" CONCURRENTLY')
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{partition}.csv.gz")
+    partial = path + ".partial"
+    with open(partial, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            async def write(chunk):
+                # Compress off the event loop; the matching engine shares it
+                await asyncio.to_thread(archive.write, chunk)
+
+            result = await conn.copy_from_table(partition, output=write, format='csv', header=True)
+        # Closing the gzip stream writes its trailer, so sync after it
+        raw.flush()
+        await asyncio.to_thread(os.fsync, raw.fileno())
+    os.replace(partial, path)
+    _fsync_dir(ARCHIVE_DIR)
+
+    await conn.execute(f'DROP TABLE "{partition}"')
+    print(f"🗄️ Archived {partition} ({result.split()[-1]} rows) to {path}")
+    return path
+
+
+async def archive_old_partitions(conn, today: Optional[date] = None) -> List[str]:
+    """Archive every partition older than ARCHIVE_AFTER_MONTHS, returning the archive paths"""
+    cutoff = archive_cutoff(today or date.today())
+    return [
+        await archive_partition(conn, table, partition, state)
+        for table, partition, state in await archivable_partitions(conn, cutoff)
+    ]
+
+
+async def run_maintenance():
+    """One maintenance pass, skipped if another instance is already running one"""
+    async with acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MAINTENANCE_LOCK_ID):
+            return
+        try:
+            created = await ensure_partitions(conn)
+            if created:
+                print(f"🧱 Created partitions {', '.join(created)}")
+            if ARCHIVE_DIR:
+                await archive_old_partitions(conn)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_ID)
+
+
+async def run_maintenance_periodically():
+    """Run a maintenance pass every MAINTENANCE_INTERVAL seconds"""
+    while True:
+        try:
+            await run_maintenance()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+async def _main():
+    try:
+        await run_maintenance()
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    # One pass, for running from cron instead of the service
+    asyncio.run(_main())
@@ -0,0 +1,270 @@
+"""
+CantonDEX Cache
+Shared Redis cache for balances, open orders and ticker rows, invalidated by order and fill events
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+# Unset disables caching; memory:// keeps it in this process (FakeRedis),
+# which only suits a single replica
+REDIS_URL = os.getenv("REDIS_URL", "")
+# Backstop only: entries are invalidated by events, this just bounds how
+# long one survives a lost invalidation
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+
+KEY_PREFIX = "trading:"
+
+
+def balances_key(party_id: str) -> str:
+    return f"{KEY_PREFIX}balances:{party_id}"
+
+
+def open_orders_key(party_id: str) -> str:
+    return f"{KEY_PREFIX}open_orders:{party_id}"
+
+
+def ticker_key(pair: str) -> str:
+    return f"{KEY_PREFIX}ticker:{pair}"
+
+
+def party_keys(party_ids: Iterable[str]) -> List[str]:
+    """The keys an order or fill event touching these parties invalidates"""
+    keys = []
+    for party_id in set(party_ids):
+        keys += [balances_key(party_id), open_orders_key(party_id)]
+    return keys
+
+
+def fill_parties(fills) -> Set[str]:
+    """Both sides' parties of a batch of fills"""
+    return {fill.maker.party_id for fill in fills} | {fill.taker.party_id for fill in fills}
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the few redis.asyncio commands the cache uses,
+    for tests and for running without Redis
+    """
+
+    def __init__(self):
+        # key -> (value, expires at on the monotonic clock or None)
+        self._data: Dict[str, tuple] = {}
+
+    def _get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._get(key)
+
+    async def mget(self, *keys: str) -> List[Optional[bytes]]:
+        return [self._get(key) for key in keys]
+
+    async def set(self, key: str, value, ex: Optional[int] = None):
+        if isinstance(value, str):
+            value = value.encode()
+        self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def incr(self, key: str) -> int:
+        value = int(self._get(key) or 0) + 1
+        self._data[key] = (str(value).encode(), None)
+        return value
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class FakePipeline:
+    """Queues FakeRedis commands and runs them on execute()"""
+
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._commands = []
+
+    def incr(self, key: str) -> "FakePipeline":
+        self._commands.append((self._redis.incr, (key,)))
+        return self
+
+    async def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        return [await command(*args) for command, args in commands]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class CacheStats:
+    """Running totals of lookups, for /metrics/cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+
+class Cache:
+    """
+    Read-through cache of JSON-encodable values, invalidated explicitly.
+
+    Every key has a generation counter alongside it (`<key>:gen`), and an
+    entry is stored with the generation that was current before its value
+    was read from the database. Invalidating a key bumps the counter, so an
+    entry loaded from data older than the last invalidation never matches,
+    even if it is written after the invalidation. Invalidate only once the
+    change is committed, and load from the primary, never a replica.
+
+    Redis being unreachable costs the cache, not the request: lookups fall
+    through to the database and failed invalidations are logged.
+    """
+
+    def __init__(self, redis, ttl: int = CACHE_TTL):
+        self.redis = redis
+        self.ttl = ttl
+        self.stats = CacheStats()
+        # Keys invalidate_soon() has yet to send, and the task sending them
+        self._pending: Set[str] = set()
+        self._sender: Optional[asyncio.Task] = None
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable]):
+        """The cached value of `key`, or load()'s, which is then cached"""
+        try:
+            generation, entry = await self.redis.mget(f"{key}:gen", key)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"⚠️ Cache lookup failed: {e}")
+            return await load()
+        generation = int(generation or 0)
+        if entry is not None:
+            entry = json.loads(entry)
+            if entry['gen'] == generation:
+                self.stats.hits += 1
+                return entry['value']
+
+        self.stats.misses += 1
+        value = await load()
+        try:
+            await self.redis.set(key, json.dumps({'gen': generation, 'value': value}, default=str), ex=self.ttl)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"⚠️ Cache write failed: {e}")
+        return value
+
+    async def invalidate(self, keys: Iterable[str]):
+        """Invalidate keys now, in one round trip"""
+        keys = set(keys)
+        if not keys:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(f"{key}:gen")
+                await pipe.execute()
+            self.stats.invalidations += len(keys)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"⚠️ Cache invalidation failed for {len(keys)} key(s): {e}")
+
+    def invalidate_soon(self, keys: Iterable[str]):
+        """
+        Invalidate keys without waiting on Redis, for the matching engine's
+        hot path. Keys queued while a round trip is out go in the next one.
+        """
+        self._pending.update(keys)
+        if self._pending and (self._sender is None or self._sender.done()):
+            self._sender = asyncio.create_task(self._send_pending())
+
+    async def _send_pending(self):
+        while self._pending:
+            keys, self._pending = self._pending, set()
+            await self.invalidate(keys)
+
+    async def close(self):
+        if self._sender is not None:
+            await asyncio.gather(self._sender, return_exceptions=True)
+        await self.redis.aclose()
+
+
+def connect(url: str):
+    """A client for `url`: FakeRedis for memory://, redis.asyncio otherwise"""
+    if url.startswith("memory://"):
+        return FakeRedis()
+    # Only needed once a Redis URL is configured
+    import redis.asyncio
+    return redis.asyncio.from_url(url)
+
+
+# Global cache, created on first use; None while caching is off
+_cache: Optional[Cache] = None
+
+
+def get_cache() -> Optional[Cache]:
+    """The cache, or None if REDIS_URL is unset"""
+    global _cache
+    if _cache is None and REDIS_URL:
+        _cache = Cache(connect(REDIS_URL))
+        print(f"✅ Cache enabled ({REDIS_URL.split('@')[-1]})")
+    return _cache
+
+
+async def cached(key: str, load: Callable[[], Awaitable]):
+    """load()'s value, through the cache when there is one"""
+    cache = get_cache()
+    if cache is None:
+        return await load()
+    return await cache.get_or_load(key, load)
+
+
+async def invalidate(keys: Iterable[str]):
+    cache = get_cache()
+    if cache is not None:
+        await cache.invalidate(keys)
+
+
+def invalidate_soon(keys: Iterable[str]):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate_soon(keys)
+
+
+def cache_metrics() -> dict:
+    """Hit rate and invalidations since start"""
+    cache = _cache
+    if cache is None:
+        return {"status": "disabled" if not REDIS_URL else "not initialised"}
+    stats = cache.stats
+    lookups = stats.hits + stats.misses
+    return {
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "hit_rate": round(stats.hits / lookups, 4) if lookups else 0.0,
+        "invalidations": stats.invalidations,
+        "errors": stats.errors,
+    }
+
+
+async def close_cache():
+    """Send outstanding invalidations and close the connection, if one was opened"""
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        await cache.close()
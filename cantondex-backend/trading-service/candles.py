@@ -0,0 +1,320 @@
+"""
+CantonDEX Candles
+Aggregates fills into OHLCV bars in memory as they execute and persists the closed ones
+"""
+
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from database import acquire, acquire_read
+from instruments import get_pair_spec
+from order_book import Fill
+
+# Bar resolutions and their lengths
+RESOLUTIONS: Dict[str, timedelta] = {
+    '1s': timedelta(seconds=1),
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+}
+
+# Most recent bars kept in memory per pair and resolution; older ones are
+# served from the candles table
+CANDLE_MEMORY_BARS = int(os.getenv("CANDLE_MEMORY_BARS", "1000"))
+
+# Bars are aligned to whole multiples of their length since this
+EPOCH = datetime(1970, 1, 1)
+
+# Rebuilds bars from trades newer than the last bar a pair has persisted;
+# the rows of one batch share matched_at, and trade_seq keeps them in
+# execution order
+REBUILD_SQL = """
+    SELECT t.pair,
+           date_bin($1::interval, t.matched_at, $2) AS open_time,
+           (array_agg(t.price ORDER BY t.matched_at, t.trade_seq))[1] AS open,
+           max(t.price) AS high,
+           min(t.price) AS low,
+           (array_agg(t.price ORDER BY t.matched_at DESC, t.trade_seq DESC))[1] AS close,
+           sum(t.quantity) AS volume,
+           count(*) AS trade_count
+    FROM trades t
+    LEFT JOIN (
+        SELECT pair, max(open_time) + $1::interval AS done
+        FROM candles WHERE resolution = $3
+        GROUP BY pair
+    ) c ON c.pair = t.pair
+    WHERE t.matched_at >= $4 AND (c.done IS NULL OR t.matched_at >= c.done)
+      AND ($5::varchar[] IS NULL OR t.pair = ANY($5))
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+CANDLES_SQL = """
+    SELECT open_time, open, high, low, close, volume, trade_count
+    FROM candles
+    WHERE pair = $1 AND resolution = $2 AND open_time >= $3 AND open_time < $4
+    ORDER BY open_time DESC
+    LIMIT $5
+"""
+
+
+def bar_open_time(at: datetime, length: timedelta) -> datetime:
+    """Start of the bar of `length` that `at` falls into"""
+    return EPOCH + (at - EPOCH) // length * length
+
+
+class Bar:
+    """One OHLCV bar, in the pair's ticks and lots"""
+
+    __slots__ = ("open_time", "close_time", "open", "high", "low", "close", "volume", "trade_count", "dirty")
+
+    def __init__(self, open_time: datetime, length: timedelta, price: int):
+        self.open_time = open_time
+        self.close_time = open_time + length
+        self.open = self.high = self.low = self.close = price
+        self.volume = 0
+        self.trade_count = 0
+        # Changed since last written to the candles table
+        self.dirty = False
+
+    @classmethod
+    def from_record(cls, record, length: timedelta, spec) -> "Bar":
+        """Build a bar from a row of candle columns, scaled by the pair's spec"""
+        bar = cls(record['open_time'], length, spec.to_ticks(record['open']))
+        bar.high = spec.to_ticks(record['high'])
+        bar.low = spec.to_ticks(record['low'])
+        bar.close = spec.to_ticks(record['close'])
+        bar.volume = spec.to_lots(record['volume'])
+        bar.trade_count = record['trade_count']
+        return bar
+
+    def add(self, high: int, low: int, close: int, volume: int, trade_count: int):
+        """Fold in a run of trades, taken to be the bar's latest"""
+        if high > self.high:
+            self.high = high
+        if low < self.low:
+            self.low = low
+        self.close = close
+        self.volume += volume
+        self.trade_count += trade_count
+
+    def to_dict(self, spec) -> dict:
+        return {
+            'open_time': self.open_time,
+            'open': str(spec.price(self.open)),
+            'high': str(spec.price(self.high)),
+            'low': str(spec.price(self.low)),
+            'close': str(spec.price(self.close)),
+            'volume': str(spec.quantity(self.volume)),
+            'trade_count': self.trade_count,
+        }
+
+
+class CandleBuilder:
+    """
+    Bars of every resolution for each pair, built from fills as the engine
+    persists them.
+
+    Each pair and resolution keeps its most recent CANDLE_MEMORY_BARS bars,
+    which are complete from the oldest one on; anything older is read back
+    from the candles table. Bars are written there once closed, and again if
+    a late batch changes them, so the table never holds a bar still open.
+    """
+
+    def __init__(self, memory_bars: int = CANDLE_MEMORY_BARS):
+        self._memory_bars = memory_bars
+        # pair -> resolution -> bars, oldest first
+        self._series: Dict[str, Dict[str, Deque[Bar]]] = {}
+        # Bars changed since they were last written, as (pair, resolution, bar)
+        self._dirty: List[Tuple[str, str, Bar]] = []
+        # pair -> its newest bar of each resolution, finest first
+        self._newest: Dict[str, List[Tuple[str, Bar]]] = {}
+
+    def series(self, pair: str, resolution: str) -> Deque[Bar]:
+        """A pair's bars of one resolution, oldest first"""
+        return self._series.get(pair, {}).get(resolution, ())
+
+    def _pair_series(self, pair: str) -> Dict[str, Deque[Bar]]:
+        series = self._series.get(pair)
+        if series is None:
+            series = self._series[pair] = {
+                resolution: deque(maxlen=self._memory_bars) for resolution in RESOLUTIONS
+            }
+        return series
+
+    def _mark_dirty(self, pair: str, resolution: str, bar: Bar):
+        if not bar.dirty:
+            bar.dirty = True
+            self._dirty.append((pair, resolution, bar))
+
+    @staticmethod
+    def _bar(series: Deque[Bar], open_time: datetime, length: timedelta, price: int) -> Optional[Bar]:
+        if not series or series[-1].open_time < open_time:
+            bar = Bar(open_time, length, price)
+            series.append(bar)
+            return bar
+        # A batch stamped before the newest bar began; rare, so search
+        for index in range(len(series) - 1, -1, -1):
+            if series[index].open_time == open_time:
+                return series[index]
+            if series[index].open_time < open_time:
+                break
+        else:
+            index = -1
+        bar = Bar(open_time, length, price)
+        if len(series) == series.maxlen:
+            if index < 0:
+                # Older than everything kept, and the table's copy cannot be
+                # updated without the rest of the bar
+                return None
+            series.popleft()
+            index -= 1
+        series.insert(index + 1, bar)
+        return bar
+
+    def add(self, fills: List[Fill], matched_at: datetime):
+        """Add a persisted batch of fills, all of one pair and stamped `matched_at`"""
+        if not fills:
+            return
+        pair = fills[0].pair
+        # The batch once, then folded into each resolution's bar
+        prices = [fill.price for fill in fills]
+        high, low = max(prices), min(prices)
+        volume = sum(fill.quantity for fill in fills)
+
+        # Resolutions nest, so a batch inside the newest 1s bar is inside
+        # the newest bar of every resolution
+        newest = self._newest.get(pair)
+        if newest and newest[0][1].open_time <= matched_at < newest[0][1].close_time:
+            for resolution, bar in newest:
+                bar.add(high, low, prices[-1], volume, len(prices))
+                if not bar.dirty:
+                    self._mark_dirty(pair, resolution, bar)
+            return
+
+        pair_series = self._pair_series(pair)
+        for resolution, series in pair_series.items():
+            bar = series[-1] if series else None
+            if bar is None or not bar.open_time <= matched_at < bar.close_time:
+                length = RESOLUTIONS[resolution]
+                bar = self._bar(series, bar_open_time(matched_at, length), length, prices[0])
+                if bar is None:
+                    continue
+            bar.add(high, low, prices[-1], volume, len(prices))
+            if not bar.dirty:
+                self._mark_dirty(pair, resolution, bar)
+        self._newest[pair] = [(resolution, series[-1]) for resolution, series in pair_series.items() if series]
+
+    async def load(self, conn, pairs: Optional[Set[str]] = None):
+        """
+        Rebuild the bars the candles table does not have yet from trades,
+        of every pair or only of `pairs`
+        """
+        now = await conn.fetchval("SELECT LOCALTIMESTAMP")
+        if pairs is None:
+            self._series = {}
+            self._dirty = []
+            self._newest = {}
+        else:
+            for pair in pairs:
+                self.drop(pair)
+        for resolution, length in RESOLUTIONS.items():
+            # As many bars as memory keeps, the open one included
+            since = bar_open_time(now, length) - length * (self._memory_bars - 1)
+            rows = await conn.fetch(REBUILD_SQL, length, EPOCH, resolution, since,
+                                    None if pairs is None else list(pairs))
+            for row in rows:
+                bar = Bar.from_record(row, length, get_pair_spec(row['pair']))
+                self._pair_series(row['pair'])[resolution].append(bar)
+                self._mark_dirty(row['pair'], resolution, bar)
+
+    def drop(self, pair: str):
+        """Forget a pair's bars, written or not"""
+        self._series.pop(pair, None)
+        self._newest.pop(pair, None)
+        self._dirty = [entry for entry in self._dirty if entry[0] != pair]
+
+    async def flush(self, conn=None) -> int:
+        """Write every changed bar that has closed, returning how many"""
+        if not self._dirty:
+            return 0
+        if conn is None:
+            async with acquire() as conn:
+                return await self._write_closed(conn)
+        return await self._write_closed(conn)
+
+    async def _write_closed(self, conn) -> int:
+        now = await conn.fetchval("SELECT LOCALTIMESTAMP")
+        closed = [entry for entry in self._dirty if entry[2].close_time <= now]
+        if not closed:
+            return 0
+        self._dirty = [entry for entry in self._dirty if entry[2].close_time > now]
+        # Taken now: a late batch may change a bar while it is being written
+        rows = []
+        for pair, resolution, bar in closed:
+            bar.dirty = False
+            rows.append((pair, resolution, bar.to_dict(get_pair_spec(pair))))
+        try:
+            await conn.execute("""
+                INSERT INTO candles (pair, resolution, open_time, open, high, low, close, volume, trade_count)
+                SELECT * FROM unnest(
+                    $1::varchar[], $2::varchar[], $3::timestamp[], $4::numeric[], $5::numeric[],
+                    $6::numeric[], $7::numeric[], $8::numeric[], $9::int[]
+                )
+                ON CONFLICT (pair, resolution, open_time) DO UPDATE
+                SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+                    close = EXCLUDED.close, volume = EXCLUDED.volume, trade_count = EXCLUDED.trade_count
+            """,
+                [pair for pair, _, _ in rows],
+                [resolution for _, resolution, _ in rows],
+                *([bar[column] for _, _, bar in rows]
+                  for column in ('open_time', 'open', 'high', 'low', 'close', 'volume', 'trade_count')),
+            )
+        except Exception:
+            for pair, resolution, bar in closed:
+                self._mark_dirty(pair, resolution, bar)
+            raise
+        return len(rows)
+
+
+def _naive_utc(at: Optional[datetime]) -> Optional[datetime]:
+    if at is None or at.tzinfo is None:
+        return at
+    return at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def fetch_candles(builder: CandleBuilder, pair: str, resolution: str,
+                        start: Optional[datetime], end: Optional[datetime], limit: int) -> List[dict]:
+    """
+    The latest `limit` bars opening in [start, end), oldest first.
+
+    Served from memory as far as it reaches back; only the part before the
+    oldest bar in memory is read from the candles table.
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    spec = get_pair_spec(pair)
+    series = builder.series(pair, resolution)
+
+    recent = []
+    for bar in reversed(series):
+        if len(recent) == limit or (start is not None and bar.open_time < start):
+            break
+        if end is None or bar.open_time < end:
+            recent.append(bar.to_dict(spec))
+
+    older = []
+    if len(recent) < limit:
+        before = series[0].open_time if series else None
+        if end is not None and (before is None or end < before):
+            before = end
+        if before is None or start is None or start < before:
+            async with acquire_read() as conn:
+                rows = await conn.fetch(
+                    CANDLES_SQL, pair, resolution, start or EPOCH, before or datetime.max, limit - len(recent)
+                )
+            length = RESOLUTIONS[resolution]
+            older = [Bar.from_record(row, length, spec).to_dict(spec) for row in rows]
+    return older[::-1] + recent[::-1]
@@ -1,30 +1,306 @@
 import os
+import asyncio
+import time
+import weakref
 import asyncpg
 from contextlib import asynccontextmanager
+from typing import Optional, Set
 
-# Global pool variable
+# Pool tuning
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+# Per-connection LRU of implicitly prepared statements; 0 disables it (e.g. behind pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Idle connections are closed after this long; 0 keeps them forever
+DB_POOL_MAX_INACTIVE_SECONDS = float(os.getenv("DB_POOL_MAX_INACTIVE_SECONDS", "300"))
+# How long shutdown waits for connections to be released before closing them anyway
+DB_POOL_CLOSE_TIMEOUT = float(os.getenv("DB_POOL_CLOSE_TIMEOUT", "10"))
+
+# Read replica for replica-safe reads; unset, they run on the primary as before
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", "5432")
+DB_REPLICA_POOL_MIN_SIZE = int(os.getenv("DB_REPLICA_POOL_MIN_SIZE", "2"))
+DB_REPLICA_POOL_MAX_SIZE = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", "20"))
+# Reads go to the primary while the replica is further behind than this
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+# How often the replica's lag is looked up
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "1"))
+# Primary connections replica-safe reads may hold at once while they fall
+# back, so reporting cannot crowd out the matching engine
+DB_REPLICA_FALLBACK_CONNECTIONS = int(os.getenv("DB_REPLICA_FALLBACK_CONNECTIONS", "4"))
+
+# Global pool variables
 db_pool = None
+replica_pool = None
+_pool_lock = asyncio.Lock()
+_replica_lock = asyncio.Lock()
+_fallback_slots = asyncio.Semaphore(DB_REPLICA_FALLBACK_CONNECTIONS)
+
+# Seconds of WAL the replica has yet to replay; nothing pending counts as
+# none however old the last replayed commit, and a primary is never behind
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity')
+    END
+"""
+
+# Queries every pooled connection prepares as it opens
+HOT_QUERIES: Set[str] = set()
+
+# Open pooled connections, for the per-connection query counts
+_connections = weakref.WeakSet()
+
+
+class PoolStats:
+    """Running totals of waits to acquire a pooled connection"""
+
+    def __init__(self):
+        self.acquires = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.acquires += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+pool_stats = PoolStats()
+replica_stats = PoolStats()
+
+
+class ReplicaLag:
+    """The replica's last looked-up lag, and how many reads fell back to the primary"""
+
+    def __init__(self):
+        # None until looked up, and while the replica cannot be reached
+        self.seconds: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.fallbacks = 0
+        self._lock = asyncio.Lock()
+
+    def due(self) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at >= DB_REPLICA_LAG_CHECK_SECONDS
+
+    def usable(self) -> bool:
+        return self.seconds is not None and self.seconds <= DB_REPLICA_MAX_LAG_SECONDS
+
+    async def _lookup(self) -> float:
+        pool = await get_replica_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval(REPLICA_LAG_SQL)
+
+    async def refresh(self):
+        """
+        Look the lag up again if it is due. One caller does; the others go
+        by the last answer rather than wait on a replica that may be hanging.
+        """
+        if self._lock.locked():
+            return
+        async with self._lock:
+            if not self.due():
+                return
+            try:
+                # A replica that cannot answer within the lag allowed is no use
+                self.seconds = await asyncio.wait_for(self._lookup(), DB_REPLICA_MAX_LAG_SECONDS)
+            except Exception as e:
+                if self.seconds is not None or self.checked_at is None:
+                    print(f"⚠️ Read replica unavailable, reading from the primary: {e}")
+                self.seconds = None
+            self.checked_at = time.monotonic()
+
+
+replica_lag = ReplicaLag()
+
+
+class TradingConnection(asyncpg.Connection):
+    """A connection that counts the queries run on it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_count = 0
+
+    def _count_query(self, record):
+        self.query_count += 1
+
+
+def prepare_on_connect(*queries: str):
+    """Have every pooled connection prepare these queries as it opens"""
+    HOT_QUERIES.update(queries)
+
+
+async def init_connection(conn: TradingConnection):
+    """
+    Set up a new pooled connection.
+
+    Preparing the hot queries checks them against the schema and loads the
+    codecs for their types, so the first conn.fetch of each on the hot path
+    costs a parse but no type introspection. The statements themselves are
+    tied to one pool checkout and are dropped here; asyncpg's statement
+    cache keeps them from the first run on.
+    """
+    conn.add_query_logger(conn._count_query)
+    if DB_STATEMENT_CACHE_SIZE:
+        for query in HOT_QUERIES:
+            await conn.prepare(query)
+    _connections.add(conn)
+
 
 async def get_db_pool():
     """Get or create the database connection pool"""
     global db_pool
-    if db_pool is None:
-        try:
-            db_pool = await asyncpg.create_pool(
+    if db_pool is not None:
+        return db_pool
+    async with _pool_lock:
+        # Another task may have created it while this one waited
+        if db_pool is None:
+            try:
+                db_pool = await asyncpg.create_pool(
+                    user=os.getenv("DB_USER", "cantondex"),
+                    password=os.getenv("DB_PASSWORD", "cantondex"),
+                    database=os.getenv("DB_NAME", "cantondex"),
+                    host=os.getenv("DB_HOST", "localhost"),
+                    port=os.getenv("DB_PORT", "5432"),
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_SECONDS,
+                    connection_class=TradingConnection,
+                    init=init_connection
+                )
+                print(f"✅ Database connection pool created ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+            except Exception as e:
+                print(f"❌ Failed to create database pool: {e}")
+                raise e
+    return db_pool
+
+
+async def get_replica_pool():
+    """Get or create the read replica's connection pool"""
+    global replica_pool
+    if replica_pool is not None:
+        return replica_pool
+    async with _replica_lock:
+        if replica_pool is None:
+            # No init: the hot queries are the primary's, mostly writes
+            replica_pool = await asyncpg.create_pool(
                 user=os.getenv("DB_USER", "cantondex"),
                 password=os.getenv("DB_PASSWORD", "cantondex"),
                 database=os.getenv("DB_NAME", "cantondex"),
-                host=os.getenv("DB_HOST", "localhost"),
-                port=os.getenv("DB_PORT", "5432")
+                host=DB_REPLICA_HOST,
+                port=DB_REPLICA_PORT,
+                min_size=DB_REPLICA_POOL_MIN_SIZE,
+                max_size=DB_REPLICA_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_SECONDS
             )
-            print("✅ Database connection pool created")
-        except Exception as e:
-            print(f"❌ Failed to create database pool: {e}")
-            raise e
-    return db_pool
+            print(f"✅ Read replica pool created ({DB_REPLICA_POOL_MIN_SIZE}-{DB_REPLICA_POOL_MAX_SIZE} connections)")
+    return replica_pool
 
-async def get_db():
-    """Dependency to get a database connection from the pool"""
+
+@asynccontextmanager
+async def acquire():
+    """A pooled connection, recording how long it took to get"""
     pool = await get_db_pool()
+    started = time.perf_counter()
     async with pool.acquire() as conn:
+        pool_stats.record(time.perf_counter() - started)
+        yield conn
+
+
+@asynccontextmanager
+async def acquire_read():
+    """
+    A connection for a replica-safe read: one that tolerates data up to
+    DB_REPLICA_MAX_LAG_SECONDS old and never writes.
+
+    Served by the read replica when one is configured and keeping up.
+    Otherwise it falls back to the primary, holding at most
+    DB_REPLICA_FALLBACK_CONNECTIONS of its connections at once. With no
+    replica configured this is plain acquire().
+    """
+    if not DB_REPLICA_HOST:
+        async with acquire() as conn:
+            yield conn
+        return
+
+    if replica_lag.due():
+        await replica_lag.refresh()
+    if replica_lag.usable():
+        started = time.perf_counter()
+        async with replica_pool.acquire() as conn:
+            replica_stats.record(time.perf_counter() - started)
+            yield conn
+        return
+
+    replica_lag.fallbacks += 1
+    async with _fallback_slots:
+        async with acquire() as conn:
+            yield conn
+
+
+def _occupancy(pool, stats: PoolStats) -> dict:
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "acquires": stats.acquires,
+        "acquire_wait_avg_ms": round(stats.wait_total / stats.acquires * 1000, 3) if stats.acquires else 0.0,
+        "acquire_wait_max_ms": round(stats.wait_max * 1000, 3),
+    }
+
+
+def pool_metrics() -> dict:
+    """Pool occupancy, acquire waits and queries run per open connection, and the replica's"""
+    pool = db_pool
+    if pool is None:
+        return {"status": "not initialised"}
+    metrics = _occupancy(pool, pool_stats)
+    metrics["queries_per_connection"] = {
+        conn.get_server_pid(): conn.query_count for conn in list(_connections) if not conn.is_closed()
+    }
+    if DB_REPLICA_HOST:
+        replica = _occupancy(replica_pool, replica_stats) if replica_pool is not None else {}
+        metrics["replica"] = {
+            **replica,
+            "lag_seconds": replica_lag.seconds,
+            "usable": replica_lag.usable(),
+            "fallbacks": replica_lag.fallbacks,
+        }
+    return metrics
+
+
+async def _close(pool):
+    try:
+        await asyncio.wait_for(pool.close(), timeout=DB_POOL_CLOSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        print("⚠️ Connections still in use at shutdown; terminating the pool")
+        pool.terminate()
+
+
+async def close_db_pool():
+    """Close the pools, if they were created"""
+    global db_pool, replica_pool
+    pools = [pool for pool in (db_pool, replica_pool) if pool is not None]
+    db_pool = replica_pool = None
+    replica_lag.seconds = replica_lag.checked_at = None
+    for pool in pools:
+        await _close(pool)
+
+
+async def get_db():
+    """Dependency to get a database connection from the pool"""
+    async with acquire() as conn:
+        yield conn
+
+
+async def get_read_db():
+    """Dependency to get a connection for a replica-safe read"""
+    async with acquire_read() as conn:
         yield conn
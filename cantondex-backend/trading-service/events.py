@@ -0,0 +1,214 @@
+"""
+CantonDEX Events
+Encodes order and trade events with the Avro schemas and writes them to the outbox with the change that raised them
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import prepare_on_connect
+from instruments import get_pair_spec
+
+# Unset turns events off: nothing is written to the outbox or published.
+# memory:// publishes to an in-process broker (see outbox.py)
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "")
+EVENTS_ENABLED = bool(KAFKA_BOOTSTRAP_SERVERS)
+
+KAFKA_TOPIC_ORDERS = os.getenv("KAFKA_TOPIC_ORDERS", "cantondex.orders")
+KAFKA_TOPIC_TRADES = os.getenv("KAFKA_TOPIC_TRADES", "cantondex.trades")
+
+# Where order-event-schema.json and trade-event-schema.json live
+EVENT_SCHEMA_DIR = os.getenv("EVENT_SCHEMA_DIR", os.path.join(os.path.dirname(__file__), ".."))
+
+# Columns of an orders row that an order event is built from; statements
+# that raise order events return them
+ORDER_EVENT_COLUMNS = (
+    'order_id', 'account_id', 'pair', 'side', 'order_type', 'price',
+    'quantity', 'filled_quantity', 'status', 'time_in_force',
+)
+
+INSERT_EVENTS_SQL = """
+    INSERT INTO event_outbox (topic, event_key, payload)
+    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::bytea[])
+"""
+
+# (topic, key, Avro-encoded event)
+Event = Tuple[str, str, bytes]
+
+
+def _write_long(out: bytearray, value: int):
+    # Zig-zag, then base-128 varint, least significant group first
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_long(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return (value >> 1) ^ -(value & 1), pos
+
+
+class EventSchema:
+    """
+    An Avro record schema, for the field types the event schemas use:
+    string, long, boolean and enum.
+
+    Records are encoded in Avro's binary encoding without a container or
+    registry header, so consumers decode them with the same schema file.
+    """
+
+    def __init__(self, schema: dict):
+        self.name = schema['name']
+        self.fields: List[Tuple[str, str, Optional[List[str]]]] = []
+        for field in schema['fields']:
+            kind = field['type']
+            if isinstance(kind, dict) and kind.get('type') == 'enum':
+                self.fields.append((field['name'], 'enum', kind['symbols']))
+            elif kind in ('string', 'long', 'boolean'):
+                self.fields.append((field['name'], kind, None))
+            else:
+                raise ValueError(f"{self.name}.{field['name']}: unsupported type {kind!r}")
+        self._symbols = {name: {s: i for i, s in enumerate(symbols)}
+                         for name, kind, symbols in self.fields if kind == 'enum'}
+
+    @classmethod
+    def load(cls, filename: str) -> "EventSchema":
+        with open(os.path.join(EVENT_SCHEMA_DIR, filename)) as f:
+            return cls(json.load(f))
+
+    def encode(self, record: dict) -> bytes:
+        out = bytearray()
+        for name, kind, _ in self.fields:
+            value = record[name]
+            if kind == 'string':
+                encoded = value.encode()
+                _write_long(out, len(encoded))
+                out += encoded
+            elif kind == 'long':
+                _write_long(out, value)
+            elif kind == 'boolean':
+                out.append(1 if value else 0)
+            else:
+                try:
+                    _write_long(out, self._symbols[name][value])
+                except KeyError:
+                    raise ValueError(f"{self.name}.{name}: {value!r} is not a symbol") from None
+        return bytes(out)
+
+    def decode(self, data: bytes) -> dict:
+        record, pos = {}, 0
+        for name, kind, symbols in self.fields:
+            if kind == 'boolean':
+                record[name] = data[pos] == 1
+                pos += 1
+                continue
+            value, pos = _read_long(data, pos)
+            if kind == 'string':
+                record[name] = data[pos:pos + value].decode()
+                pos += value
+            elif kind == 'enum':
+                record[name] = symbols[value]
+            else:
+                record[name] = value
+        return record
+
+
+_schemas: Dict[str, EventSchema] = {}
+
+
+def schema(filename: str) -> EventSchema:
+    """A schema file from EVENT_SCHEMA_DIR, parsed once"""
+    if filename not in _schemas:
+        _schemas[filename] = EventSchema.load(filename)
+    return _schemas[filename]
+
+
+def _millis(at: Optional[datetime] = None) -> int:
+    if at is None:
+        return int(time.time() * 1000)
+    # Database timestamps are naive UTC
+    return int(at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _amount(value: Optional[Decimal], step: Decimal) -> str:
+    return "" if value is None else format(value.quantize(step), "f")
+
+
+def order_event(event_type: str, row) -> Event:
+    """An OrderEvent for an orders row as it stands after the change, keyed by pair"""
+    spec = get_pair_spec(row['pair'])
+    record = {
+        'event_id': str(uuid.uuid4()),
+        'event_type': event_type,
+        'timestamp': _millis(),
+        'order_id': str(row['order_id']),
+        'account_id': str(row['account_id']),
+        'trading_pair': row['pair'],
+        'side': row['side'].capitalize(),
+        'order_type': row['order_type'].capitalize(),
+        'price': _amount(row['price'], spec.tick_size),
+        'quantity': _amount(row['quantity'], spec.lot_size),
+        'filled_quantity': _amount(row['filled_quantity'], spec.lot_size),
+        'status': row['status'],
+        'time_in_force': row['time_in_force'] or "",
+    }
+    return KAFKA_TOPIC_ORDERS, row['pair'], schema('order-event-schema.json').encode(record)
+
+
+def order_events(event_type: str, rows) -> List[Event]:
+    return [order_event(event_type, row) for row in rows]
+
+
+def trade_events(fills, matched_at: datetime) -> List[Event]:
+    """A TradeEvent per fill of a persisted batch, keyed by pair"""
+    if not fills:
+        return []
+    encode = schema('trade-event-schema.json').encode
+    spec = get_pair_spec(fills[0].pair)
+    now, traded = _millis(), _millis(matched_at)
+    events = []
+    for fill in fills:
+        buyer, seller = fill.buyer, fill.seller
+        events.append((KAFKA_TOPIC_TRADES, fill.pair, encode({
+            'event_id': str(uuid.uuid4()),
+            'event_type': 'TradeExecuted',
+            'timestamp': now,
+            'trade_id': str(fill.trade_id),
+            'trading_pair': fill.pair,
+            'buy_order_id': str(buyer.order_id),
+            'sell_order_id': str(seller.order_id),
+            'buyer_account_id': str(buyer.account_id),
+            'seller_account_id': str(seller.account_id),
+            'price': str(spec.price(fill.price)),
+            'quantity': str(spec.quantity(fill.quantity)),
+            'trade_timestamp': traded,
+            'settlement_required': True,
+        })))
+    return events
+
+
+async def write_events(conn, events: Iterable[Event]):
+    """Add events to the outbox, in the caller's transaction; a no-op with events off"""
+    if not EVENTS_ENABLED:
+        return
+    events = list(events)
+    if not events:
+        return
+    await conn.execute(INSERT_EVENTS_SQL, *(list(column) for column in zip(*events)))
+
+
+if EVENTS_ENABLED:
+    prepare_on_connect(INSERT_EVENTS_SQL)
@@ -0,0 +1,153 @@
+"""
+CantonDEX History
+Keyset-paginated and streamed order, trade and transaction history per party
+"""
+
+import json
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from database import acquire_read
+
+# Rows fetched per round trip while streaming an export
+EXPORT_PREFETCH = 1000
+
+
+@dataclass(frozen=True)
+class HistorySource:
+    """
+    A table read newest first by (time column, id column).
+
+    Each entry in `party_columns` is scanned separately with its own index on
+    (party column, time, id); a row matching several of them is only
+    returned by the first.
+    """
+
+    table: str
+    columns: str
+    time_column: str
+    id_column: str
+    party_columns: Tuple[str, ...]
+
+
+SOURCES: Dict[str, HistorySource] = {
+    'orders': HistorySource(
+        'orders',
+        "order_id, account_id, pair, side, order_type, time_in_force, quantity, price, stop_price, "
+        "display_quantity, filled_quantity, status, created_at, updated_at",
+        'created_at', 'order_id', ('party_id',),
+    ),
+    'trades': HistorySource(
+        'trades',
+        "trade_id, pair, price, quantity, maker_order_id, taker_order_id, maker_party_id, "
+        "taker_party_id, maker_side, settlement_status, matched_at, executed_at",
+        'matched_at', 'trade_id', ('maker_party_id', 'taker_party_id'),
+    ),
+    'transactions': HistorySource(
+        'transactions',
+        "transaction_id, account_id, tx_type, asset_symbol, amount, balance_after, order_id, "
+        "trade_id, description, created_at",
+        'created_at', 'transaction_id', ('party_id',),
+    ),
+}
+
+
+def parse_cursor(after: str) -> Tuple[datetime, uuid.UUID]:
+    """Split an `after` cursor of the form '<timestamp>,<id>'"""
+    try:
+        timestamp, _, row_id = after.partition(',')
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor {after!r}; expected '<timestamp>,<id>'")
+
+
+def make_cursor(source: HistorySource, row) -> str:
+    return f"{row[source.time_column].isoformat()},{row[source.id_column]}"
+
+
+def build_query(source: HistorySource, party_id: str, after: Optional[str] = None,
+                status: Optional[str] = None, limit: Optional[int] = None) -> Tuple[str, List]:
+    """
+    Query and arguments for a party's rows newest first, optionally only
+    those before an `after` cursor, with a status, or at most `limit` rows.
+
+    Every branch is a range scan of its (party, time, id) index, so a page
+    costs the same however deep into the history it starts.
+    """
+    args: List = [party_id]
+    filters = []
+    if after is not None:
+        args += parse_cursor(after)
+        filters.append(f"({source.time_column}, {source.id_column}) < ($2, $3)")
+    if status is not None:
+        args.append(status)
+        filters.append(f"status = ${len(args)}")
+    limit_clause = ""
+    if limit is not None:
+        args.append(limit)
+        limit_clause = f" LIMIT ${len(args)}"
+
+    order = f"ORDER BY {source.time_column} DESC, {source.id_column} DESC"
+    branches = []
+    for i, party_column in enumerate(source.party_columns):
+        # Skip rows already returned by an earlier branch
+        conditions = [f"{party_column} = $1"] + [f"{c} <> $1" for c in source.party_columns[:i]] + filters
+        branches.append(
+            f"SELECT {source.columns} FROM {source.table} "
+            f"WHERE {' AND '.join(conditions)} {order}{limit_clause}"
+        )
+    if len(branches) == 1:
+        return branches[0], args
+    union = " UNION ALL ".join(f"({branch})" for branch in branches)
+    return f"SELECT * FROM ({union}) h {order}{limit_clause}", args
+
+
+def encode_row(row) -> dict:
+    """A history row as JSON-safe values, keeping decimals exact as strings"""
+    values = {}
+    for key, value in row.items():
+        if isinstance(value, (Decimal, uuid.UUID)):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        values[key] = value
+    return values
+
+
+async def fetch_page(conn, kind: str, party_id: str, after: Optional[str] = None,
+                     limit: int = 100, status: Optional[str] = None) -> dict:
+    """
+    One page of a party's history, newest first.
+
+    `next` is the cursor to pass as `after` for the following page, or None
+    once the history is exhausted.
+    """
+    source = SOURCES[kind]
+    query, args = build_query(source, party_id, after, status, limit + 1)
+    rows = await conn.fetch(query, *args)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'items': [encode_row(row) for row in rows],
+        'next': make_cursor(source, rows[-1]) if more else None,
+    }
+
+
+async def export_rows(kind: str, party_id: str, after: Optional[str] = None,
+                      status: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Stream a party's whole history as NDJSON, newest first.
+
+    Reads through a server-side cursor in EXPORT_PREFETCH-row chunks, so
+    only one chunk is ever held in memory. Holds its own connection, on the
+    read replica when it is keeping up, until the stream ends.
+    """
+    query, args = build_query(SOURCES[kind], party_id, after, status)
+    async with acquire_read() as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            async for row in conn.cursor(query, *args, prefetch=EXPORT_PREFETCH):
+                yield (json.dumps(encode_row(row)) + "\n").encode()
+
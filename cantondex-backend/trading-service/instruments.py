@@ -0,0 +1,86 @@
+"""
+CantonDEX Instruments
+Per-pair tick and lot sizes used to scale prices and quantities to integers
+"""
+
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict
+
+
+@dataclass(frozen=True)
+class PairSpec:
+    """
+    Tick and lot size for one trading pair.
+
+    The matching engine holds prices as a number of ticks and quantities as
+    a number of lots, so the match loop only compares and subtracts plain
+    integers. Decimal values exist only at the API and database edges.
+    """
+
+    pair: str
+    tick_size: Decimal
+    lot_size: Decimal
+
+    def to_ticks(self, price) -> int:
+        return _scale(price, self.tick_size, f"{self.pair} price")
+
+    def to_lots(self, quantity) -> int:
+        return _scale(quantity, self.lot_size, f"{self.pair} quantity")
+
+    def price(self, ticks: int) -> Decimal:
+        return ticks * self.tick_size
+
+    def quantity(self, lots: int) -> Decimal:
+        return lots * self.lot_size
+
+    def to_cost(self, amount) -> int:
+        """A quote amount as ticks times lots, the unit a price times a quantity comes in"""
+        return _scale(amount, self.tick_size * self.lot_size, f"{self.pair} cost")
+
+    def cost(self, units: int) -> Decimal:
+        return units * self.tick_size * self.lot_size
+
+
+# Ticks, lots and costs are journaled as signed 64-bit integers
+MAX_UNITS = 2 ** 63 - 1
+
+
+def _scale(value, unit: Decimal, what: str) -> int:
+    """Express `value` as a whole number of `unit`, refusing to round"""
+    if isinstance(value, float):
+        value = str(value)
+    value = Decimal(value)
+    if abs(value) > MAX_UNITS * unit:
+        raise ValueError(f"{what} {value} is too large")
+    units, remainder = divmod(value, unit)
+    if remainder:
+        raise ValueError(f"{what} {value} is not a multiple of {unit}")
+    return int(units)
+
+
+class UnknownPairError(ValueError):
+    """The pair is not one the exchange lists"""
+
+    def __init__(self, pair: str):
+        super().__init__(f"pair {pair!r} is not listed")
+        self.pair = pair
+
+
+# The listed pairs; only these are accepted and matched
+PAIR_SPECS: Dict[str, PairSpec] = {
+    spec.pair: spec for spec in (
+        PairSpec("BTC/USDT", Decimal("0.01"), Decimal("0.00000001")),
+        PairSpec("ETH/USDT", Decimal("0.01"), Decimal("0.00000001")),
+        PairSpec("SOL/USDT", Decimal("0.01"), Decimal("0.000001")),
+        PairSpec("tTBILL/USDT", Decimal("0.01"), Decimal("0.000001")),
+    )
+}
+
+
+def get_pair_spec(pair: str) -> PairSpec:
+    """Get the tick and lot size for a listed pair, raising UnknownPairError for any other"""
+    spec = PAIR_SPECS.get(pair)
+    if spec is None:
+        raise UnknownPairError(pair)
+    return spec
@@ -0,0 +1,315 @@
+"""
+CantonDEX Matching Journal
+Append-only per-pair journal plus compact binary book snapshots for fast restarts
+"""
+
+import logging
+import os
+import struct
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from order_book import OrderBook, BookOrder, Fill, BUY, SELL
+
+logger = logging.getLogger(__name__)
+
+# Record types
+ORDER = 1    # order (re)booked with its current state
+REMOVE = 2   # order taken off the book
+FILL = 3     # execution between a maker and a taker
+
+# Starts every journal file; bumped whenever a record layout changes
+_JOURNAL_MAGIC = b"CDXJRNL3"
+_HEADER = struct.Struct("<IQB")          # payload length, sequence, record type
+_CRC = struct.Struct("<I")
+# ids, side, time in force, price, quantity, filled, stop price, display quantity,
+# shown slice, budget, created_at, party_id length; -1 stands for None. The
+# party_id follows
+_ORDER = struct.Struct("<16s16sBBqqqqqqqqH")
+_REMOVE = struct.Struct("<16s")
+_FILL = struct.Struct("<16s16s16sqq")    # trade, maker and taker ids, price, quantity
+
+_SNAPSHOT_MAGIC = b"CDXBOOK3"
+_SNAPSHOT_HEADER = struct.Struct("<8sQI")  # magic, last sequence, order count
+_LENGTH = struct.Struct("<I")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+_TIME_IN_FORCE = ("GTC", "IOC", "FOK")
+
+
+class JournalFormatError(ValueError):
+    """A snapshot or journal written in a format this build does not read"""
+
+
+def _encode_optional(value: Optional[int]) -> int:
+    return -1 if value is None else value
+
+
+def _decode_optional(value: int) -> Optional[int]:
+    return None if value < 0 else value
+
+
+def _encode_time(value: Optional[datetime]) -> int:
+    return -1 if value is None else (value - _EPOCH) // _MICROSECOND
+
+
+def _decode_time(value: int) -> Optional[datetime]:
+    return None if value < 0 else _EPOCH + value * _MICROSECOND
+
+
+def encode_order(order: BookOrder) -> bytes:
+    party_id = order.party_id.encode()
+    return _ORDER.pack(
+        order.order_id.bytes, order.account_id.bytes, 0 if order.side == BUY else 1,
+        _TIME_IN_FORCE.index(order.time_in_force),
+        _encode_optional(order.price), order.quantity, order.filled_quantity,
+        _encode_optional(order.stop_price), _encode_optional(order.display_quantity),
+        _encode_optional(order.shown), _encode_optional(order.budget),
+        _encode_time(order.created_at), len(party_id),
+    ) + party_id
+
+
+def decode_order(pair: str, payload: bytes) -> BookOrder:
+    (order_id, account_id, side, time_in_force, price, quantity, filled,
+     stop_price, display_quantity, shown, budget, created_at, party_len) = _ORDER.unpack_from(payload)
+    party_id = payload[_ORDER.size:_ORDER.size + party_len].decode()
+    order = BookOrder(
+        uuid.UUID(bytes=order_id), uuid.UUID(bytes=account_id), party_id, pair,
+        BUY if side == 0 else SELL, _decode_optional(price), quantity, filled,
+        _decode_time(created_at), _TIME_IN_FORCE[time_in_force],
+        _decode_optional(stop_price), _decode_optional(display_quantity),
+        _decode_optional(budget),
+    )
+    if order.display_quantity is not None:
+        order.shown = shown
+    return order
+
+
+class PairJournal:
+    """
+    Journal and snapshot files for one pair's book.
+
+    Records are buffered and only written by flush(), which the engine calls
+    before committing the matching database transaction, so the journal is
+    always at least as far ahead as the database. flush() and save_snapshot()
+    do the file writes, and the engine runs them in a worker thread.
+    """
+
+    def __init__(self, directory: str, pair: str, fsync: bool = True):
+        self.pair = pair
+        self.fsync = fsync
+        name = quote(pair, safe='')
+        self.journal_path = os.path.join(directory, f"{name}.journal")
+        self.snapshot_path = os.path.join(directory, f"{name}.snapshot")
+        self.sequence = 0
+        self.records_since_snapshot = 0
+        self._buffer = bytearray()
+        self._file = None
+
+    def _append(self, record_type: int, payload: bytes):
+        self.sequence += 1
+        self.records_since_snapshot += 1
+        record = _HEADER.pack(len(payload), self.sequence, record_type) + payload
+        self._buffer += record
+        self._buffer += _CRC.pack(zlib.crc32(record))
+
+    def record_order(self, order: BookOrder):
+        self._append(ORDER, encode_order(order))
+
+    def record_remove(self, order_id):
+        self._append(REMOVE, _REMOVE.pack(order_id.bytes))
+
+    def record_fills(self, fills: Iterable[Fill]):
+        for fill in fills:
+            self._append(FILL, _FILL.pack(
+                fill.trade_id.bytes, fill.maker.order_id.bytes, fill.taker.order_id.bytes,
+                fill.price, fill.quantity,
+            ))
+
+    def flush(self):
+        """Make every buffered record durable"""
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._file = open(self.journal_path, "ab")
+            if self._file.tell() == 0:
+                self._buffer[:0] = _JOURNAL_MAGIC
+        self._file.write(self._buffer)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._buffer.clear()
+
+    def discard(self):
+        """Drop buffered records that were never flushed"""
+        self._buffer.clear()
+
+    def write_snapshot(self, book: OrderBook):
+        """Persist the whole book and start a fresh journal after it"""
+        self.save_snapshot(self.snapshot(book))
+
+    def snapshot(self, book: OrderBook) -> bytes:
+        """Encode the whole book, dropping buffered records it supersedes"""
+        self.discard()
+        orders = [order for side in (book.bids, book.asks) for level in side.levels() for order in level]
+        orders += book.stops
+        body = bytearray(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, self.sequence, len(orders)))
+        for order in orders:
+            encoded = encode_order(order)
+            body += _LENGTH.pack(len(encoded))
+            body += encoded
+        body += _CRC.pack(zlib.crc32(body))
+        return bytes(body)
+
+    def save_snapshot(self, body: bytes):
+        """Write a snapshot() and start a fresh journal after it"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Everything in the journal is now covered by the snapshot
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        open(self.journal_path, "wb").close()
+        self.records_since_snapshot = 0
+
+    def _read_snapshot(self, book: OrderBook) -> int:
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path, "rb") as f:
+            data = f.read()
+        body, (crc,) = data[:-_CRC.size], _CRC.unpack(data[-_CRC.size:])
+        magic, sequence, count = _SNAPSHOT_HEADER.unpack_from(body)
+        if zlib.crc32(body) != crc:
+            raise ValueError(f"Corrupt snapshot {self.snapshot_path}")
+        if magic != _SNAPSHOT_MAGIC:
+            raise JournalFormatError(f"Snapshot {self.snapshot_path} is in format {magic!r}")
+
+        offset = _SNAPSHOT_HEADER.size
+        for _ in range(count):
+            (length,) = _LENGTH.unpack_from(body, offset)
+            offset += _LENGTH.size
+            book.add(decode_order(self.pair, body[offset:offset + length]))
+            offset += length
+        return sequence
+
+    def _read_records(self) -> Iterable[Tuple[int, int, bytes]]:
+        """Yield (sequence, type, payload), truncating a torn tail left by a crash"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+
+        if data[:len(_JOURNAL_MAGIC)] == _JOURNAL_MAGIC:
+            offset = len(_JOURNAL_MAGIC)
+        elif _JOURNAL_MAGIC.startswith(data):
+            # Empty, or torn before the first flush got past the header
+            offset = 0
+        else:
+            raise JournalFormatError(f"Journal {self.journal_path} is in an older format")
+        while offset + _HEADER.size <= len(data):
+            length, sequence, record_type = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + length
+            if end + _CRC.size > len(data):
+                break
+            (crc,) = _CRC.unpack_from(data, end)
+            if zlib.crc32(data[offset:end]) != crc:
+                break
+            yield sequence, record_type, data[offset + _HEADER.size:end]
+            offset = end + _CRC.size
+
+        if offset < len(data):
+            logger.warning(f"Truncating {len(data) - offset} torn bytes from {self.journal_path}")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(offset)
+
+    def recover(self) -> Tuple[OrderBook, Optional[uuid.UUID]]:
+        """
+        Rebuild the book from the latest snapshot and the journal tail.
+
+        Also returns the trade id of the last replayed fill, so the caller
+        can check that its batch actually reached the database.
+        """
+        book = OrderBook(self.pair)
+        self.sequence = self._read_snapshot(book)
+        last_trade_id = None
+        replayed = 0
+
+        for sequence, record_type, payload in self._read_records():
+            if sequence <= self.sequence:
+                continue
+            self.sequence = sequence
+            replayed += 1
+            if record_type == ORDER:
+                book.upsert(decode_order(self.pair, payload))
+            elif record_type == REMOVE:
+                book.remove(uuid.UUID(bytes=_REMOVE.unpack(payload)[0]))
+            elif record_type == FILL:
+                trade_id, maker_id, taker_id, _, quantity = _FILL.unpack(payload)
+                for order_id in (maker_id, taker_id):
+                    order = book.get(uuid.UUID(bytes=order_id))
+                    if order is not None:
+                        book.fill(order, quantity)
+                last_trade_id = uuid.UUID(bytes=trade_id)
+
+        self.records_since_snapshot = replayed
+        return book, last_trade_id
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MatchJournal:
+    """All pair journals under one directory, plus the engine's sync checkpoint"""
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        self.checkpoint_path = os.path.join(directory, "engine.checkpoint")
+        self._pairs: Dict[str, PairJournal] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def for_pair(self, pair: str) -> PairJournal:
+        journal = self._pairs.get(pair)
+        if journal is None:
+            journal = self._pairs[pair] = PairJournal(self.directory, pair, self.fsync)
+        return journal
+
+    def pairs(self) -> List[str]:
+        """Pairs that have a snapshot or journal on disk"""
+        names = set()
+        for filename in os.listdir(self.directory):
+            stem, ext = os.path.splitext(filename)
+            if ext in (".journal", ".snapshot"):
+                names.add(unquote(stem))
+        return sorted(names)
+
+    def read_checkpoint(self) -> Optional[datetime]:
+        """Time from which order changes may not be reflected in the journal"""
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return datetime.fromisoformat(f.read().strip())
+
+    def write_checkpoint(self, synced_until: datetime):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(synced_until.isoformat())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        for journal in self._pairs.values():
+            journal.close()
@@ -0,0 +1,150 @@
+"""
+CantonDEX Pair Leases
+Shares out the pairs among trading-service replicas so each is matched by exactly one of them
+"""
+
+import asyncio
+import os
+import socket
+from datetime import timedelta
+from typing import List, Set, Tuple
+
+# Identifies this replica in pair_leases; unique per running process
+REPLICA_ID = os.getenv("MATCHING_REPLICA_ID", "") or f"{socket.gethostname()}:{os.getpid()}"
+
+# A lease lapses unless renewed within this long, and a replica whose
+# heartbeat is older no longer counts towards the share-out
+LEASE_TTL = timedelta(seconds=float(os.getenv("MATCHING_LEASE_TTL_SECONDS", "10")))
+
+# Match statements take this on the pair's lease row, inside their own
+# transaction; no row means the lease is gone and nothing may be written
+FENCE_SQL = """
+    SELECT set_config('cantondex.writer', 'matching_engine', true)
+    FROM pair_leases
+    WHERE pair = $1 AND owner = $2 AND expires_at > LOCALTIMESTAMP
+    FOR SHARE
+"""
+
+
+def fair_share(pairs: int, replicas: List[str], replica_id: str) -> int:
+    """
+    How many of `pairs` the replica should hold: an even split, the
+    remainder going one each to the replicas that sort first
+    """
+    if replica_id not in replicas:
+        return 0
+    share, remainder = divmod(pairs, len(replicas))
+    return share + (1 if sorted(replicas).index(replica_id) < remainder else 0)
+
+
+class LeaseLost(Exception):
+    """The pair's lease lapsed or was taken over before its fills were written"""
+
+    def __init__(self, pair: str):
+        super().__init__(f"Lease on {pair} lost")
+        self.pair = pair
+
+
+class PairLeases:
+    """
+    This replica's leases on pairs, kept in the pair_leases table.
+
+    Every live replica heartbeats and renews its leases each round, then
+    gives up what it holds beyond its fair share and claims lapsed leases
+    up to it. Pairs move over when a replica joins, and the leases of one
+    that dies lapse after LEASE_TTL and are claimed by the others, which
+    settle the trades it left PENDING. The table is the only authority:
+    matching fences every write on the lease (FENCE_SQL), so a replica
+    that is late to notice a lost lease cannot trade on the pair in the
+    meantime.
+    """
+
+    def __init__(self, replica_id: str = REPLICA_ID, ttl: timedelta = LEASE_TTL):
+        self.replica_id = replica_id
+        self.ttl = ttl
+        # Pairs leased here
+        self.held: Set[str] = set()
+        # Pairs with orders but no lease row yet, noticed since the last round
+        self._unknown: Set[str] = set()
+        self._known: Set[str] = set()
+        self._wake = asyncio.Event()
+
+    def saw(self, pair: str):
+        """Note a pair with orders; one nobody has leased yet is claimed early"""
+        if pair not in self._known and pair not in self._unknown:
+            self._unknown.add(pair)
+            self._wake.set()
+
+    async def wait(self, timeout: float):
+        """Sleep until the next round is due, or a new pair turns up"""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def balance(self, conn) -> Tuple[Set[str], Set[str]]:
+        """
+        Run one round, returning the pairs gained and lost.
+
+        Lost pairs are dropped from `held` here; the caller adds the gained
+        ones once it is ready to match them.
+        """
+        await conn.execute("""
+            INSERT INTO matching_replicas (replica_id, heartbeat_at) VALUES ($1, LOCALTIMESTAMP)
+            ON CONFLICT (replica_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at
+        """, self.replica_id)
+        if self._unknown:
+            unknown, self._unknown = self._unknown, set()
+            await conn.execute("""
+                INSERT INTO pair_leases (pair, owner, expires_at)
+                SELECT pair, '', '-infinity' FROM unnest($1::varchar[]) AS pair
+                ON CONFLICT (pair) DO NOTHING
+            """, list(unknown))
+
+        renewed = {row['pair'] for row in await conn.fetch("""
+            UPDATE pair_leases SET expires_at = LOCALTIMESTAMP + $2::interval
+            WHERE owner = $1 AND expires_at > LOCALTIMESTAMP
+            RETURNING pair
+        """, self.replica_id, self.ttl)}
+        lost = self.held - renewed
+
+        self._known = {row['pair'] for row in await conn.fetch("SELECT pair FROM pair_leases")}
+        replicas = [row['replica_id'] for row in await conn.fetch("""
+            SELECT replica_id FROM matching_replicas WHERE heartbeat_at > LOCALTIMESTAMP - $1::interval
+        """, self.ttl)]
+        share = fair_share(len(self._known), replicas, self.replica_id)
+
+        gained = set()
+        if len(renewed) > share:
+            surplus = sorted(renewed)[share:]
+            await conn.execute("""
+                UPDATE pair_leases SET expires_at = '-infinity'
+                WHERE owner = $1 AND pair = ANY($2::varchar[])
+            """, self.replica_id, surplus)
+            renewed -= set(surplus)
+            lost |= set(surplus) & self.held
+        elif len(renewed) < share:
+            # Leases whose last holder is still mid-write are skipped this round
+            gained = {row['pair'] for row in await conn.fetch("""
+                UPDATE pair_leases SET owner = $1, expires_at = LOCALTIMESTAMP + $2::interval
+                WHERE pair IN (
+                    SELECT pair FROM pair_leases WHERE expires_at <= LOCALTIMESTAMP
+                    ORDER BY pair LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING pair
+            """, self.replica_id, self.ttl, share - len(renewed))}
+        # Renewed here though not held: left over by an earlier run under the same id
+        gained |= renewed - self.held
+
+        self.held -= lost
+        return gained, lost
+
+    async def release_all(self, conn):
+        """Give up every lease and leave the share-out"""
+        await conn.execute(
+            "UPDATE pair_leases SET expires_at = '-infinity' WHERE owner = $1", self.replica_id
+        )
+        await conn.execute("DELETE FROM matching_replicas WHERE replica_id = $1", self.replica_id)
+        self.held = set()
@@ -0,0 +1,95 @@
+"""
+CantonDEX Balance Ledger
+Holds the balance changes of persisted fills in memory and settles them in periodic batches
+"""
+
+import asyncio
+from typing import Dict, Iterable, List, Tuple
+
+from cache import balances_key, fill_parties, invalidate_soon
+from database import acquire
+from order_book import Fill
+from persistence import balance_deltas, transaction_legs, mark_settled, settle_balances
+
+
+class BalanceLedger:
+    """
+    Balance changes of fills whose trades are written but not yet settled.
+
+    The matching engine writes each batch's trades as PENDING and hands
+    the fills here once committed. flush() settles everything held so far
+    in one transaction: it marks the trades SETTLED, applies their deltas
+    netted per (account, asset) and writes their transactions rows, so
+    an account that trades a thousand times between flushes has its
+    balance row updated once. The PENDING trades are the durable record of
+    what is held here; a restarted engine settles them again from those.
+
+    Fills only ever add to available funds, so anything that reads
+    balances without the ledger sees at most less than is there.
+
+    The ledger only takes fill settlement off the matching path; it is not
+    the authority for available and locked amounts. Reservations on order
+    entry and releases on cancel or expiry still lock and update balances
+    rows directly, since order entry runs on every replica and an
+    account's pairs may be leased to several engines, so no one process
+    holds all of an account's balance changes. What the ledger holds is
+    only ever owed to accounts, which order entry settles on a shortfall
+    (see orders.place_orders).
+    """
+
+    def __init__(self):
+        # trade id -> fill; the fields settling reads never change once matched
+        self._held: Dict[object, Fill] = {}
+        self._flushing: Dict[object, Fill] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._held) + len(self._flushing)
+
+    def add(self, fills: List[Fill]):
+        """Hold a committed batch of PENDING fills until the next flush"""
+        for fill in fills:
+            if fill.trade_id not in self._flushing:
+                self._held[fill.trade_id] = fill
+
+    def pending(self) -> Dict[Tuple[object, str], List]:
+        """Net unsettled (available, locked) change per (account, asset)"""
+        return balance_deltas([*self._flushing.values(), *self._held.values()])
+
+    def has_credit(self, keys: Iterable[Tuple[object, str]]) -> bool:
+        """Whether any of these (account, asset)s has unsettled funds coming to it"""
+        if not self:
+            return False
+        pending = self.pending()
+        return any(key in pending and pending[key][0] > 0 for key in keys)
+
+    async def flush(self, conn=None) -> int:
+        """
+        Settle everything held so far in one transaction, on `conn` or a
+        pooled connection. Returns how many trades this flush settled.
+        On failure everything stays held for the next one.
+        """
+        async with self._lock:
+            if not self._held:
+                return 0
+            self._flushing, self._held = self._held, {}
+            try:
+                if conn is None:
+                    async with acquire() as conn:
+                        return await self._settle(conn)
+                return await self._settle(conn)
+            except BaseException:
+                self._flushing.update(self._held)
+                self._held = self._flushing
+                raise
+            finally:
+                self._flushing = {}
+
+    async def _settle(self, conn) -> int:
+        async with conn.transaction():
+            # Trades someone else settled meanwhile are already in the balances
+            settled = await mark_settled(conn, list(self._flushing))
+            fills = [fill for trade_id, fill in self._flushing.items() if trade_id in settled]
+            await settle_balances(conn, balance_deltas(fills), transaction_legs(fills))
+        invalidate_soon(balances_key(party_id) for party_id in fill_parties(fills))
+        return len(settled)
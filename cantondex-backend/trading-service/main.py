@@ -4,112 +4,155 @@ Main trading engine with order matching and settlement
 """
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
+import time
 import uvicorn
+import weakref
 from decimal import Decimal
 import uuid
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 
 # Local imports
-from database import get_db, get_db_pool, db_pool
-from matching_engine import MatchingEngine
+from database import get_db, get_read_db, get_db_pool, acquire, acquire_read, close_db_pool, pool_metrics
+from instruments import PAIR_SPECS, get_pair_spec
+from matching_engine import LIVE_STATUSES, ORDER_COLUMNS, MatchingEngine, announce_orders
 from models import (
     CreateOrderRequest, OrderResponse,
+    CreateOrdersRequest, CancelOrdersRequest, CancelOrdersResponse,
+    OrderBookLevel, OrderBookResponse, HistoryKind, HistoryPage,
+    CandleResolution, CandleResponse, TickerResponse,
     BalanceResponse, AccountResponse,
     CreateAccountRequest, DepositRequest,
     WithdrawRequest, TransactionResponse
 )
+from orders import MAX_BATCH_ORDERS, OrderRejected, place_orders, cancel_orders
+from history import fetch_page, export_rows, parse_cursor
+from candles import fetch_candles
+from cache import (
+    balances_key, open_orders_key, ticker_key, party_keys,
+    cached, invalidate, get_cache, cache_metrics, close_cache
+)
+from archival import run_maintenance_periodically
+from events import EVENTS_ENABLED
+from outbox import OutboxRelay, create_producer
 
 # Initialize matching engine
 matching_engine = MatchingEngine()
 
+# Publishes the order and trade events matching and order entry write to the outbox
+outbox_relay = OutboxRelay(create_producer()) if EVENTS_ENABLED else None
+
+MAX_BOOK_DEPTH = 500
+# Depths /orderbook serves; a request is rounded up to the next one
+BOOK_DEPTHS = (5, 10, 20, 50, 100, 200, MAX_BOOK_DEPTH)
+MAX_HISTORY_PAGE = 1000
+MAX_CANDLES = 1000
+
+# pair -> (weak reference to its book, bids version, asks version, {depth: encoded response});
+# an entry goes when its book is dropped or replaced
+_depth_cache: Dict = {}
+
+# Milliseconds each startup step took, reported by /health
+startup_timings: Dict[str, float] = {}
+
+# Demo order book for BTC/USDT, as (side, quantity, price)
+SEED_ORDERS = [
+    ('BUY', Decimal('0.5'), Decimal('92450.00')),
+    ('BUY', Decimal('0.6'), Decimal('92400.00')),
+    ('BUY', Decimal('0.7'), Decimal('92350.00')),
+    ('SELL', Decimal('0.5'), Decimal('92550.00')),
+    ('SELL', Decimal('0.6'), Decimal('92600.00')),
+    ('SELL', Decimal('0.7'), Decimal('92650.00')),
+]
+
+
+@asynccontextmanager
+async def _timed(step: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[step] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"⏱️ {step}: {startup_timings[step]} ms")
+
+
+async def _seed_demo_orders(conn):
+    """Give the system operator funds and a BTC/USDT book, unless it has one already"""
+    existing_orders = await conn.fetchval("""
+        SELECT COUNT(*) FROM orders
+        WHERE pair = 'BTC/USDT' AND status = 'OPEN'
+    """)
+    if existing_orders:
+        return
+    account_id = await conn.fetchval("""
+        SELECT account_id FROM trading_accounts
+        WHERE party_id = 'canton::system::operator'
+        LIMIT 1
+    """)
+    if account_id is None:
+        return
+
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE balances
+            SET available = CASE asset_symbol WHEN 'BTC' THEN 100.0 ELSE 10000000.0 END
+            WHERE account_id = $1 AND asset_symbol IN ('BTC', 'USDT')
+        """, account_id)
+        await conn.execute("""
+            INSERT INTO orders (account_id, party_id, pair, side, order_type, quantity, price, status)
+            SELECT $1, 'canton::system::operator', 'BTC/USDT', o.side, 'LIMIT', o.quantity, o.price, 'OPEN'
+            FROM unnest($2::varchar[], $3::numeric[], $4::numeric[]) AS o(side, quantity, price)
+        """, account_id, *(list(column) for column in zip(*SEED_ORDERS)))
+    print(f"📊 Order Book seeded with {len(SEED_ORDERS)} BTC/USDT orders - ready for demo!")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
-    # Startup
+    # Startup: warm everything up before serving, timing each step
     print("🚀 Starting CantonDEX Trading Service...")
-    pool = await get_db_pool()
-    
-    # Create seed orders for BTC/USDT to populate order book
-    async with pool.acquire() as conn:
+    started = time.perf_counter()
+    async with _timed("pool"):
+        # Opens the pool's minimum connections, each preparing the hot statements
+        await get_db_pool()
+    async with _timed("seed"):
         try:
-            # Check if seed orders already exist
-            existing_orders = await conn.fetchval("""
-                SELECT COUNT(*) FROM orders 
-                WHERE pair = 'BTC/USDT' AND status = 'OPEN'
-            """)
-            
-            if existing_orders == 0:
-                print("📋 Creating seed orders for BTC/USDT...")
-                
-                # Create a system account for seed orders
-                system_account = await conn.fetchrow("""
-                    SELECT account_id FROM trading_accounts 
-                    WHERE party_id = 'canton::system::operator'
-                    LIMIT 1
-                """)
-                
-                if system_account:
-                    account_id = system_account['account_id']
-                    
-                    # Ensure sufficient BTC balance for sell orders
-                    await conn.execute("""
-                        UPDATE balances 
-                        SET available = 100.0 
-                        WHERE account_id = $1 AND asset_symbol = 'BTC'
-                    """, account_id)
-                    
-                    # Ensure sufficient USDT balance for buy orders
-                    await conn.execute("""
-                        UPDATE balances 
-                        SET available = 10000000.0 
-                        WHERE account_id = $1 AND asset_symbol = 'USDT'
-                    """, account_id)
-                    
-                    # Create 3 BID (buy) orders - market buyers at different prices
-                    bid_prices = [92450.00, 92400.00, 92350.00]
-                    for i, price in enumerate(bid_prices):
-                        await conn.execute("""
-                            INSERT INTO orders (
-                                account_id, party_id, pair, side, order_type,
-                                quantity, price, status
-                            ) VALUES (
-                                $1, 'canton::system::operator', 'BTC/USDT', 'BUY', 'LIMIT',
-                                $2, $3, 'OPEN'
-                            )
-                        """, account_id, 0.5 + (i * 0.1), price)
-                        print(f"  ✅ Seed BID order #{i+1}: {0.5 + (i * 0.1)} BTC @ ${price}")
-                    
-                    # Create 3 ASK (sell) orders - market sellers at different prices
-                    ask_prices = [92550.00, 92600.00, 92650.00]
-                    for i, price in enumerate(ask_prices):
-                        await conn.execute("""
-                            INSERT INTO orders (
-                                account_id, party_id, pair, side, order_type,
-                                quantity, price, status
-                            ) VALUES (
-                                $1, 'canton::system::operator', 'BTC/USDT', 'SELL', 'LIMIT',
-                                $2, $3, 'OPEN'
-                            )
-                        """, account_id, 0.5 + (i * 0.1), price)
-                        print(f"  ✅ Seed ASK order #{i+1}: {0.5 + (i * 0.1)} BTC @ ${price}")
-                    
-                    print("📊 Order Book seeded successfully - ready for demo!")
+            async with acquire() as conn:
+                await _seed_demo_orders(conn)
         except Exception as e:
             print(f"⚠️ Warning: Could not create seed orders: {e}")
-    
+    async with _timed("books"):
+        try:
+            await matching_engine.warm_up()
+        except Exception as e:
+            # The matching loop keeps trying; /health reports not ready until then
+            print(f"⚠️ Warning: Could not load the books: {e}")
+    startup_timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"✅ Warmed up in {startup_timings['total']} ms")
+
     # Start matching engine in background
-    asyncio.create_task(matching_engine.run_continuous_matching())
+    matching_engine._task = asyncio.create_task(matching_engine.run_continuous_matching())
+    # Keep trade and transaction partitions ahead of time and archive old ones
+    maintenance = asyncio.create_task(run_maintenance_periodically())
+    relay = asyncio.create_task(outbox_relay.run()) if outbox_relay else None
     
     yield
     
     # Shutdown
     print("🛑 Shutting down CantonDEX Trading Service...")
+    maintenance.cancel()
     matching_engine.stop()
-    if db_pool:
-        await db_pool.close()
+    await asyncio.gather(maintenance, matching_engine.wait_stopped(), return_exceptions=True)
+    if relay:
+        # Events it has not relayed stay in the outbox for the next start
+        relay.cancel()
+        await asyncio.gather(relay, return_exceptions=True)
+    await close_db_pool()
+    await close_cache()
 
 
 # Create FastAPI app
@@ -141,13 +184,353 @@ async def root():
 
 
 @app.get("/health")
-async def health_check():
-    """Health check endpoint"""
+async def health_check(response: Response):
+    """Health check endpoint; 503 until the matching engine has its books loaded"""
+    ready = matching_engine.ready
+    if not ready:
+        response.status_code = 503
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "starting",
         "service": "trading-service",
-        "matching_engine": "running" if matching_engine.is_running else "stopped"
+        "matching_engine": "running" if matching_engine.is_running else "stopped",
+        "matching_workers": len(matching_engine.workers),
+        "startup_ms": startup_timings
+    }
+
+
+@app.get("/metrics/pool")
+async def get_pool_metrics():
+    """Database pool occupancy, acquire waits and queries per connection, and the read replica's lag"""
+    return pool_metrics()
+
+
+@app.get("/metrics/cache")
+async def get_cache_metrics():
+    """Cache hits, misses and invalidations"""
+    return cache_metrics()
+
+
+@app.get("/metrics/events")
+async def get_event_metrics():
+    """Order and trade events relayed to Kafka"""
+    if outbox_relay is None:
+        return {"status": "disabled"}
+    return outbox_relay.metrics()
+
+
+def _order_response(row) -> OrderResponse:
+    return OrderResponse(
+        order_id=str(row['order_id']),
+        account_id=str(row['account_id']),
+        party_id=row['party_id'],
+        pair=row['pair'],
+        side=row['side'],
+        order_type=row['order_type'],
+        time_in_force=row['time_in_force'],
+        quantity=float(row['quantity']),
+        price=float(row['price']) if row['price'] is not None else None,
+        status=row['status'],
+        filled_quantity=float(row['filled_quantity']),
+        created_at=row['created_at']
+    )
+
+
+async def _hand_to_engine(conn, rows):
+    """
+    Queue changed orders with the matching engine, one entry per pair.
+    Orders of pairs another replica matches are announced to it instead.
+    """
+    by_pair = {}
+    for row in rows:
+        by_pair.setdefault(row['pair'], []).append(row)
+    elsewhere = []
+    for pair, pair_rows in by_pair.items():
+        if not matching_engine.owns(pair):
+            elsewhere += pair_rows
+            continue
+        matching_engine.notify_orders(
+            pair, [row['order_id'] for row in pair_rows], min(row['updated_at'] for row in pair_rows)
+        )
+    if elsewhere:
+        await announce_orders(conn, elsewhere)
+
+
+def _check_batch_size(count: int):
+    if not 0 < count <= MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"A batch takes 1 to {MAX_BATCH_ORDERS} orders")
+
+
+async def _place_orders(conn, requests: List[CreateOrderRequest]) -> List[OrderResponse]:
+    try:
+        rows = await place_orders(conn, requests, matching_engine.ledger)
+    except OrderRejected as e:
+        raise HTTPException(status_code=400, detail=e.errors)
+    await invalidate(party_keys(row['party_id'] for row in rows))
+    await _hand_to_engine(conn, rows)
+    return [_order_response(row) for row in rows]
+
+
+@app.post("/orders", response_model=OrderResponse, status_code=201)
+async def create_order(request: CreateOrderRequest, conn=Depends(get_db)):
+    """Place an order"""
+    return (await _place_orders(conn, [request]))[0]
+
+
+@app.post("/orders/batch", response_model=List[OrderResponse], status_code=201)
+async def create_orders(request: CreateOrdersRequest, conn=Depends(get_db)):
+    """Place a batch of orders atomically: all are accepted or none is"""
+    _check_batch_size(len(request.orders))
+    return await _place_orders(conn, request.orders)
+
+
+@app.delete("/orders/batch", response_model=CancelOrdersResponse)
+async def cancel_order_batch(request: CancelOrdersRequest, conn=Depends(get_db)):
+    """Cancel a batch of one account's orders"""
+    _check_batch_size(len(request.order_ids))
+    try:
+        account_id = uuid.UUID(request.account_id)
+        order_ids = [uuid.UUID(order_id) for order_id in request.order_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="account_id and order_ids must be UUIDs")
+
+    rows = await cancel_orders(conn, account_id, order_ids)
+    await invalidate(party_keys(row['party_id'] for row in rows))
+    await _hand_to_engine(conn, rows)
+    cancelled = {row['order_id'] for row in rows}
+    return CancelOrdersResponse(
+        cancelled=[str(order_id) for order_id in order_ids if order_id in cancelled],
+        not_cancelled=[str(order_id) for order_id in order_ids if order_id not in cancelled]
+    )
+
+
+def _acquire_cached():
+    """
+    A connection for loading a cache entry: the primary, since an entry read
+    from a lagging replica would outlive the invalidation meant to replace
+    it. Uncached reads may use the replica.
+    """
+    return acquire() if get_cache() is not None else acquire_read()
+
+
+@app.get("/accounts/{party_id}/balances", response_model=List[BalanceResponse])
+async def get_balances(party_id: str):
+    """A party's balances per asset, summed over its accounts"""
+    async def load():
+        async with _acquire_cached() as conn:
+            rows = await conn.fetch("""
+                SELECT b.asset_symbol, sum(b.available) AS available, sum(b.locked) AS locked,
+                       max(b.updated_at) AS updated_at
+                FROM balances b JOIN trading_accounts a ON a.account_id = b.account_id
+                WHERE a.party_id = $1
+                GROUP BY b.asset_symbol
+                ORDER BY b.asset_symbol
+            """, party_id)
+        return [
+            BalanceResponse(
+                asset_symbol=row['asset_symbol'],
+                available=float(row['available']),
+                locked=float(row['locked']),
+                updated_at=row['updated_at']
+            ).model_dump(mode='json')
+            for row in rows
+        ]
+
+    return await cached(balances_key(party_id), load)
+
+
+@app.get("/accounts/{party_id}/open-orders", response_model=List[OrderResponse])
+async def get_open_orders(party_id: str):
+    """A party's orders that are still live, newest first"""
+    async def load():
+        async with _acquire_cached() as conn:
+            rows = await conn.fetch(f"""
+                SELECT {ORDER_COLUMNS} FROM orders
+                WHERE party_id = $1 AND status = ANY($2::varchar[])
+                ORDER BY created_at DESC, order_id DESC
+            """, party_id, list(LIVE_STATUSES))
+        return [_order_response(row).model_dump(mode='json') for row in rows]
+
+    return await cached(open_orders_key(party_id), load)
+
+
+def _check_pair(pair: str):
+    if pair not in PAIR_SPECS:
+        raise HTTPException(status_code=404, detail=f"{pair} is not listed")
+
+
+def _book_levels(pair: str, side, depth: int) -> List[OrderBookLevel]:
+    spec = get_pair_spec(pair)
+    return [
+        OrderBookLevel(
+            price=str(spec.price(level.price)),
+            quantity=str(spec.quantity(level.quantity)),
+            order_count=len(level)
+        )
+        for level in side.top(depth)
+    ]
+
+
+@app.get("/orderbook/{pair:path}", response_model=OrderBookResponse)
+async def get_order_book(pair: str, depth: int = Query(20, ge=1, le=MAX_BOOK_DEPTH)):
+    """
+    Best price levels per side, straight from the matching engine's books,
+    `depth` rounded up to one of BOOK_DEPTHS. The encoded response is reused
+    until either side changes. Pairs another replica matches are read from
+    order_book_snapshot instead.
+    """
+    _check_pair(pair)
+    depth = next(allowed for allowed in BOOK_DEPTHS if allowed >= depth)
+    if not matching_engine.owns(pair):
+        return await _snapshot_order_book(pair, depth)
+    book = matching_engine.books.get(pair)
+    if book is None:
+        return OrderBookResponse(pair=pair, bids=[], asks=[], updated_at=datetime.utcnow())
+
+    cached = _depth_cache.get(pair)
+    if not (cached and cached[0]() is book and cached[1] == book.bids.version and cached[2] == book.asks.version):
+        cached = _depth_cache[pair] = (
+            weakref.ref(book, lambda ref: _evict_depth(pair, ref)), book.bids.version, book.asks.version, {}
+        )
+    body = cached[3].get(depth)
+    if body is None:
+        body = cached[3][depth] = OrderBookResponse(
+            pair=pair,
+            bids=_book_levels(pair, book.bids, depth),
+            asks=_book_levels(pair, book.asks, depth),
+            updated_at=datetime.utcnow()
+        ).model_dump_json().encode()
+    return Response(content=body, media_type="application/json")
+
+
+def _evict_depth(pair: str, ref):
+    """Drop a pair's cached responses once the book they were built from is gone"""
+    cached = _depth_cache.get(pair)
+    if cached and cached[0] is ref:
+        del _depth_cache[pair]
+
+
+async def _snapshot_order_book(pair: str, depth: int) -> OrderBookResponse:
+    async with acquire_read() as conn:
+        rows = await conn.fetch("""
+            (SELECT side, price, quantity, order_count, updated_at FROM order_book_snapshot
+             WHERE pair = $1 AND side = 'BUY' ORDER BY price DESC LIMIT $2)
+            UNION ALL
+            (SELECT side, price, quantity, order_count, updated_at FROM order_book_snapshot
+             WHERE pair = $1 AND side = 'SELL' ORDER BY price ASC LIMIT $2)
+        """, pair, depth)
+    spec = get_pair_spec(pair)
+
+    def levels(side):
+        return [
+            OrderBookLevel(
+                price=str(row['price'].quantize(spec.tick_size)),
+                quantity=str(row['quantity'].quantize(spec.lot_size)),
+                order_count=row['order_count']
+            )
+            for row in rows if row['side'] == side
+        ]
+
+    return OrderBookResponse(
+        pair=pair, bids=levels('BUY'), asks=levels('SELL'),
+        updated_at=max((row['updated_at'] for row in rows), default=datetime.utcnow())
+    )
+
+
+@app.get("/candles/{pair:path}", response_model=List[CandleResponse])
+async def get_candles(
+    pair: str,
+    resolution: CandleResolution = CandleResolution.minute,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(500, ge=1, le=MAX_CANDLES)
+):
+    """
+    The latest `limit` OHLCV bars opening in [start, end), oldest first.
+    Recent bars come from the matching engine's memory, older ones from the
+    candles table; the last bar may still be open.
+    """
+    _check_pair(pair)
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await fetch_candles(matching_engine.candles, pair, resolution.value, start, end, limit)
+
+
+@app.get("/ticker/{pair:path}", response_model=TickerResponse)
+async def get_ticker(pair: str):
+    """
+    Rolling 24h statistics, straight from the matching engine, or as last
+    written to market_data, through the cache, for pairs another replica matches
+    """
+    _check_pair(pair)
+    if matching_engine.owns(pair):
+        ticker = _ticker_fields(matching_engine.ticker.ticker(pair))
+    else:
+        ticker = await cached(ticker_key(pair), lambda: _market_data_ticker(pair))
+    if ticker is None:
+        raise HTTPException(status_code=404, detail=f"{pair} has not traded")
+    return TickerResponse(**ticker)
+
+
+def _ticker_fields(ticker: Optional[dict]) -> Optional[dict]:
+    if ticker is None:
+        return None
+    return {k: v if v is None or k == 'pair' else str(v) for k, v in ticker.items()}
+
+
+async def _market_data_ticker(pair: str) -> Optional[dict]:
+    async with _acquire_cached() as conn:
+        row = await conn.fetchrow("""
+            SELECT last_price, price_change_24h, price_change_percent_24h,
+                   high_24h, low_24h, coalesce(volume_24h, 0) AS volume_24h
+            FROM market_data WHERE pair = $1 AND last_price IS NOT NULL
+        """, pair)
+    if row is None:
+        return None
+    spec = get_pair_spec(pair)
+    # Scaled like the engine's own figures
+    ticker = {
+        'pair': pair,
+        'price_change_percent_24h': row['price_change_percent_24h'],
+        'volume_24h': row['volume_24h'].quantize(spec.lot_size),
     }
+    for column in ('last_price', 'price_change_24h', 'high_24h', 'low_24h'):
+        ticker[column] = None if row[column] is None else row[column].quantize(spec.tick_size)
+    return _ticker_fields(ticker)
+
+
+def _check_history_filters(kind: HistoryKind, after: Optional[str], status: Optional[str]):
+    if status is not None and kind != HistoryKind.orders:
+        raise HTTPException(status_code=400, detail="status only applies to order history")
+    if after is not None:
+        try:
+            parse_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/parties/{party_id}/{kind}", response_model=HistoryPage)
+async def get_history(
+    party_id: str,
+    kind: HistoryKind,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_HISTORY_PAGE),
+    status: Optional[str] = None,
+    conn=Depends(get_read_db)
+):
+    """A page of a party's history, newest first; pass `next` back as `after`"""
+    _check_history_filters(kind, after, status)
+    return await fetch_page(conn, kind.value, party_id, after, limit, status)
+
+
+@app.get("/parties/{party_id}/{kind}/export")
+async def export_history(party_id: str, kind: HistoryKind, after: Optional[str] = None,
+                         status: Optional[str] = None):
+    """A party's whole history, newest first, streamed as NDJSON"""
+    _check_history_filters(kind, after, status)
+    return StreamingResponse(
+        export_rows(kind.value, party_id, after, status),
+        media_type="application/x-ndjson"
+    )
 
 
 if __name__ == "__main__":
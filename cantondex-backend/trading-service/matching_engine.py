@@ -1,144 +1,960 @@
 import asyncio
+import json
 import logging
-from database import get_db_pool
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from cache import fill_parties, invalidate_soon, party_keys
+from candles import CandleBuilder
+from database import get_db_pool, acquire, prepare_on_connect
+from instruments import PAIR_SPECS, get_pair_spec
+from journal import JournalFormatError, MatchJournal, PairJournal
+from leases import FENCE_SQL, LeaseLost, PairLeases
+from ledger import BalanceLedger
+from order_book import OrderBook, BookOrder, Fill
+from persistence import StaleOrderError, persist_fills, expire_orders, mark_triggered, write_book_levels
+from ticker import TickerBoard
 
 logger = logging.getLogger(__name__)
 
+# Statuses of orders that can still rest on the book
+LIVE_STATUSES = ('OPEN', 'PARTIALLY_FILLED')
+
+# Time in force of orders that execute on arrival and never rest
+IMMEDIATE_TIME_IN_FORCE = ('IOC', 'FOK')
+
+# Rows fetched per round trip while loading the books at startup
+LOAD_BATCH_ROWS = int(os.getenv("MATCHING_LOAD_BATCH_ROWS", "10000"))
+
+# Re-read window for the incremental order sync. Rows are stamped with their
+# transaction's start time, so a slow writer can commit behind the watermark.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# Channel the orders trigger publishes on (see database/schema.sql)
+ORDER_CHANNEL = 'order_changes'
+
+# Matching is driven by order notifications; the periodic sweep only catches
+# anything a notification missed
+SWEEP_INTERVAL = float(os.getenv("MATCHING_SWEEP_INTERVAL", "5"))
+
+# Per-pair worker tuning
+WORKER_QUEUE_SIZE = int(os.getenv("MATCHING_WORKER_QUEUE_SIZE", "1024"))
+WORKER_IDLE_TIMEOUT = float(os.getenv("MATCHING_WORKER_IDLE_SECONDS", "30"))
+
+# Crash recovery journal; disabled unless a directory is configured
+JOURNAL_DIR = os.getenv("MATCHING_JOURNAL_DIR", "")
+JOURNAL_FSYNC = os.getenv("MATCHING_JOURNAL_FSYNC", "true").lower() == "true"
+SNAPSHOT_RECORDS = int(os.getenv("MATCHING_SNAPSHOT_RECORDS", "100000"))
+
+# How often changed price levels are written to order_book_snapshot
+LEVEL_FLUSH_INTERVAL = float(os.getenv("MATCHING_LEVEL_FLUSH_SECONDS", "1"))
+
+# How often fills' balance changes are settled in a batch (see ledger.py);
+# 0 settles every batch of fills in its own transaction instead
+BALANCE_FLUSH_INTERVAL = float(os.getenv("MATCHING_BALANCE_FLUSH_SECONDS", "0.5"))
+
+# How often trades left PENDING by a run or replica that stopped before
+# settling them are swept up, and how old they must be first; a live
+# engine settles its own long before
+PENDING_SWEEP_INTERVAL = float(os.getenv("MATCHING_PENDING_SWEEP_SECONDS", "60"))
+
+# How often closed candles are written to the candles table
+CANDLE_FLUSH_INTERVAL = float(os.getenv("MATCHING_CANDLE_FLUSH_SECONDS", "5"))
+
+# How often rolling 24h statistics are written to market_data
+TICKER_FLUSH_INTERVAL = float(os.getenv("MATCHING_TICKER_FLUSH_MS", "500")) / 1000
+
+# Share the pairs out among replicas through pair_leases (see leases.py);
+# required to run more than one. Leases are renewed every LEASE_RENEW_INTERVAL
+# and lapse after MATCHING_LEASE_TTL_SECONDS, which must be well above it.
+PAIR_LEASES = os.getenv("MATCHING_PAIR_LEASES", "false").lower() == "true"
+LEASE_RENEW_INTERVAL = float(os.getenv("MATCHING_LEASE_RENEW_SECONDS", "3"))
+
+ORDER_COLUMNS = """
+    order_id, account_id, party_id, pair, side, order_type, time_in_force,
+    quantity, price, stop_price, display_quantity, max_cost, filled_quantity, status,
+    created_at, updated_at, triggered_at
+"""
+
+# Hot queries. Statuses and order types are spelled out rather than bound so
+# the planner can prove they match the partial indexes in database/schema.sql,
+# whose predicates must stay in step with them.
+_LIVE = "status IN ({})".format(", ".join(f"'{s}'" for s in LIVE_STATUSES))
+_MAY_TAKE = "(order_type IN ('MARKET', 'STOP') OR time_in_force IN ({}))".format(
+    ", ".join(f"'{t}'" for t in IMMEDIATE_TIME_IN_FORCE))
+
+LIVE_ORDERS_SQL = f"""
+    SELECT {ORDER_COLUMNS} FROM orders
+    WHERE {_LIVE} AND order_type <> 'MARKET'
+    ORDER BY created_at ASC, order_id ASC
+"""
+
+PAIR_ORDERS_SQL = f"""
+    SELECT {ORDER_COLUMNS} FROM orders
+    WHERE pair = $1 AND {_LIVE} AND order_type <> 'MARKET'
+    ORDER BY created_at ASC, order_id ASC
+"""
+
+CHANGED_ORDERS_SQL = f"""
+    SELECT {ORDER_COLUMNS} FROM orders
+    WHERE updated_at > $1
+    ORDER BY updated_at ASC, created_at ASC
+"""
+
+ORDERS_BY_ID_SQL = f"""
+    SELECT {ORDER_COLUMNS} FROM orders WHERE order_id = ANY($1::uuid[])
+    ORDER BY created_at ASC, order_id ASC
+"""
+
+TAKERS_SQL = f"""
+    SELECT order_id, pair FROM orders
+    WHERE {_LIVE} AND {_MAY_TAKE}
+      AND CASE WHEN order_type = 'STOP'
+               THEN triggered_at IS NOT NULL AND (price IS NULL OR time_in_force = ANY($1::varchar[]))
+               ELSE order_type = 'MARKET' OR time_in_force = ANY($1::varchar[])
+          END
+      AND ($2::varchar IS NULL OR pair = $2)
+    ORDER BY created_at ASC, order_id ASC
+"""
+
+LIVE_PAIRS_SQL = f"SELECT DISTINCT pair FROM orders WHERE {_LIVE}"
+
+TRADES_BY_ID_SQL = "SELECT trade_id FROM trades WHERE trade_id = ANY($1::uuid[])"
+
+# Optionally only some pairs', and only trades at least $2 seconds old
+PENDING_TRADES_SQL = """
+    SELECT trade_id, pair, price, quantity, maker_order_id, taker_order_id
+    FROM trades
+    WHERE settlement_status = 'PENDING'
+      AND ($1::text[] IS NULL OR pair = ANY($1::text[]))
+      AND matched_at <= LOCALTIMESTAMP - make_interval(secs => $2)
+    ORDER BY matched_at ASC
+"""
+
+# Run on every match or sweep, so every pooled connection prepares them up front
+prepare_on_connect(PAIR_ORDERS_SQL, CHANGED_ORDERS_SQL, ORDERS_BY_ID_SQL, TAKERS_SQL, TRADES_BY_ID_SQL)
+if PAIR_LEASES:
+    prepare_on_connect(FENCE_SQL)
+
+
+async def announce_orders(conn, rows):
+    """
+    Publish changed orders on the notification channel, as the orders
+    trigger would, for a writer that set cantondex.writer but cannot hand
+    them to the engine matching their pair itself
+    """
+    await conn.execute("""
+        SELECT pg_notify($1, json_build_object(
+            'order_id', o.order_id, 'pair', o.pair,
+            'updated_at', to_char(o.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+        )::text)
+        FROM unnest($2::uuid[], $3::varchar[], $4::timestamp[]) AS o(order_id, pair, updated_at)
+    """, ORDER_CHANNEL, [row['order_id'] for row in rows], [row['pair'] for row in rows],
+        [row['updated_at'] for row in rows])
+
+
+class PairWorker:
+    """
+    Matches a single pair on its own pooled connection.
+
+    Only the pair's worker touches its book, so pairs match concurrently
+    without interleaving on each other's state. The worker holds its
+    connection while it has work and retires after WORKER_IDLE_TIMEOUT.
+    """
+
+    def __init__(self, engine: "MatchingEngine", pair: str):
+        self.engine = engine
+        self.pair = pair
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WORKER_QUEUE_SIZE)
+        self.overflowed = False
+        self.task = None
+        # Oldest change queued, and oldest in the batch being processed, that
+        # may not have reached the journal yet
+        self.pending_since: Optional[datetime] = None
+        self.active_since: Optional[datetime] = None
+
+    def submit(self, order_id=None, updated_at: Optional[datetime] = None):
+        """
+        Queue an order change, a frozenset of them, or a bare rematch,
+        without ever blocking
+        """
+        if updated_at is not None and (self.pending_since is None or updated_at < self.pending_since):
+            self.pending_since = updated_at
+        try:
+            self.queue.put_nowait(order_id)
+        except asyncio.QueueFull:
+            # Too far behind to track individual orders; reload the whole book instead
+            self.overflowed = True
+
+    def rebuild(self):
+        """Queue a reload of the pair's book from the database, and a match"""
+        self.overflowed = True
+        self.submit()
+
+    @property
+    def unjournaled_since(self) -> Optional[datetime]:
+        return min(filter(None, (self.pending_since, self.active_since)), default=None)
+
+    async def run(self):
+        try:
+            async with acquire() as conn:
+                while True:
+                    try:
+                        first = await asyncio.wait_for(self.queue.get(), timeout=WORKER_IDLE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        if self.queue.empty() and not self.overflowed:
+                            return
+                        continue
+
+                    order_ids = self._drain(first)
+                    reload, self.overflowed = self.overflowed, False
+                    self.active_since, self.pending_since = self.unjournaled_since, None
+                    try:
+                        await self.engine.process_pair(conn, self.pair, order_ids, reload=reload)
+                        self.active_since = None
+                    except Exception as e:
+                        logger.error(f"Error matching {self.pair}: {e}")
+                        if conn.is_closed():
+                            # Lost the connection; the safety sweep re-queues what was missed
+                            return
+        finally:
+            self.engine._retire(self)
+
+    def _drain(self, first) -> Set:
+        """Coalesce everything queued so far into one set of order ids"""
+        order_ids = set()
+        item = first
+        while True:
+            if isinstance(item, frozenset):
+                order_ids |= item
+            elif item is not None:
+                order_ids.add(item)
+            if self.queue.empty():
+                return order_ids
+            item = self.queue.get_nowait()
+
+
 class MatchingEngine:
-    def __init__(self):
+    def __init__(self, journal_dir: str = JOURNAL_DIR):
         self.is_running = False
         self._task = None
+        self.books: Dict[str, OrderBook] = {}
+        self.workers: Dict[str, PairWorker] = {}
+        self._synced_until = None
+        self._listener = None
+        self.journal = MatchJournal(journal_dir, JOURNAL_FSYNC) if journal_dir else None
+        # Books rebuilt from scratch, whose snapshot rows must be replaced wholesale
+        self._rebuilt_pairs: Set[str] = set()
+        self._rebuilt_all = False
+        # Fills written but not yet settled into balances
+        self.ledger = BalanceLedger() if BALANCE_FLUSH_INTERVAL > 0 else None
+        self.candles = CandleBuilder()
+        self.ticker = TickerBoard()
+        # Pairs this replica matches, when it is one of several
+        self.leases = PairLeases() if PAIR_LEASES else None
 
     async def run_continuous_matching(self):
         """Run the matching engine loop"""
         self.is_running = True
         print("🔄 Matching Engine started")
-        
-        while self.is_running:
+        flushers = [
+            asyncio.create_task(self._flush_levels_periodically()),
+            asyncio.create_task(self._flush_candles_periodically()),
+            asyncio.create_task(self._flush_ticker_periodically()),
+        ]
+        if self.ledger is not None:
+            flushers.append(asyncio.create_task(self._flush_balances_periodically()))
+            flushers.append(asyncio.create_task(self._settle_pending_periodically()))
+        if self.leases is not None:
+            flushers.append(asyncio.create_task(self._balance_leases_periodically()))
+
+        try:
+            while self.is_running:
+                try:
+                    if self._synced_until is None:
+                        await self.warm_up()
+                    if self._listener is None or self._listener.is_closed():
+                        await self._listen()
+                        # Catch up with anything committed while nobody was listening
+                        await self.match_orders()
+
+                    await asyncio.sleep(SWEEP_INTERVAL)
+                    await self.match_orders()
+                except Exception as e:
+                    logger.error(f"Error in matching engine: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            for flusher in flushers:
+                flusher.cancel()
+            if self.ledger is not None:
+                try:
+                    # Whatever is still held is settled on the next start instead
+                    await self.ledger.flush()
+                except Exception as e:
+                    logger.error(f"Error settling balances: {e}")
+            try:
+                # Bars still open are rebuilt from trades on the next start
+                await self.candles.flush()
+            except Exception as e:
+                logger.error(f"Error writing candles: {e}")
             try:
-                await self.match_orders()
-                await asyncio.sleep(0.5)  # Run every 500ms
+                await self.ticker.flush()
             except Exception as e:
-                logger.error(f"Error in matching engine: {e}")
-                await asyncio.sleep(1)
+                logger.error(f"Error writing ticker: {e}")
+            if self.leases is not None:
+                try:
+                    # Let the other replicas take over without waiting for the leases to lapse
+                    async with acquire() as conn:
+                        await self.leases.release_all(conn)
+                except Exception as e:
+                    logger.error(f"Error releasing pair leases: {e}")
+            await self._unlisten()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the books are loaded and orders can be matched"""
+        return self._synced_until is not None
+
+    async def warm_up(self):
+        """
+        Get everything matching needs into memory: settle what an earlier
+        run left pending, then load market data and the books. Run before
+        the matching loop, which retries it until it succeeds.
+        """
+        if self.leases is not None:
+            # Books and market data are loaded, and pending trades settled,
+            # pair by pair as leases come in
+            async with acquire() as conn:
+                self._synced_until = await conn.fetchval("SELECT LOCALTIMESTAMP")
+                # Pairs no replica has leased yet, as when leases are first enabled
+                for row in await conn.fetch(LIVE_PAIRS_SQL):
+                    if row['pair'] in PAIR_SPECS:
+                        self.leases.saw(row['pair'])
+            return
+        if self.ledger is not None:
+            await self.settle_pending_trades()
+        await self.load_market_data()
+        if self.journal:
+            await self.recover_books()
+        else:
+            await self.load_books()
 
     def stop(self):
         """Stop the matching engine"""
         self.is_running = False
         if self._task:
             self._task.cancel()
+        for worker in list(self.workers.values()):
+            worker.task.cancel()
         print("⏹️ Matching Engine stopped")
 
-    async def match_orders(self):
-        """Execute order matching logic"""
+    async def wait_stopped(self):
+        """Wait for the tasks stop() cancelled to give back their connections"""
+        tasks = [self._task] if self._task else []
+        tasks += [worker.task for worker in list(self.workers.values())]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify_order(self, pair: str, order_id=None, updated_at: Optional[datetime] = None):
+        """
+        Hand an inserted, amended or cancelled order to its pair's worker.
+
+        Without an order id the pair is simply queued for another match pass.
+        A worker is started for the pair if it has none. Pairs another
+        replica matches, and pairs that are not listed, are ignored.
+        """
+        if pair not in PAIR_SPECS:
+            return
+        if self.owns(pair):
+            self._worker(pair).submit(order_id, updated_at)
+        else:
+            self.leases.saw(pair)
+
+    def notify_orders(self, pair: str, order_ids: Iterable, updated_at: Optional[datetime] = None):
+        """Hand a batch of a pair's orders to its worker as a single queue entry"""
+        if pair not in PAIR_SPECS:
+            return
+        if self.owns(pair):
+            self._worker(pair).submit(frozenset(order_ids), updated_at)
+        else:
+            self.leases.saw(pair)
+
+    def owns(self, pair: str) -> bool:
+        """Whether this replica matches the pair"""
+        return self.leases is None or pair in self.leases.held
+
+    def _worker(self, pair: str) -> PairWorker:
+        worker = self.workers.get(pair)
+        if worker is None:
+            worker = self.workers[pair] = PairWorker(self, pair)
+            worker.task = asyncio.create_task(worker.run())
+        return worker
+
+    async def flush_levels(self):
+        """
+        Write the price levels changed since the last flush to
+        order_book_snapshot, for every book, in one transaction.
+        """
+        rebuilt_all, self._rebuilt_all = self._rebuilt_all, False
+        rebuilt, self._rebuilt_pairs = self._rebuilt_pairs, set()
+        levels = []
+        for pair, book in self.books.items():
+            if not self.owns(pair):
+                # Lost while matching; the new owner rewrites its levels
+                continue
+            if rebuilt_all or pair in rebuilt:
+                changes = [
+                    (side.side, level.price, level.quantity, len(level))
+                    for side in (book.bids, book.asks) for level in side.levels()
+                ]
+                book.take_changes()
+            else:
+                changes = book.take_changes()
+            spec = get_pair_spec(pair)
+            levels += [
+                (pair, side, spec.price(price), spec.quantity(quantity), order_count)
+                for side, price, quantity, order_count in changes
+            ]
+        if not levels and not rebuilt and not rebuilt_all:
+            return
+
+        try:
+            async with acquire() as conn:
+                async with conn.transaction():
+                    if rebuilt_all:
+                        await conn.execute("DELETE FROM order_book_snapshot")
+                    await write_book_levels(conn, levels, [] if rebuilt_all else list(rebuilt))
+        except Exception:
+            # Rewrite the affected pairs in full next time
+            self._rebuilt_all |= rebuilt_all
+            self._rebuilt_pairs |= rebuilt | {level[0] for level in levels}
+            raise
+
+    async def _flush_levels_periodically(self):
+        while True:
+            await asyncio.sleep(LEVEL_FLUSH_INTERVAL)
+            try:
+                await self.flush_levels()
+            except Exception as e:
+                logger.error(f"Error flushing price levels: {e}")
+
+    async def _flush_balances_periodically(self):
+        while True:
+            await asyncio.sleep(BALANCE_FLUSH_INTERVAL)
+            try:
+                await self.ledger.flush()
+            except Exception as e:
+                logger.error(f"Error settling balances: {e}")
+
+    async def _settle_pending_periodically(self):
+        while True:
+            await asyncio.sleep(PENDING_SWEEP_INTERVAL)
+            try:
+                await self.settle_pending_trades(min_age=PENDING_SWEEP_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error settling pending trades: {e}")
+
+    async def _flush_candles_periodically(self):
+        while True:
+            await asyncio.sleep(CANDLE_FLUSH_INTERVAL)
+            try:
+                await self.candles.flush()
+            except Exception as e:
+                logger.error(f"Error writing candles: {e}")
+
+    async def _flush_ticker_periodically(self):
+        while True:
+            await asyncio.sleep(TICKER_FLUSH_INTERVAL)
+            try:
+                await self.ticker.flush()
+            except Exception as e:
+                logger.error(f"Error writing ticker: {e}")
+
+    async def _balance_leases_periodically(self):
+        while True:
+            try:
+                await self.balance_leases()
+            except Exception as e:
+                logger.error(f"Error balancing pair leases: {e}")
+            await self.leases.wait(LEASE_RENEW_INTERVAL)
+
+    async def balance_leases(self):
+        """
+        Renew this replica's pair leases and take on or give up pairs to
+        keep its fair share. A gained pair has its market data rebuilt, the
+        trades its last holder left PENDING settled, and its book reloaded
+        from the database before it is matched here.
+        """
+        async with acquire() as conn:
+            gained, lost = await self.leases.balance(conn)
+            for pair in lost:
+                self._drop_pair(pair)
+            if not gained:
+                return
+            try:
+                await self.candles.load(conn, gained)
+                await self.ticker.load(conn, gained)
+            except Exception as e:
+                logger.error(f"Error rebuilding market data: {e}")
+            if self.ledger is not None:
+                try:
+                    await self.settle_pending_trades(conn, gained)
+                except Exception as e:
+                    # The periodic sweep gets them instead
+                    logger.error(f"Error settling pending trades: {e}")
+        # Matched from here on
+        self.leases.held |= gained
+        for pair in gained:
+            self._worker(pair).rebuild()
+        print(f"🔑 Took on {len(gained)} pair(s): {', '.join(sorted(gained))}")
+
+    def _drop_pair(self, pair: str):
+        """Forget a pair whose lease was lost or given up"""
+        self.leases.held.discard(pair)
+        self.books.pop(pair, None)
+        self._rebuilt_pairs.discard(pair)
+        self.candles.drop(pair)
+        self.ticker.drop(pair)
+        print(f"🔓 Gave up {pair}")
+
+    async def load_market_data(self):
+        """
+        Rebuild the candles still open, or closed but unwritten, when the
+        engine last stopped, and the 24h ticker windows
+        """
+        try:
+            async with acquire() as conn:
+                await self.candles.load(conn)
+                await self.ticker.load(conn)
+        except Exception as e:
+            # Charts and tickers are not worth holding up matching for
+            logger.error(f"Error rebuilding market data: {e}")
+
+    async def settle_pending_trades(self, conn=None, pairs: Optional[Iterable[str]] = None,
+                                    min_age: float = 0.0) -> int:
+        """
+        Settle the trades an earlier run, or a replica that held the pair
+        before, wrote as PENDING but never settled: all of them, or those
+        of `pairs`, at least `min_age` seconds old. Settling is idempotent,
+        so trades their writer settles meanwhile are skipped.
+        """
+        if conn is None:
+            async with acquire() as conn:
+                return await self.settle_pending_trades(conn, pairs, min_age)
+
+        trades = await conn.fetch(PENDING_TRADES_SQL, None if pairs is None else list(pairs), min_age)
+        if not trades:
+            return 0
+        order_ids = {row['maker_order_id'] for row in trades} | {row['taker_order_id'] for row in trades}
+        orders = {row['order_id']: row for row in await conn.fetch(ORDERS_BY_ID_SQL, list(order_ids))}
+
+        fills = []
+        for row in trades:
+            if row['pair'] not in PAIR_SPECS:
+                continue
+            spec = get_pair_spec(row['pair'])
+            fill = Fill(
+                row['pair'],
+                BookOrder.from_record(orders[row['maker_order_id']], spec),
+                BookOrder.from_record(orders[row['taker_order_id']], spec),
+                spec.to_ticks(row['price']),
+                spec.to_lots(row['quantity']),
+            )
+            fill.trade_id = row['trade_id']
+            fills.append(fill)
+        self.ledger.add(fills)
+        settled = await self.ledger.flush(conn)
+        print(f"💰 Settled {settled} trade(s) left pending by an earlier run or replica")
+        return settled
+
+    def _retire(self, worker: PairWorker):
+        if self.workers.get(worker.pair) is worker:
+            del self.workers[worker.pair]
+
+    def _on_order_notification(self, connection, pid, channel, payload):
+        event = json.loads(payload)
+        updated_at = event.get('updated_at')
+        self.notify_order(
+            event['pair'], uuid.UUID(event['order_id']),
+            datetime.fromisoformat(updated_at) if updated_at else None,
+        )
+
+    async def _listen(self):
+        """Hold a connection subscribed to order change notifications"""
+        await self._unlisten()
         pool = await get_db_pool()
-        
-        async with pool.acquire() as conn:
-            # Get all active pairs
-            pairs = await conn.fetch("SELECT DISTINCT pair FROM orders WHERE status = 'OPEN'")
-            
-            for record in pairs:
-                pair = record['pair']
-                await self._match_pair(conn, pair)
-
-    async def _match_pair(self, conn, pair):
-        """Match orders for a specific pair"""
-        # Fetch best bid (highest price)
-        best_bid = await conn.fetchrow("""
-            SELECT * FROM orders 
-            WHERE pair = $1 AND side = 'BUY' AND status = 'OPEN'
-            ORDER BY price DESC, created_at ASC
-            LIMIT 1
-        """, pair)
-
-        # Fetch best ask (lowest price)
-        best_ask = await conn.fetchrow("""
-            SELECT * FROM orders 
-            WHERE pair = $1 AND side = 'SELL' AND status = 'OPEN'
-            ORDER BY price ASC, created_at ASC
-            LIMIT 1
-        """, pair)
-
-        if not best_bid or not best_ask:
+        self._listener = await pool.acquire()
+        await self._listener.add_listener(ORDER_CHANNEL, self._on_order_notification)
+
+    async def _unlisten(self):
+        listener, self._listener = self._listener, None
+        if listener is None:
             return
+        pool = await get_db_pool()
+        try:
+            if not listener.is_closed():
+                await listener.remove_listener(ORDER_CHANNEL, self._on_order_notification)
+        finally:
+            await pool.release(listener)
+
+    def get_book(self, pair: str) -> OrderBook:
+        """Get or create the in-memory book for a pair"""
+        book = self.books.get(pair)
+        if book is None:
+            book = self.books[pair] = OrderBook(pair)
+        return book
+
+    async def load_books(self):
+        """
+        Rebuild every book from the live orders in the database, streamed
+        through a cursor so they are never all held as rows at once
+        """
+        self.books = {}
+        self._rebuilt_all = True
+        loaded = 0
+        async with acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                synced_until = await conn.fetchval("SELECT LOCALTIMESTAMP")
+                takers = await self._fetch_takers(conn)
+                async for row in conn.cursor(LIVE_ORDERS_SQL, prefetch=LOAD_BATCH_ROWS):
+                    self._apply_order_row(row)
+                    loaded += 1
+        self._synced_until = synced_until
+        logger.info(f"Loaded {loaded} live orders into {len(self.books)} books")
+
+        if self.journal:
+            # Start the journal over from what was just loaded
+            for pair in set(self.journal.pairs()) | set(self.books):
+                await self._write_snapshot(self.journal.for_pair(pair), self.books.get(pair) or OrderBook(pair))
+            await asyncio.to_thread(self.journal.write_checkpoint, synced_until)
+
+        self._rematch_crossed()
+        # Orders that arrived but never got to execute
+        for taker in takers:
+            self.notify_order(taker['pair'], taker['order_id'])
+
+    async def recover_books(self):
+        """
+        Restore every book from its snapshot and journal tail.
+
+        Falls back to a full load when there is no checkpoint yet, or the
+        files were written in an older format. Only the
+        last fill batch of a pair can be missing from the database (the engine
+        journals a batch before committing it); such a pair is reloaded. Order
+        changes after the checkpoint are picked up by the following sweep.
+        """
+        synced_until = self.journal.read_checkpoint()
+        if synced_until is None:
+            await self.load_books()
+            return
+
+        self.books = {}
+        self._rebuilt_all = True
+        last_trades = {}
+        try:
+            for pair in self.journal.pairs():
+                if pair not in PAIR_SPECS:
+                    logger.warning(f"Ignoring the journal of {pair}, which is not listed")
+                    continue
+                self.books[pair], last_trade_id = self.journal.for_pair(pair).recover()
+                if last_trade_id is not None:
+                    last_trades[pair] = last_trade_id
+        except JournalFormatError as e:
+            logger.warning(f"{e}; loading the books from the database instead")
+            await self.load_books()
+            return
+
+        if last_trades:
+            async with acquire() as conn:
+                rows = await conn.fetch(TRADES_BY_ID_SQL, list(last_trades.values()))
+                persisted = {row['trade_id'] for row in rows}
+                for pair, trade_id in last_trades.items():
+                    if trade_id not in persisted:
+                        logger.warning(f"Last journaled fills for {pair} were never committed; reloading")
+                        await self._reload_book(conn, pair)
+
+        self._synced_until = synced_until
+        logger.info(f"Recovered {sum(len(b) for b in self.books.values())} orders into {len(self.books)} books")
+        self._rematch_crossed()
+
+    def _rematch_crossed(self):
+        # A book may have been left crossed by a previous run
+        for book in self.books.values():
+            if book.is_crossed():
+                self.notify_order(book.pair)
+
+    def _pair_journal(self, pair: str) -> Optional[PairJournal]:
+        return self.journal.for_pair(pair) if self.journal else None
+
+    async def _write_checkpoint(self):
+        """Record how far back a restart has to re-read order changes"""
+        since = [w.unjournaled_since for w in self.workers.values()]
+        await asyncio.to_thread(self.journal.write_checkpoint, min(filter(None, since + [self._synced_until])))
+
+    @staticmethod
+    async def _write_snapshot(journal: PairJournal, book: OrderBook):
+        """Snapshot a book, encoded here but written out in a worker thread"""
+        await asyncio.to_thread(journal.save_snapshot, journal.snapshot(book))
+
+    async def match_orders(self):
+        """
+        Safety sweep over orders changed since the last sync.
+
+        Rows the books already agree with are skipped; the rest are handed
+        to their pair's worker, which re-reads and matches them.
+        """
+        async with acquire() as conn:
+            rows = await conn.fetch(CHANGED_ORDERS_SQL, self._synced_until - SYNC_OVERLAP)
+
+        for row in rows:
+            if not self._is_current(row):
+                self.notify_order(row['pair'], row['order_id'], row['updated_at'])
+            if row['updated_at'] > self._synced_until:
+                self._synced_until = row['updated_at']
+
+        if self.journal:
+            await self._write_checkpoint()
+
+    async def process_pair(self, conn, pair: str, order_ids: Set, reload: bool = False) -> List[Fill]:
+        """Apply changed orders to a pair's book and match it, returning the fills"""
+        if not self.owns(pair):
+            return []
+        journal = self._pair_journal(pair)
+        fills: List[Fill] = []
+        takers: List[BookOrder] = []
+        if reload:
+            await self._reload_book(conn, pair)
+            # Takers dropped with the overflowing queue still have to execute
+            order_ids = set(order_ids) | {row['order_id'] for row in await self._fetch_takers(conn, pair)}
+        if order_ids:
+            rows = await conn.fetch(ORDERS_BY_ID_SQL, list(order_ids))
+            book = self.get_book(pair)
+            for row in rows:
+                if self._is_taker(row):
+                    # Let earlier arrivals trade first, then execute on arrival
+                    fills += book.match()
+                    taker = self._taker_from_row(row)
+                    if taker is not None:
+                        fills += book.execute(taker, fill_or_kill=row['time_in_force'] == 'FOK')
+                        takers.append(taker)
+                    continue
+                if reload:
+                    # Resting orders were just reloaded as persisted
+                    continue
+                self._apply_order_row(row)
+                if journal:
+                    self._journal_order(journal, book, row['order_id'])
+
+        book = self.get_book(pair)
+        fills = await self._match_pair(conn, book, fills, takers)
+        if journal and journal.records_since_snapshot >= SNAPSHOT_RECORDS:
+            await self._write_snapshot(journal, book)
+        return fills
+
+    @staticmethod
+    def _is_live(row) -> bool:
+        return row['status'] in LIVE_STATUSES and row['quantity'] > (row['filled_quantity'] or 0)
+
+    @classmethod
+    def _is_resting(cls, row) -> bool:
+        """Live order that sits on the book: GTC limit, iceberg or triggered stop-limit"""
+        if row['order_type'] == 'STOP':
+            active = row['triggered_at'] is not None
+        else:
+            active = row['order_type'] in ('LIMIT', 'ICEBERG')
+        return (
+            active
+            and cls._is_live(row)
+            and row['time_in_force'] == 'GTC'
+            and row['price'] is not None
+        )
+
+    @classmethod
+    def _is_pending_stop(cls, row) -> bool:
+        """Live stop order waiting for its stop price"""
+        return (
+            row['order_type'] == 'STOP'
+            and row['triggered_at'] is None
+            and row['stop_price'] is not None
+            and cls._is_live(row)
+        )
+
+    @classmethod
+    def _is_taker(cls, row) -> bool:
+        """Live order that executes on arrival: market, IOC, FOK or a triggered stop of those"""
+        if not cls._is_live(row):
+            return False
+        if row['order_type'] == 'STOP':
+            return row['triggered_at'] is not None and (row['price'] is None or row['time_in_force'] != 'GTC')
+        return row['order_type'] == 'MARKET' or row['time_in_force'] in IMMEDIATE_TIME_IN_FORCE
+
+    def _taker_from_row(self, row) -> Optional[BookOrder]:
+        try:
+            taker = BookOrder.from_record(row, get_pair_spec(row['pair']))
+        except ValueError as e:
+            logger.error(f"Not executing order {row['order_id']}: {e}")
+            return None
+        if row['order_type'] == 'MARKET':
+            # Market orders take any price, whatever was sent along with them
+            taker.price = None
+        return taker
+
+    def _is_current(self, row) -> bool:
+        """Whether the book already reflects this persisted order state"""
+        book = self.books.get(row['pair'])
+        order = (book.get(row['order_id']) or book.stops.get(row['order_id'])) if book else None
+        if self._is_taker(row):
+            # Still waiting to execute
+            return False
+        if not (self._is_resting(row) or self._is_pending_stop(row)):
+            return order is None
+        if order is None:
+            return False
+
+        spec = get_pair_spec(row['pair'])
+
+        def same(scale, value, persisted):
+            if value is None or persisted is None:
+                return value is None and persisted is None
+            return scale(value) == persisted
+
+        return (
+            same(spec.price, order.price, row['price'])
+            and same(spec.price, order.stop_price, row['stop_price'] if order.stop_price is not None else None)
+            and same(spec.quantity, order.display_quantity, row['display_quantity'])
+            and spec.quantity(order.quantity) == row['quantity']
+            and spec.quantity(order.filled_quantity) == row['filled_quantity']
+        )
+
+    def _apply_order_row(self, row):
+        """Make the book agree with the persisted state of one order"""
+        if row['pair'] not in PAIR_SPECS:
+            # Not listed, so never matched
+            return
+        book = self.get_book(row['pair'])
+        if not (self._is_resting(row) or self._is_pending_stop(row)):
+            book.remove(row['order_id'])
+            return
+        try:
+            order = BookOrder.from_record(row, get_pair_spec(row['pair']))
+        except ValueError as e:
+            # Off-grid price or quantity; it cannot be matched in whole ticks and lots
+            logger.error(f"Not booking order {row['order_id']}: {e}")
+            book.remove(row['order_id'])
+            return
+        book.upsert(order)
+
+    async def _match_pair(self, conn, book: OrderBook, fills: List[Fill] = (),
+                          takers: List[BookOrder] = ()) -> List[Fill]:
+        """
+        Uncross a pair's book and persist the resulting fills as one batch.
+
+        `fills` already executed by incoming `takers` go into the same batch,
+        together with cancelling whatever the takers left unfilled. Stops
+        reached by the batch's trades trigger and execute within it too.
+        """
+        fills = list(fills) + book.match()
+        takers = list(takers)
+        triggered = self._trigger_stops(book, fills, takers)
+
+        journal = self._pair_journal(book.pair)
+        if journal:
+            # Write ahead: the journal must never be behind the database
+            journal.record_fills(fills)
+            for order in triggered:
+                self._journal_order(journal, book, order.order_id)
+            # Off the event loop, but still finished before the transaction starts
+            await asyncio.to_thread(journal.flush)
+        if not fills and not takers:
+            return fills
+
+        if fills:
+            print(f"⚡ Executing {len(fills)} trade(s) on {book.pair}")
+        if triggered:
+            print(f"🎯 Triggered {len(triggered)} stop order(s) on {book.pair}")
+        try:
+            async with conn.transaction():
+                if self.leases is None:
+                    # Keep the engine's own order updates out of the notification channel
+                    await conn.execute("SELECT set_config('cantondex.writer', 'matching_engine', true)")
+                elif await conn.fetchval(FENCE_SQL, book.pair, self.leases.replica_id) is None:
+                    # Sets cantondex.writer likewise, if the lease still holds
+                    raise LeaseLost(book.pair)
+                # Before the fills, which may leave a triggered stop no longer live
+                await mark_triggered(conn, triggered)
+                matched_at = await persist_fills(conn, fills, settle=self.ledger is None)
+                await expire_orders(conn, takers)
+        except StaleOrderError as e:
+            # A client cancelled an order the book still held; start over from the database
+            logger.warning(f"{e}; rematching {book.pair} from the database")
+            return await self.process_pair(conn, book.pair, set(), reload=True)
+        except LeaseLost as e:
+            # Another replica may be matching the pair already; nothing was written
+            logger.warning(str(e))
+            if book.pair in self.leases.held:
+                self._drop_pair(book.pair)
+            return []
+        except Exception:
+            # The book already reflects the fills; put it back to what was persisted
+            await self._reload_book(conn, book.pair)
+            raise
+
+        if self.ledger is not None:
+            self.ledger.add(fills)
+        invalidate_soon(party_keys(fill_parties(fills) | {taker.party_id for taker in takers}))
+        self.candles.add(fills, matched_at)
+        self.ticker.add(fills, matched_at)
+        return fills
+
+    @staticmethod
+    def _trigger_stops(book: OrderBook, fills: List[Fill], takers: List[BookOrder]) -> List[BookOrder]:
+        """
+        Trigger the stops reached by `fills` and execute them on the spot.
+
+        A triggered stop-limit takes what it can and rests the remainder; a
+        stop-market (or IOC/FOK stop) joins `takers` to have its remainder
+        cancelled. Their trades are appended to `fills` and may reach further
+        stops, so this repeats until a round triggers nothing new.
+        """
+        triggered = []
+        checked = 0
+        while checked < len(fills):
+            prices = [fill.price for fill in fills[checked:]]
+            checked = len(fills)
+            for order in book.trigger_stops(max(prices), min(prices)):
+                triggered.append(order)
+                fills += book.execute(order, fill_or_kill=order.time_in_force == 'FOK')
+                if order.price is None or order.time_in_force != 'GTC':
+                    takers.append(order)
+                elif order.remaining > 0:
+                    book.add(order)
+        return triggered
+
+    @staticmethod
+    def _journal_order(journal: PairJournal, book: OrderBook, order_id):
+        """Journal the book's current state of one order"""
+        order = book.get(order_id) or book.stops.get(order_id)
+        if order is not None:
+            journal.record_order(order)
+        else:
+            journal.record_remove(order_id)
+
+    @staticmethod
+    async def _fetch_takers(conn, pair: Optional[str] = None):
+        """Live orders that execute on arrival, oldest first"""
+        return await conn.fetch(TAKERS_SQL, list(IMMEDIATE_TIME_IN_FORCE), pair)
+
+    async def _reload_book(self, conn, pair: str):
+        """Rebuild one pair's book from its live orders in the database"""
+        rows = await conn.fetch(PAIR_ORDERS_SQL, pair)
+
+        self.books[pair] = OrderBook(pair)
+        self._rebuilt_pairs.add(pair)
+        for row in rows:
+            self._apply_order_row(row)
 
-        # Check for cross
-        if best_bid['price'] >= best_ask['price']:
-            # Match found!
-            match_price = best_ask['price'] # Price-time priority (maker's price)
-            match_qty = min(best_bid['quantity'] - best_bid['filled_quantity'], 
-                          best_ask['quantity'] - best_ask['filled_quantity'])
-            
-            if match_qty > 0:
-                await self._execute_trade(conn, best_bid, best_ask, match_price, match_qty)
-
-    async def _execute_trade(self, conn, bid, ask, price, quantity):
-        """Execute the trade atomically"""
-        print(f"⚡ Executing Trade: {quantity} {bid['pair']} @ {price}")
-        
-        async with conn.transaction():
-            # Update Bidder (Buyer)
-            await conn.execute("""
-                UPDATE orders 
-                SET filled_quantity = filled_quantity + $1,
-                    status = CASE WHEN filled_quantity + $1 >= quantity THEN 'FILLED' ELSE 'PARTIAL' END,
-                    updated_at = NOW()
-                WHERE order_id = $2
-            """, quantity, bid['order_id'])
-
-            # Update Asker (Seller)
-            await conn.execute("""
-                UPDATE orders 
-                SET filled_quantity = filled_quantity + $1,
-                    status = CASE WHEN filled_quantity + $1 >= quantity THEN 'FILLED' ELSE 'PARTIAL' END,
-                    updated_at = NOW()
-                WHERE order_id = $2
-            """, quantity, ask['order_id'])
-
-            # Create Trade Record
-            await conn.execute("""
-                INSERT INTO trades (
-                    pair, price, quantity, 
-                    bid_order_id, ask_order_id,
-                    maker_order_id, taker_order_id,
-                    settlement_status
-                ) VALUES ($1, $2, $3, $4, $5, $5, $4, 'COMPLETED')
-            """, bid['pair'], price, quantity, bid['order_id'], ask['order_id'])
-
-            # Transfer Assets (Simplified for now - real implementation would update balances)
-            # In a real system, we would unlock the frozen assets and swap them here.
-            # For this demo, we assume the order placement locked the assets and we just update the balances.
-            
-            base, quote = bid['pair'].split('/')
-            total_cost = price * quantity
-
-            # Buyer: +Base, -Quote (Locked)
-            # Seller: -Base (Locked), +Quote
-
-            # Update Buyer Balances
-            # Unlock Quote (cost) and deduct it
-            await conn.execute("""
-                UPDATE balances SET locked = locked - $1 WHERE account_id = $2 AND asset_symbol = $3
-            """, total_cost, bid['account_id'], quote)
-            
-            # Add Base
-            await conn.execute("""
-                INSERT INTO balances (account_id, asset_symbol, available)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (account_id, asset_symbol) 
-                DO UPDATE SET available = balances.available + $3
-            """, bid['account_id'], base, quantity)
-
-            # Update Seller Balances
-            # Unlock Base (quantity) and deduct it
-            await conn.execute("""
-                UPDATE balances SET locked = locked - $1 WHERE account_id = $2 AND asset_symbol = $3
-            """, quantity, ask['account_id'], base)
-
-            # Add Quote
-            await conn.execute("""
-                INSERT INTO balances (account_id, asset_symbol, available)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (account_id, asset_symbol) 
-                DO UPDATE SET available = balances.available + $3
-            """, ask['account_id'], quote, total_cost)
+        journal = self._pair_journal(pair)
+        if journal:
+            # Supersedes anything journaled for this pair so far
+            await self._write_snapshot(journal, self.books[pair])
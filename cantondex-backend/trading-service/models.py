@@ -1,6 +1,8 @@
 from pydantic import BaseModel
 from typing import Optional, List
+from enum import Enum
 from datetime import datetime
+from decimal import Decimal
 
 class CreateAccountRequest(BaseModel):
     party_id: str
@@ -23,20 +25,35 @@ class BalanceResponse(BaseModel):
 class DepositRequest(BaseModel):
     account_id: str
     asset_symbol: str
-    amount: float
+    amount: Decimal
 
 class WithdrawRequest(BaseModel):
     account_id: str
     asset_symbol: str
-    amount: float
+    amount: Decimal
 
 class CreateOrderRequest(BaseModel):
     account_id: str
     pair: str
     side: str  # BUY or SELL
     order_type: str  # LIMIT or MARKET
-    quantity: float
-    price: Optional[float] = None
+    quantity: Decimal
+    price: Optional[Decimal] = None
+    time_in_force: str = "GTC"  # GTC, IOC or FOK
+    stop_price: Optional[Decimal] = None  # STOP orders only
+    display_quantity: Optional[Decimal] = None  # ICEBERG orders only
+    max_cost: Optional[Decimal] = None  # Quote budget; buys without a price only
+
+class CreateOrdersRequest(BaseModel):
+    orders: List[CreateOrderRequest]
+
+class CancelOrdersRequest(BaseModel):
+    account_id: str
+    order_ids: List[str]
+
+class CancelOrdersResponse(BaseModel):
+    cancelled: List[str]
+    not_cancelled: List[str]  # Unknown, another account's, or no longer live
 
 class OrderResponse(BaseModel):
     order_id: str
@@ -45,12 +62,58 @@ class OrderResponse(BaseModel):
     pair: str
     side: str
     order_type: str
+    time_in_force: str = "GTC"
     quantity: float
     price: Optional[float]
     status: str
     filled_quantity: float
     created_at: datetime
 
+class OrderBookLevel(BaseModel):
+    price: str
+    quantity: str  # Displayed quantity; hidden iceberg reserves are not shown
+    order_count: int
+
+class OrderBookResponse(BaseModel):
+    pair: str
+    bids: List[OrderBookLevel]
+    asks: List[OrderBookLevel]
+    updated_at: datetime
+
+class HistoryKind(str, Enum):
+    orders = "orders"
+    trades = "trades"
+    transactions = "transactions"
+
+class HistoryPage(BaseModel):
+    items: List[dict]
+    next: Optional[str]  # Pass back as `after` for the next page; None on the last
+
+class CandleResolution(str, Enum):
+    second = "1s"
+    minute = "1m"
+    five_minutes = "5m"
+    hour = "1h"
+    day = "1d"
+
+class CandleResponse(BaseModel):
+    open_time: datetime
+    open: str
+    high: str
+    low: str
+    close: str
+    volume: str  # Base quantity traded
+    trade_count: int
+
+class TickerResponse(BaseModel):
+    pair: str
+    last_price: Optional[str]
+    price_change_24h: Optional[str]
+    price_change_percent_24h: Optional[str]
+    high_24h: Optional[str]
+    low_24h: Optional[str]
+    volume_24h: str  # Base quantity traded
+
 class TransactionResponse(BaseModel):
     transaction_id: str
     status: str
@@ -0,0 +1,589 @@
+"""
+CantonDEX In-Memory Order Book
+Price-time priority book kept resident by the matching engine
+"""
+
+import uuid
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from itertools import count, islice
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+BUY = "BUY"
+SELL = "SELL"
+
+
+class BookOrder:
+    """
+    Resting order as held by the book.
+
+    The engine stores `price` in ticks and the quantities in lots (see
+    instruments.PairSpec); the book itself only compares and subtracts them.
+
+    An order with a `stop_price` is an untriggered stop and waits in the
+    book's StopIndex. An order with a `display_quantity` is an iceberg that
+    only shows `shown` of its remaining quantity at a time.
+
+    A buy that takes any price has a `budget` instead, the quote it has
+    reserved and not yet spent, in ticks times lots; it never executes
+    beyond it.
+
+    `arrival` is stamped by the book when the order starts resting, and
+    decides which of two crossing orders was there first.
+    """
+
+    __slots__ = (
+        "order_id", "account_id", "party_id", "pair", "side",
+        "price", "quantity", "filled_quantity", "created_at",
+        "time_in_force", "stop_price", "display_quantity", "shown", "budget", "arrival",
+    )
+
+    def __init__(self, order_id, account_id, party_id, pair, side,
+                 price, quantity, filled_quantity=0, created_at=None,
+                 time_in_force="GTC", stop_price=None, display_quantity=None, budget=None):
+        self.order_id = order_id
+        self.account_id = account_id
+        self.party_id = party_id
+        self.pair = pair
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.filled_quantity = filled_quantity
+        self.created_at = created_at
+        self.time_in_force = time_in_force
+        self.stop_price = stop_price
+        self.display_quantity = display_quantity
+        self.shown = None if display_quantity is None else min(display_quantity, self.remaining)
+        self.budget = budget
+        self.arrival = None
+
+    @classmethod
+    def from_record(cls, record, spec) -> "BookOrder":
+        """Build a book order from an `orders` row, scaled by the pair's spec"""
+        pending_stop = record['order_type'] == 'STOP' and record['triggered_at'] is None
+        display_quantity = record['display_quantity']
+        budget = None
+        if record['side'] == BUY and (record['price'] is None or record['order_type'] == 'MARKET'):
+            # Without a max_cost nothing was reserved, so nothing may be spent
+            budget = 0 if record['max_cost'] is None else spec.to_cost(record['max_cost'])
+        return cls(
+            order_id=record['order_id'],
+            account_id=record['account_id'],
+            party_id=record['party_id'],
+            pair=record['pair'],
+            side=record['side'],
+            price=None if record['price'] is None else spec.to_ticks(record['price']),
+            quantity=spec.to_lots(record['quantity']),
+            filled_quantity=spec.to_lots(record['filled_quantity'] or 0),
+            created_at=record['created_at'],
+            time_in_force=record['time_in_force'],
+            stop_price=spec.to_ticks(record['stop_price']) if pending_stop else None,
+            display_quantity=None if display_quantity is None else spec.to_lots(display_quantity),
+            budget=budget,
+        )
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled_quantity
+
+    @property
+    def visible(self):
+        """Quantity other orders can see and trade against right now"""
+        if self.display_quantity is None:
+            return self.remaining
+        return min(self.shown, self.remaining)
+
+    @property
+    def hidden(self):
+        return self.remaining - self.visible
+
+    def __repr__(self):
+        return f"BookOrder({self.order_id}, {self.side} {self.remaining} {self.pair} @ {self.price})"
+
+
+class Fill:
+    """One execution between a resting maker and an incoming taker"""
+
+    __slots__ = ("trade_id", "pair", "maker", "taker", "price", "quantity")
+
+    def __init__(self, pair, maker: BookOrder, taker: BookOrder, price, quantity):
+        self.trade_id = uuid.uuid4()
+        self.pair = pair
+        self.maker = maker
+        self.taker = taker
+        self.price = price
+        self.quantity = quantity
+
+    @property
+    def buyer(self) -> BookOrder:
+        return self.maker if self.maker.side == BUY else self.taker
+
+    @property
+    def seller(self) -> BookOrder:
+        return self.maker if self.maker.side == SELL else self.taker
+
+    def __repr__(self):
+        return f"Fill({self.quantity} {self.pair} @ {self.price})"
+
+
+class PriceLevel:
+    """
+    FIFO queue of orders resting at one price.
+
+    `quantity` is what the level displays; `hidden` is the undisplayed
+    remainder of its iceberg orders.
+    """
+
+    __slots__ = ("price", "orders", "quantity", "hidden")
+
+    def __init__(self, price):
+        self.price = price
+        self.orders: "OrderedDict[object, BookOrder]" = OrderedDict()
+        self.quantity = 0
+        self.hidden = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self) -> Iterator[BookOrder]:
+        return iter(self.orders.values())
+
+    def head(self) -> BookOrder:
+        """Oldest order at this price"""
+        return next(iter(self.orders.values()))
+
+    def append(self, order: BookOrder):
+        self.orders[order.order_id] = order
+        self.quantity += order.visible
+        self.hidden += order.hidden
+
+    def discard(self, order: BookOrder):
+        if self.orders.pop(order.order_id, None) is not None:
+            self.quantity -= order.visible
+            self.hidden -= order.hidden
+
+    def replenish(self, order: BookOrder):
+        """Show the next slice of an iceberg, which goes to the back of the queue"""
+        order.shown = min(order.display_quantity, order.remaining)
+        self.quantity += order.shown
+        self.hidden -= order.shown
+        self.orders.move_to_end(order.order_id)
+
+
+class SortedKeys:
+    """
+    Sorted, distinct keys, held as a list of sorted chunks: a two-level
+    B-tree. Adding or removing a key bisects the chunk maxima, then shifts
+    only within one chunk of at most 2 * CHUNK keys, so it costs
+    O(log n + CHUNK) rather than a flat list's O(n). The largest key is
+    O(1) to read and to pop.
+    """
+
+    CHUNK = 128
+
+    def __init__(self):
+        self._chunks: List[List] = []
+        self._maxes: List = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __reversed__(self) -> Iterator:
+        for chunk in reversed(self._chunks):
+            yield from reversed(chunk)
+
+    def last(self):
+        return self._maxes[-1]
+
+    def add(self, key):
+        self._len += 1
+        if not self._maxes:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._chunks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._chunks[i], key)
+        chunk = self._chunks[i]
+        if len(chunk) > 2 * self.CHUNK:
+            self._chunks[i:i + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self._maxes[i:i + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        chunk = self._chunks[i]
+        if i == len(self._maxes) - 1 and chunk[-1] == key:
+            chunk.pop()
+        else:
+            del chunk[bisect_left(chunk, key)]
+        self._len -= 1
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+
+class BookSide:
+    """
+    One side of the book.
+
+    Levels are keyed so that the best price always sorts last: bids use the
+    price itself, asks use its negation. Best-level lookup and removal are
+    O(1); adding or removing any other level is O(log n) plus a shift
+    within one chunk of SortedKeys.
+
+    Every change to a level bumps `version` and records its price in
+    `changed`, so aggregated depth can be cached and persisted incrementally.
+    """
+
+    def __init__(self, side: str):
+        self.side = side
+        self._keys = SortedKeys()
+        self._levels: Dict[object, PriceLevel] = {}
+        self.version = 0
+        self.changed: Set = set()
+
+    def _key(self, price):
+        return price if self.side == BUY else -price
+
+    def __len__(self):
+        return len(self._keys)
+
+    def best(self) -> Optional[PriceLevel]:
+        """Best price level, or None if the side is empty"""
+        if not self._keys:
+            return None
+        return self._levels[self._keys.last()]
+
+    def level(self, price) -> Optional[PriceLevel]:
+        return self._levels.get(self._key(price))
+
+    def levels(self) -> Iterator[PriceLevel]:
+        """Price levels from best to worst"""
+        for key in reversed(self._keys):
+            yield self._levels[key]
+
+    def top(self, count: int) -> List[PriceLevel]:
+        """The `count` best price levels"""
+        return [self._levels[key] for key in islice(reversed(self._keys), count)]
+
+    def touch(self, price):
+        """Note that the level at `price` changed"""
+        self.version += 1
+        self.changed.add(price)
+
+    def add(self, order: BookOrder):
+        key = self._key(order.price)
+        level = self._levels.get(key)
+        if level is None:
+            level = PriceLevel(order.price)
+            self._levels[key] = level
+            self._keys.add(key)
+        level.append(order)
+        self.touch(order.price)
+
+    def remove(self, order: BookOrder):
+        key = self._key(order.price)
+        level = self._levels.get(key)
+        if level is None:
+            return
+        level.discard(order)
+        self.touch(order.price)
+        if not level.orders:
+            self._drop_level(key)
+
+    def reduce(self, order: BookOrder, quantity):
+        """
+        Account for `quantity` of `order` having been filled.
+
+        Fills only ever take displayed quantity. An iceberg whose slice runs
+        out shows its next one and loses its place in the queue.
+        """
+        level = self._levels[self._key(order.price)]
+        level.quantity -= quantity
+        order.filled_quantity += quantity
+        self.touch(order.price)
+        if order.display_quantity is not None:
+            order.shown -= quantity
+            if order.shown <= 0 < order.remaining:
+                level.replenish(order)
+
+    def _drop_level(self, key):
+        del self._levels[key]
+        self._keys.remove(key)
+
+
+class StopIndex:
+    """
+    Untriggered stop orders of one pair, ordered by stop price.
+
+    Like BookSide, each side is kept sorted so that the stops a trade
+    price reaches first sort last: buy stops by descending stop price, sell
+    stops by ascending stop price, oldest first among equal stops. A trade
+    price therefore triggers k stops with one binary search's worth of
+    comparisons plus k pops off the end of a list.
+    """
+
+    def __init__(self):
+        self._buys: List[Tuple] = []
+        self._sells: List[Tuple] = []
+        self._entries: Dict[object, Tuple] = {}
+        self._orders: Dict[object, BookOrder] = {}
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __iter__(self) -> Iterator[BookOrder]:
+        return iter(list(self._orders.values()))
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def get(self, order_id) -> Optional[BookOrder]:
+        return self._orders.get(order_id)
+
+    def add(self, order: BookOrder):
+        if order.order_id in self._orders:
+            raise ValueError(f"Stop {order.order_id} is already indexed")
+        key = -order.stop_price if order.side == BUY else order.stop_price
+        entry = (key, -next(self._sequence), order.order_id)
+        insort(self._buys if order.side == BUY else self._sells, entry)
+        self._entries[order.order_id] = entry
+        self._orders[order.order_id] = order
+
+    def remove(self, order_id) -> Optional[BookOrder]:
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            entries = self._buys if order.side == BUY else self._sells
+            del entries[bisect_left(entries, self._entries.pop(order_id))]
+        return order
+
+    def triggered(self, high, low) -> List[BookOrder]:
+        """
+        Take out every stop reached by trades between `low` and `high`.
+
+        Buy stops trigger at or below the highest trade price, sell stops
+        at or above the lowest. Returned nearest stop first.
+        """
+        orders = []
+        while self._buys and -self._buys[-1][0] <= high:
+            orders.append(self._take(self._buys))
+        while self._sells and self._sells[-1][0] >= low:
+            orders.append(self._take(self._sells))
+        return orders
+
+    def _take(self, entries: List[Tuple]) -> BookOrder:
+        order_id = entries.pop()[2]
+        del self._entries[order_id]
+        return self._orders.pop(order_id)
+
+
+class OrderBook:
+    """Limit order book for a single trading pair"""
+
+    def __init__(self, pair: str):
+        self.pair = pair
+        self.bids = BookSide(BUY)
+        self.asks = BookSide(SELL)
+        self.stops = StopIndex()
+        self._orders: Dict[object, BookOrder] = {}
+        self._arrivals = count()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def get(self, order_id) -> Optional[BookOrder]:
+        return self._orders.get(order_id)
+
+    def side(self, side: str) -> BookSide:
+        return self.bids if side == BUY else self.asks
+
+    def best_bid(self) -> Optional[BookOrder]:
+        level = self.bids.best()
+        return level.head() if level else None
+
+    def best_ask(self) -> Optional[BookOrder]:
+        level = self.asks.best()
+        return level.head() if level else None
+
+    def take_changes(self) -> List[Tuple[str, int, int, int]]:
+        """
+        (side, price, quantity, order count) of each level changed since the
+        last call. A level that has emptied is reported with zero orders.
+        """
+        changes = []
+        for side in (self.bids, self.asks):
+            for price in side.changed:
+                level = side.level(price)
+                if level is None:
+                    changes.append((side.side, price, 0, 0))
+                else:
+                    changes.append((side.side, price, level.quantity, len(level)))
+            side.changed.clear()
+        return changes
+
+    def is_crossed(self) -> bool:
+        bid = self.best_bid()
+        ask = self.best_ask()
+        return bid is not None and ask is not None and bid.price >= ask.price
+
+    def add(self, order: BookOrder):
+        """Rest an order at the back of its price level, or index it if it is a stop"""
+        if order.order_id in self._orders:
+            raise ValueError(f"Order {order.order_id} is already on the book")
+        if order.remaining <= 0:
+            raise ValueError(f"Order {order.order_id} has no remaining quantity")
+        if order.stop_price is not None:
+            self.stops.add(order)
+            return
+        order.arrival = next(self._arrivals)
+        self._orders[order.order_id] = order
+        self.side(order.side).add(order)
+
+    def remove(self, order_id) -> Optional[BookOrder]:
+        """Take an order off the book or out of the stops, returning it if found"""
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self.side(order.side).remove(order)
+            return order
+        return self.stops.remove(order_id)
+
+    def upsert(self, order: BookOrder):
+        """
+        Apply the persisted state of an order.
+
+        An order already resting at the same price keeps its queue position
+        and only has its quantities refreshed.
+        """
+        current = self._orders.get(order.order_id)
+        if current is None or order.stop_price is not None:
+            self.remove(order.order_id)
+            self.add(order)
+            return
+        if current.price != order.price or current.side != order.side:
+            self.remove(order.order_id)
+            self.add(order)
+            return
+        level = self.side(current.side).level(current.price)
+        level.quantity -= current.visible
+        level.hidden -= current.hidden
+        current.quantity = order.quantity
+        current.filled_quantity = order.filled_quantity
+        current.display_quantity = order.display_quantity
+        if current.display_quantity is not None:
+            # Keep what is left of the slice on show, if anything
+            current.shown = min(current.shown or 0, current.remaining) or order.shown
+        level.quantity += current.visible
+        level.hidden += current.hidden
+        self.side(current.side).touch(current.price)
+        if current.remaining <= 0:
+            self.remove(current.order_id)
+
+    def match(self) -> List[Fill]:
+        """
+        Uncross the book.
+
+        Keeps filling the best bid against the best ask until they no longer
+        cross, sweeping as many levels as it takes. The order that started
+        resting first, by arrival, is the maker and sets the price. Fills are returned in
+        execution order.
+        """
+        fills = []
+        while True:
+            bid = self.best_bid()
+            ask = self.best_ask()
+            if bid is None or ask is None or bid.price < ask.price:
+                return fills
+
+            maker, taker = (bid, ask) if bid.arrival < ask.arrival else (ask, bid)
+            quantity = min(bid.visible, ask.visible)
+            fills.append(Fill(self.pair, maker, taker, maker.price, quantity))
+            self.fill(bid, quantity)
+            self.fill(ask, quantity)
+
+    def execute(self, taker: BookOrder, fill_or_kill: bool = False) -> List[Fill]:
+        """
+        Fill an incoming order against the opposite side without resting it.
+
+        Walks the opposite side best price first in a single pass until the
+        taker is filled or the next level is beyond its limit. A taker with
+        no price (a market order) accepts any price, and a buy among those
+        stops once its budget would not cover another lot. With
+        `fill_or_kill` nothing executes unless the whole quantity can.
+        Whatever is left unfilled is up to the caller; it is never added to
+        the book.
+        """
+        if fill_or_kill and self.depth(taker.side, taker.price, taker.remaining, taker.budget) < taker.remaining:
+            return []
+
+        opposite = self.asks if taker.side == BUY else self.bids
+        fills = []
+        while taker.remaining > 0:
+            level = opposite.best()
+            if level is None or not self._accepts(taker, level.price):
+                break
+            maker = level.head()
+            quantity = min(maker.visible, taker.remaining)
+            if taker.budget is not None:
+                quantity = min(quantity, taker.budget // level.price)
+                if quantity <= 0:
+                    break
+                taker.budget -= quantity * level.price
+            fills.append(Fill(self.pair, maker, taker, maker.price, quantity))
+            self.fill(maker, quantity)
+            taker.filled_quantity += quantity
+        return fills
+
+    def depth(self, side: str, limit, quantity, budget=None):
+        """
+        Quantity an incoming `side` order could take at `limit` or better,
+        and within `budget` if it has one.
+
+        Counts hidden iceberg quantity too, since an incoming order keeps
+        trading against replenished slices. Stops counting once `quantity`
+        is reached, so it only visits as many levels as the order would
+        consume.
+        """
+        opposite = self.asks if side == BUY else self.bids
+        probe = BookOrder(None, None, None, self.pair, side, limit, quantity)
+        total = 0
+        for level in opposite.levels():
+            if total >= quantity or not self._accepts(probe, level.price):
+                break
+            available = level.quantity + level.hidden
+            if budget is not None:
+                taken = min(available, quantity - total, budget // level.price)
+                budget -= taken * level.price
+                if taken < min(available, quantity - total):
+                    return total + taken
+            total += available
+        return total
+
+    @staticmethod
+    def _accepts(taker: BookOrder, price) -> bool:
+        if taker.price is None:
+            return True
+        return price <= taker.price if taker.side == BUY else price >= taker.price
+
+    def fill(self, order: BookOrder, quantity):
+        """Record a fill against a resting order, dropping it once complete"""
+        self.side(order.side).reduce(order, quantity)
+        if order.remaining <= 0:
+            self.remove(order.order_id)
+
+    def trigger_stops(self, high, low) -> List[BookOrder]:
+        """Release the stops reached by trades between `low` and `high` as live orders"""
+        orders = self.stops.triggered(high, low)
+        for order in orders:
+            order.stop_price = None
+        return orders
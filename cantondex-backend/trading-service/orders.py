@@ -0,0 +1,245 @@
+"""
+CantonDEX Order Entry
+Validates, reserves funds for and inserts or cancels orders in array-based batches
+"""
+
+import os
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+
+from database import prepare_on_connect
+from events import EVENTS_ENABLED, order_events, write_events
+from instruments import get_pair_spec
+from ledger import BalanceLedger
+from matching_engine import ORDER_COLUMNS
+from models import CreateOrderRequest
+from order_book import BookOrder, BUY, SELL
+from persistence import apply_balance_deltas, release_deltas, reserve_balances
+
+ORDER_TYPES = ('LIMIT', 'MARKET', 'STOP', 'ICEBERG')
+TIME_IN_FORCE = ('GTC', 'IOC', 'FOK')
+
+# Largest batch accepted by POST /orders/batch and DELETE /orders/batch
+MAX_BATCH_ORDERS = int(os.getenv("ORDER_BATCH_MAX_ORDERS", "500"))
+
+ACCOUNTS_SQL = """
+    SELECT account_id, party_id, account_status FROM trading_accounts
+    WHERE account_id = ANY($1::uuid[])
+"""
+
+# Stamped a microsecond apart so a batch keeps its time priority order
+INSERT_ORDERS_SQL = f"""
+    INSERT INTO orders (
+        order_id, account_id, party_id, pair, side, order_type, time_in_force,
+        quantity, price, stop_price, display_quantity, max_cost, created_at, updated_at
+    )
+    SELECT o.order_id, o.account_id, o.party_id, o.pair, o.side, o.order_type, o.time_in_force,
+           o.quantity, o.price, o.stop_price, o.display_quantity, o.max_cost,
+           LOCALTIMESTAMP + (o.n - 1) * interval '1 microsecond',
+           LOCALTIMESTAMP + (o.n - 1) * interval '1 microsecond'
+    FROM unnest(
+        $1::uuid[], $2::uuid[], $3::varchar[], $4::varchar[], $5::varchar[], $6::varchar[],
+        $7::varchar[], $8::numeric[], $9::numeric[], $10::numeric[], $11::numeric[], $12::numeric[]
+    ) WITH ORDINALITY AS o(
+        order_id, account_id, party_id, pair, side, order_type, time_in_force,
+        quantity, price, stop_price, display_quantity, max_cost, n
+    )
+    RETURNING {ORDER_COLUMNS}
+"""
+
+CANCEL_ORDERS_SQL = f"""
+    UPDATE orders SET status = 'CANCELLED', updated_at = NOW()
+    WHERE order_id = ANY($1::uuid[]) AND account_id = $2
+      AND status IN ('OPEN', 'PARTIALLY_FILLED')
+    RETURNING {ORDER_COLUMNS}
+"""
+
+# Run for every batch placed or cancelled, so every pooled connection prepares them up front
+prepare_on_connect(ACCOUNTS_SQL, INSERT_ORDERS_SQL, CANCEL_ORDERS_SQL)
+
+
+class OrderRejected(ValueError):
+    """Orders that failed validation, as a list of {index, error}"""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__("; ".join(f"order {e['index']}: {e['error']}" for e in errors))
+        self.errors = errors
+
+
+def _positive(value, what: str) -> Decimal:
+    if value is None or value <= 0:
+        raise ValueError(f"{what} must be positive")
+    return value
+
+
+def validate_order(request: CreateOrderRequest) -> Tuple[str, Decimal]:
+    """
+    Check an order against its type and its pair's tick and lot sizes.
+
+    Returns the asset and amount the order has to reserve: a sell its base
+    quantity, a buy its quantity at its limit price, which is what
+    release_deltas gives back. A buy without a limit price (market or
+    stop-market) reserves the max_cost it has to name instead, and never
+    executes beyond it.
+    """
+    base, _, quote = request.pair.partition('/')
+    if not base or not quote:
+        raise ValueError(f"pair {request.pair!r} is not of the form BASE/QUOTE")
+    if request.side not in (BUY, SELL):
+        raise ValueError(f"side must be one of {BUY}, {SELL}")
+    if request.order_type not in ORDER_TYPES:
+        raise ValueError(f"order_type must be one of {', '.join(ORDER_TYPES)}")
+    if request.time_in_force not in TIME_IN_FORCE:
+        raise ValueError(f"time_in_force must be one of {', '.join(TIME_IN_FORCE)}")
+
+    spec = get_pair_spec(request.pair)
+    spec.to_lots(_positive(request.quantity, "quantity"))
+
+    if request.order_type == 'MARKET':
+        if request.price is not None:
+            raise ValueError("MARKET orders take no price")
+    elif request.price is not None:
+        spec.to_ticks(_positive(request.price, "price"))
+    elif request.order_type != 'STOP':
+        raise ValueError(f"{request.order_type} orders need a price")
+
+    if request.order_type == 'STOP':
+        spec.to_ticks(_positive(request.stop_price, "stop_price"))
+    elif request.stop_price is not None:
+        raise ValueError("only STOP orders take a stop_price")
+
+    if request.order_type == 'ICEBERG':
+        spec.to_lots(_positive(request.display_quantity, "display_quantity"))
+        if request.display_quantity > request.quantity:
+            raise ValueError("display_quantity cannot exceed quantity")
+    elif request.display_quantity is not None:
+        raise ValueError("only ICEBERG orders take a display_quantity")
+
+    if request.side == BUY and request.price is None:
+        if request.max_cost is None:
+            raise ValueError("buy orders without a price need a max_cost to reserve funds against")
+        spec.to_cost(_positive(request.max_cost, "max_cost"))
+        return quote, request.max_cost
+    if request.max_cost is not None:
+        raise ValueError("only buy orders without a price take a max_cost")
+
+    if request.side == SELL:
+        return base, request.quantity
+    return quote, request.quantity * request.price
+
+
+class _Shortfall(Exception):
+    """Rolls back a reservation some of whose (account, asset)s came up short"""
+
+    def __init__(self, short: Set[Tuple[object, str]]):
+        super().__init__(f"{len(short)} balance(s) short")
+        self.short = short
+
+
+async def place_orders(conn, requests: List[CreateOrderRequest], ledger: Optional[BalanceLedger] = None) -> List:
+    """
+    Validate, reserve funds for and insert a batch of orders.
+
+    All or nothing: any problem raises OrderRejected and leaves no trace.
+    The database work is a fixed handful of statements in one transaction
+    whatever the batch size. Returns the inserted rows in request order;
+    the caller hands them to the matching engine, so their inserts are not
+    announced on the order notification channel.
+
+    Fill proceeds the matching engine's `ledger` still holds are not in
+    the balances yet; a batch that comes up short where some are due
+    settles them and tries once more.
+    """
+    errors = []
+    reservations: Dict[Tuple[object, str], Decimal] = defaultdict(Decimal)
+    keys = []
+    for index, request in enumerate(requests):
+        try:
+            account_id = uuid.UUID(request.account_id)
+            asset, amount = validate_order(request)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        keys.append((account_id, asset))
+        reservations[(account_id, asset)] += amount
+    if errors:
+        raise OrderRejected(errors)
+
+    rows = await conn.fetch(ACCOUNTS_SQL, list({account_id for account_id, _ in keys}))
+    accounts = {row['account_id']: row for row in rows}
+    for index, (account_id, _) in enumerate(keys):
+        account = accounts.get(account_id)
+        if account is None:
+            errors.append({'index': index, 'error': f"account {account_id} not found"})
+        elif account['account_status'] != 'ACTIVE':
+            errors.append({'index': index, 'error': f"account {account_id} is {account['account_status']}"})
+    if errors:
+        raise OrderRejected(errors)
+
+    order_ids = [uuid.uuid4() for _ in requests]
+    try:
+        rows = await _insert_orders(conn, requests, keys, accounts, reservations, order_ids)
+    except _Shortfall as e:
+        short = e.short
+        if ledger is not None and ledger.has_credit(short):
+            await ledger.flush(conn)
+            try:
+                rows = await _insert_orders(conn, requests, keys, accounts, reservations, order_ids)
+                short = None
+            except _Shortfall as retry:
+                short = retry.short
+        if short:
+            raise OrderRejected([
+                {'index': index, 'error': f"insufficient {asset} balance"}
+                for index, (account_id, asset) in enumerate(keys) if (account_id, asset) in short
+            ])
+
+    by_id = {row['order_id']: row for row in rows}
+    return [by_id[order_id] for order_id in order_ids]
+
+
+async def _insert_orders(conn, requests, keys, accounts, reservations, order_ids) -> List:
+    """Reserve funds for and insert validated orders in one transaction"""
+    async with conn.transaction():
+        await conn.execute("SELECT set_config('cantondex.writer', 'order_entry', true)")
+        short = set(await reserve_balances(conn, reservations))
+        if short:
+            raise _Shortfall(short)
+
+        rows = await conn.fetch(INSERT_ORDERS_SQL,
+            order_ids,
+            [account_id for account_id, _ in keys],
+            [accounts[account_id]['party_id'] for account_id, _ in keys],
+            [r.pair for r in requests],
+            [r.side for r in requests],
+            [r.order_type for r in requests],
+            [r.time_in_force for r in requests],
+            [r.quantity for r in requests],
+            [r.price for r in requests],
+            [r.stop_price for r in requests],
+            [r.display_quantity for r in requests],
+            [r.max_cost for r in requests],
+        )
+        if EVENTS_ENABLED:
+            await write_events(conn, order_events('OrderCreated', rows))
+    return rows
+
+
+async def cancel_orders(conn, account_id: uuid.UUID, order_ids: List[uuid.UUID]) -> List:
+    """
+    Cancel an account's live orders and release the funds they still hold.
+
+    Orders that are unknown, belong to another account or are no longer
+    live are skipped. Returns the cancelled rows; like place_orders, the
+    caller hands them to the matching engine.
+    """
+    async with conn.transaction():
+        await conn.execute("SELECT set_config('cantondex.writer', 'order_entry', true)")
+        rows = await conn.fetch(CANCEL_ORDERS_SQL, order_ids, account_id)
+        orders = [BookOrder.from_record(row, get_pair_spec(row['pair'])) for row in rows]
+        await apply_balance_deltas(conn, release_deltas(orders))
+        if EVENTS_ENABLED:
+            await write_events(conn, order_events('OrderCancelled', rows))
+    return rows
@@ -0,0 +1,192 @@
+"""
+CantonDEX Event Outbox
+Relays order and trade events from the outbox table to Kafka in batches, in the order they were written
+"""
+
+import asyncio
+import logging
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from database import acquire
+from events import KAFKA_BOOTSTRAP_SERVERS
+
+logger = logging.getLogger(__name__)
+
+# Producer tuning: how long a batch waits for more events, how big it may
+# grow per partition, and how it is compressed on the wire
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "5"))
+KAFKA_BATCH_BYTES = int(os.getenv("KAFKA_BATCH_BYTES", "262144"))
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "gzip")
+
+# Outbox rows relayed per round, and how long the relay sleeps once it
+# has caught up
+OUTBOX_BATCH_ROWS = int(os.getenv("OUTBOX_BATCH_ROWS", "5000"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_MS", "100")) / 1000
+
+# Advisory lock that keeps the relay to one replica at a time, so events
+# leave in outbox order
+OUTBOX_LOCK_KEY = 0x4f5554424f58
+
+# Only rows of transactions older than every one still running: a running
+# transaction may yet commit rows with lower event_ids, but never with a
+# lower txid, so nothing can turn up ahead of what was already relayed
+PENDING_EVENTS_SQL = """
+    SELECT event_id, topic, event_key, payload FROM event_outbox
+    WHERE txid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY txid, event_id
+    LIMIT $1
+"""
+
+
+class FakeBroker:
+    """
+    In-process stand-in for a Kafka cluster, for tests and for running
+    without one. Keeps every topic's messages per partition, in the order
+    they were sent, partitioned by key like Kafka's default partitioner.
+    """
+
+    def __init__(self, partitions: int = 3):
+        self.partitions = partitions
+        # topic -> partition -> [(key, value)]
+        self.topics: Dict[str, List[List[Tuple[bytes, bytes]]]] = {}
+        # Set to make sends fail, as while the cluster is unreachable
+        self.down = False
+
+    def partition(self, key: bytes) -> int:
+        return zlib.crc32(key) % self.partitions
+
+    def append(self, topic: str, key: bytes, value: bytes):
+        if self.down:
+            raise ConnectionError("broker unavailable")
+        partitions = self.topics.setdefault(topic, [[] for _ in range(self.partitions)])
+        partitions[self.partition(key)].append((key, value))
+
+    def messages(self, topic: str, key: Optional[bytes] = None) -> List[bytes]:
+        """A topic's values in send order, of every key or only `key`'s"""
+        partitions = self.topics.get(topic, [])
+        if key is not None:
+            partitions = partitions[self.partition(key):self.partition(key) + 1]
+        return [value for partition in partitions for k, value in partition if key is None or k == key]
+
+
+class FakeProducer:
+    """The slice of aiokafka's AIOKafkaProducer the relay uses, over a FakeBroker"""
+
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, topic: str, value: bytes, key: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.broker.append(topic, key, value)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def create_producer(bootstrap_servers: str = KAFKA_BOOTSTRAP_SERVERS):
+    """A producer for `bootstrap_servers`: a FakeBroker's for memory://, aiokafka's otherwise"""
+    if bootstrap_servers.startswith("memory://"):
+        return FakeProducer(FakeBroker())
+    # Only needed once a Kafka cluster is configured
+    from aiokafka import AIOKafkaProducer
+    # Idempotence keeps each partition in send order across retries
+    return AIOKafkaProducer(
+        bootstrap_servers=bootstrap_servers,
+        linger_ms=KAFKA_LINGER_MS,
+        max_batch_size=KAFKA_BATCH_BYTES,
+        compression_type=KAFKA_COMPRESSION,
+        enable_idempotence=True,
+    )
+
+
+async def publish(producer, rows) -> int:
+    """
+    Send outbox rows, keyed by pair, and wait until every one is
+    acknowledged. Sends only queue a message, so the producer batches the
+    whole lot per partition; returns how many were sent.
+    """
+    futures = [
+        await producer.send(row['topic'], bytes(row['payload']), key=row['event_key'].encode())
+        for row in rows
+    ]
+    await asyncio.gather(*futures)
+    return len(futures)
+
+
+class RelayStats:
+    """Running totals of events relayed, for /metrics/events"""
+
+    def __init__(self):
+        self.published = 0
+        self.rounds = 0
+        self.failures = 0
+
+
+class OutboxRelay:
+    """
+    Moves events from event_outbox to Kafka.
+
+    Each round takes the oldest OUTBOX_BATCH_ROWS rows, publishes them and
+    deletes them in one transaction, so an event is published at least
+    once: a round that fails or is cut short leaves its rows for the next,
+    and consumers drop repeats by event_id. Rows wait until every
+    transaction that started writing before theirs has finished (see
+    PENDING_EVENTS_SQL), so a long-running write transaction holds the
+    relay back until it ends. An advisory lock keeps the relay to one
+    replica at a time. Matching only ever inserts into the outbox, so a
+    slow or unreachable cluster never holds up a match.
+    """
+
+    def __init__(self, producer):
+        self.producer = producer
+        self.stats = RelayStats()
+
+    async def relay_once(self) -> int:
+        """Relay one round of events, returning how many"""
+        async with acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", OUTBOX_LOCK_KEY):
+                    return 0
+                rows = await conn.fetch(PENDING_EVENTS_SQL, OUTBOX_BATCH_ROWS)
+                if not rows:
+                    return 0
+                await publish(self.producer, rows)
+                await conn.execute("DELETE FROM event_outbox WHERE event_id = ANY($1::bigint[])",
+                                   [row['event_id'] for row in rows])
+        self.stats.published += len(rows)
+        self.stats.rounds += 1
+        return len(rows)
+
+    async def run(self):
+        """Relay events until cancelled, sleeping OUTBOX_POLL_INTERVAL whenever caught up"""
+        await self.producer.start()
+        print(f"📤 Relaying events to {KAFKA_BOOTSTRAP_SERVERS}")
+        try:
+            while True:
+                try:
+                    while await self.relay_once() == OUTBOX_BATCH_ROWS:
+                        pass
+                except Exception as e:
+                    self.stats.failures += 1
+                    logger.error(f"Error relaying events: {e}")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+        finally:
+            # Flushes whatever is still queued
+            await self.producer.stop()
+
+    def metrics(self) -> dict:
+        return {
+            "published": self.stats.published,
+            "rounds": self.stats.rounds,
+            "failures": self.stats.failures,
+        }
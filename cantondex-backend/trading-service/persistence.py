@@ -0,0 +1,409 @@
+"""
+CantonDEX Fill Persistence
+Writes a batch of fills with a fixed number of array-based statements
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+
+from database import prepare_on_connect
+from events import EVENTS_ENABLED, ORDER_EVENT_COLUMNS, order_events, trade_events, write_events
+from instruments import get_pair_spec
+from order_book import BookOrder, Fill, BUY
+
+# Columns write_transactions copies, in record order
+TRANSACTION_COLUMNS = (
+    'account_id', 'party_id', 'tx_type', 'asset_symbol', 'amount', 'balance_after', 'order_id', 'trade_id'
+)
+
+# Returns the updated rows for their order events
+FILL_ORDERS_SQL = f"""
+    UPDATE orders o
+    SET filled_quantity = o.filled_quantity + f.quantity,
+        status = CASE WHEN o.filled_quantity + f.quantity >= o.quantity THEN 'FILLED' ELSE 'PARTIALLY_FILLED' END,
+        updated_at = NOW()
+    FROM unnest($1::uuid[], $2::numeric[]) AS f(order_id, quantity)
+    WHERE o.order_id = f.order_id AND o.status IN ('OPEN', 'PARTIALLY_FILLED')
+    RETURNING {", ".join(f"o.{column}" for column in ORDER_EVENT_COLUMNS)}
+"""
+
+INSERT_TRADES_SQL = """
+    INSERT INTO trades (
+        trade_id, pair, price, quantity,
+        maker_order_id, taker_order_id,
+        maker_party_id, taker_party_id,
+        maker_side, settlement_status, settled_at, executed_at
+    )
+    SELECT t.trade_id, t.pair, t.price, t.quantity,
+           t.maker_order_id, t.taker_order_id,
+           t.maker_party_id, t.taker_party_id,
+           t.maker_side, CASE WHEN $10 THEN 'SETTLED' ELSE 'PENDING' END, CASE WHEN $10 THEN NOW() END, NOW()
+    FROM unnest(
+        $1::uuid[], $2::varchar[], $3::numeric[], $4::numeric[],
+        $5::uuid[], $6::uuid[], $7::varchar[], $8::varchar[], $9::varchar[]
+    ) WITH ORDINALITY AS t(
+        trade_id, pair, price, quantity,
+        maker_order_id, taker_order_id,
+        maker_party_id, taker_party_id,
+        maker_side, fill_index
+    )
+    -- trade_seq is drawn in this order, so it follows the order of the fills
+    ORDER BY t.fill_index
+    RETURNING matched_at
+"""
+
+SETTLE_TRADES_SQL = """
+    UPDATE trades SET settlement_status = 'SETTLED', settled_at = NOW()
+    WHERE trade_id = ANY($1::uuid[]) AND settlement_status = 'PENDING'
+    RETURNING trade_id
+"""
+
+EXPIRE_ORDERS_SQL = f"""
+    UPDATE orders SET status = 'CANCELLED', updated_at = NOW()
+    WHERE order_id = ANY($1::uuid[]) AND status IN ('OPEN', 'PARTIALLY_FILLED')
+    RETURNING {", ".join(ORDER_EVENT_COLUMNS)}
+"""
+
+MARK_TRIGGERED_SQL = """
+    UPDATE orders SET triggered_at = NOW(), updated_at = NOW()
+    WHERE order_id = ANY($1::uuid[]) AND status IN ('OPEN', 'PARTIALLY_FILLED')
+"""
+
+ENSURE_BALANCES_SQL = """
+    INSERT INTO balances (account_id, asset_symbol)
+    SELECT * FROM unnest($1::uuid[], $2::varchar[])
+    ON CONFLICT (account_id, asset_symbol) DO NOTHING
+"""
+
+APPLY_BALANCES_SQL = """
+    WITH d AS (
+        SELECT * FROM unnest($1::uuid[], $2::varchar[], $3::numeric[], $4::numeric[])
+            AS d(account_id, asset_symbol, available, locked)
+    ), locked_rows AS (
+        SELECT b.balance_id
+        FROM balances b
+        JOIN d ON b.account_id = d.account_id AND b.asset_symbol = d.asset_symbol
+        ORDER BY b.account_id, b.asset_symbol
+        FOR UPDATE OF b
+    )
+    UPDATE balances b
+    SET available = b.available + d.available,
+        locked = b.locked + d.locked
+    FROM d
+    WHERE b.account_id = d.account_id AND b.asset_symbol = d.asset_symbol
+      AND b.balance_id IN (SELECT balance_id FROM locked_rows)
+    RETURNING b.account_id, b.asset_symbol, b.available + b.locked AS total
+"""
+
+RESERVE_BALANCES_SQL = """
+    WITH d AS (
+        SELECT * FROM unnest($1::uuid[], $2::varchar[], $3::numeric[])
+            AS d(account_id, asset_symbol, amount)
+    ), locked_rows AS (
+        SELECT b.balance_id
+        FROM balances b
+        JOIN d ON b.account_id = d.account_id AND b.asset_symbol = d.asset_symbol
+        ORDER BY b.account_id, b.asset_symbol
+        FOR UPDATE OF b
+    )
+    UPDATE balances b
+    SET available = b.available - d.amount,
+        locked = b.locked + d.amount
+    FROM d
+    WHERE b.account_id = d.account_id AND b.asset_symbol = d.asset_symbol
+      AND b.balance_id IN (SELECT balance_id FROM locked_rows)
+      AND b.available >= d.amount
+    RETURNING b.account_id, b.asset_symbol
+"""
+
+# Run for every batch of fills or orders, so every pooled connection
+# prepares them up front
+prepare_on_connect(
+    FILL_ORDERS_SQL, INSERT_TRADES_SQL, SETTLE_TRADES_SQL, EXPIRE_ORDERS_SQL, MARK_TRIGGERED_SQL,
+    ENSURE_BALANCES_SQL, APPLY_BALANCES_SQL, RESERVE_BALANCES_SQL,
+)
+
+
+class StaleOrderError(RuntimeError):
+    """A batch of fills names an order the database no longer has live"""
+
+
+def order_fill_totals(fills: List[Fill]) -> Dict[object, Decimal]:
+    """Total filled quantity per order across the batch"""
+    lots: Dict[object, int] = defaultdict(int)
+    for fill in fills:
+        lots[fill.maker.order_id] += fill.quantity
+        lots[fill.taker.order_id] += fill.quantity
+    spec = get_pair_spec(fills[0].pair)
+    return {order_id: spec.quantity(total) for order_id, total in lots.items()}
+
+
+def balance_deltas(fills: List[Fill]) -> Dict[Tuple[object, str], List]:
+    """
+    Net (available, locked) change per (account, asset) across the batch.
+
+    The buyer spends locked quote and receives base; the seller spends
+    locked base and receives quote. A buy filled below its limit price
+    reserved more than it spent, and gets the difference unlocked.
+    """
+    deltas: Dict[Tuple[object, str], List] = defaultdict(lambda: [0, 0])
+    for fill in fills:
+        spec = get_pair_spec(fill.pair)
+        base, quote = fill.pair.split('/')
+        quantity = spec.quantity(fill.quantity)
+        total_cost = spec.price(fill.price) * quantity
+        buyer, seller = fill.buyer.account_id, fill.seller.account_id
+
+        deltas[(buyer, quote)][1] -= total_cost
+        deltas[(buyer, base)][0] += quantity
+        deltas[(seller, base)][1] -= quantity
+        deltas[(seller, quote)][0] += total_cost
+
+        limit = fill.buyer.price
+        if limit is not None and limit > fill.price:
+            surplus = spec.price(limit - fill.price) * quantity
+            deltas[(buyer, quote)][0] += surplus
+            deltas[(buyer, quote)][1] -= surplus
+    return deltas
+
+
+def transaction_legs(fills: List[Fill]) -> List[Tuple]:
+    """
+    The transactions rows a batch of fills leaves, as (account, party,
+    asset, amount, order, trade); amounts change the account's total.
+    """
+    legs = []
+    for fill in fills:
+        spec = get_pair_spec(fill.pair)
+        base, quote = fill.pair.split('/')
+        quantity = spec.quantity(fill.quantity)
+        total_cost = spec.price(fill.price) * quantity
+        buyer, seller = fill.buyer, fill.seller
+        legs += [
+            (buyer.account_id, buyer.party_id, quote, -total_cost, buyer.order_id, fill.trade_id),
+            (buyer.account_id, buyer.party_id, base, quantity, buyer.order_id, fill.trade_id),
+            (seller.account_id, seller.party_id, base, -quantity, seller.order_id, fill.trade_id),
+            (seller.account_id, seller.party_id, quote, total_cost, seller.order_id, fill.trade_id),
+        ]
+    return legs
+
+
+def release_deltas(orders: List[BookOrder]) -> Dict[Tuple[object, str], List]:
+    """
+    Funds freed by cancelling the unfilled remainder of each order.
+
+    A sell reserves its base quantity and a limit buy reserves quantity at
+    its limit price. A buy without a price reserved a budget, and gets
+    back whatever of it is unspent, however much quantity is left.
+    """
+    deltas: Dict[Tuple[object, str], List] = defaultdict(lambda: [0, 0])
+    for order in orders:
+        spec = get_pair_spec(order.pair)
+        base, quote = order.pair.split('/')
+        remaining = spec.quantity(order.remaining)
+        if order.budget is not None:
+            if not order.budget:
+                continue
+            asset, amount = quote, spec.cost(order.budget)
+        elif order.side == BUY:
+            asset, amount = quote, spec.price(order.price) * remaining
+        else:
+            asset, amount = base, remaining
+        deltas[(order.account_id, asset)][0] += amount
+        deltas[(order.account_id, asset)][1] -= amount
+    return deltas
+
+
+async def persist_fills(conn, fills: List[Fill], settle: bool = True) -> Optional[datetime]:
+    """
+    Write the order updates, trade rows and balance transfers for a batch.
+
+    Costs five statements whatever the batch size, and one more for the
+    trade and order events when they are on. The caller owns the
+    transaction. All fills in a batch belong to the same pair. With
+    `settle` off the trades are written as PENDING and their balances are
+    left for a BalanceLedger to settle later, in two statements. Returns
+    the trades' matched_at, which the whole batch shares.
+    """
+    if not fills:
+        return None
+    spec = get_pair_spec(fills[0].pair)
+
+    totals = order_fill_totals(fills)
+    filled = await conn.fetch(FILL_ORDERS_SQL, list(totals.keys()), list(totals.values()))
+    if len(filled) != len(totals):
+        # An order was cancelled after the book last saw it; its funds are
+        # already released, so the whole batch has to be matched again
+        raise StaleOrderError(f"{fills[0].pair}: filled orders are no longer live "
+                              f"({len(filled)} of {len(totals)} updated)")
+
+    matched_at = await conn.fetchval(INSERT_TRADES_SQL,
+        [f.trade_id for f in fills],
+        [f.pair for f in fills],
+        [spec.price(f.price) for f in fills],
+        [spec.quantity(f.quantity) for f in fills],
+        [f.maker.order_id for f in fills],
+        [f.taker.order_id for f in fills],
+        [f.maker.party_id for f in fills],
+        [f.taker.party_id for f in fills],
+        [f.maker.side for f in fills],
+        settle,
+    )
+
+    if settle:
+        await settle_balances(conn, balance_deltas(fills), transaction_legs(fills))
+    if EVENTS_ENABLED:
+        await write_events(conn, trade_events(fills, matched_at) + order_events('OrderFilled', filled))
+    return matched_at
+
+
+async def mark_settled(conn, trade_ids: List) -> Set:
+    """
+    Settle PENDING trades, returning the ids this call settled.
+
+    Trades already settled (say by another engine's recovery) are skipped,
+    so each trade's balances are applied exactly once.
+    """
+    rows = await conn.fetch(SETTLE_TRADES_SQL, trade_ids)
+    return {row['trade_id'] for row in rows}
+
+
+async def settle_balances(conn, deltas: Dict[Tuple[object, str], List], legs: List[Tuple]):
+    """Apply balance deltas and record the transactions rows they came from"""
+    totals = await apply_balance_deltas(conn, deltas)
+    await write_transactions(conn, legs, totals)
+
+
+async def write_transactions(conn, legs: List[Tuple], totals: Dict[Tuple[object, str], Decimal]):
+    """
+    COPY TRADE transactions rows for (account, party, asset, amount,
+    order, trade) legs, in order.
+
+    `totals` holds each (account, asset)'s total after every leg was
+    applied, from which each row's balance_after is worked back.
+    """
+    if not legs:
+        return
+    running: Dict[Tuple[object, str], Decimal] = dict(totals)
+    for account_id, _, asset, amount, _, _ in legs:
+        running[(account_id, asset)] -= amount
+    records = []
+    for account_id, party_id, asset, amount, order_id, trade_id in legs:
+        running[(account_id, asset)] += amount
+        records.append((
+            account_id, party_id, 'TRADE', asset, amount, running[(account_id, asset)], order_id, trade_id
+        ))
+
+    # The binary COPY protocol costs far less per row than INSERT, and
+    # still runs inside the caller's transaction
+    await conn.copy_records_to_table('transactions', records=records, columns=TRANSACTION_COLUMNS)
+
+
+async def expire_orders(conn, orders: List[BookOrder]):
+    """
+    Cancel what is left of orders that may not rest on the book.
+
+    Used for market, immediate-or-cancel and fill-or-kill orders once they
+    have executed everything they can. Runs in the caller's transaction,
+    after persist_fills for the same batch. A buy without a price that
+    filled completely may have spent less than its budget, and gets the
+    rest released too.
+    """
+    # Filled by this very batch, so nobody else has released their funds
+    released = [order for order in orders if order.remaining <= 0 and order.budget]
+    orders = [order for order in orders if order.remaining > 0]
+    rows = []
+    if orders:
+        # Orders a client cancelled in the meantime have had their funds released
+        rows = await conn.fetch(EXPIRE_ORDERS_SQL, [order.order_id for order in orders])
+        expired = {row['order_id'] for row in rows}
+        released += [order for order in orders if order.order_id in expired]
+    await apply_balance_deltas(conn, release_deltas(released))
+    if EVENTS_ENABLED and rows:
+        await write_events(conn, order_events('OrderCancelled', rows))
+
+
+async def mark_triggered(conn, orders: List[BookOrder]):
+    """
+    Record that these stop orders' stop prices have been reached.
+
+    Raises StaleOrderError if any of them is no longer live, as when a
+    client cancelled it after the book last saw it.
+    """
+    if not orders:
+        return
+    result = await conn.execute(MARK_TRIGGERED_SQL, [order.order_id for order in orders])
+    if result != f"UPDATE {len(orders)}":
+        raise StaleOrderError(f"{orders[0].pair}: triggered stops are no longer live ({result})")
+
+
+async def apply_balance_deltas(conn, deltas: Dict[Tuple[object, str], List]) -> Dict[Tuple[object, str], Decimal]:
+    """
+    Add (available, locked) deltas to balance rows, locking them in key
+    order. Returns each row's new total.
+    """
+    if not deltas:
+        return {}
+    # Sorted so concurrent pair workers lock shared balance rows in the same order
+    deltas = sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1]))
+    accounts = [account_id for (account_id, _), _ in deltas]
+    assets = [asset for (_, asset), _ in deltas]
+
+    # Credits may land on an asset the account has never held
+    await conn.execute(ENSURE_BALANCES_SQL, accounts, assets)
+
+    rows = await conn.fetch(APPLY_BALANCES_SQL, accounts, assets,
+        [available for _, (available, _) in deltas],
+        [locked for _, (_, locked) in deltas])
+    return {(row['account_id'], row['asset_symbol']): row['total'] for row in rows}
+
+
+async def reserve_balances(conn, amounts: Dict[Tuple[object, str], Decimal]) -> List[Tuple[object, str]]:
+    """
+    Move amounts from available to locked, locking rows in key order.
+
+    Returns the (account, asset) keys without enough available funds; those
+    are left untouched and the caller is expected to roll back.
+    """
+    if not amounts:
+        return []
+    keys = sorted(amounts)
+    rows = await conn.fetch(RESERVE_BALANCES_SQL, [account_id for account_id, _ in keys],
+                            [asset for _, asset in keys], [amounts[key] for key in keys])
+    reserved = {(row['account_id'], row['asset_symbol']) for row in rows}
+    return [key for key in keys if key not in reserved]
+
+
+async def write_book_levels(conn, levels: List[Tuple[str, str, Decimal, Decimal, int]], replace_pairs: List[str] = ()):
+    """
+    Bring order_book_snapshot up to date with (pair, side, price, quantity,
+    order count) levels; empty levels are deleted.
+
+    Pairs in `replace_pairs` have every existing row dropped first, for books
+    that were rebuilt from scratch. Costs at most three statements.
+    """
+    if replace_pairs:
+        await conn.execute("DELETE FROM order_book_snapshot WHERE pair = ANY($1::varchar[])", list(replace_pairs))
+
+    gone = [level for level in levels if level[4] == 0]
+    live = [level for level in levels if level[4] > 0]
+    if gone:
+        await conn.execute("""
+            DELETE FROM order_book_snapshot s
+            USING unnest($1::varchar[], $2::varchar[], $3::numeric[]) AS g(pair, side, price)
+            WHERE s.pair = g.pair AND s.side = g.side AND s.price = g.price
+        """, [l[0] for l in gone], [l[1] for l in gone], [l[2] for l in gone])
+    if live:
+        await conn.execute("""
+            INSERT INTO order_book_snapshot (pair, side, price, quantity, order_count, updated_at)
+            SELECT l.*, NOW()
+            FROM unnest($1::varchar[], $2::varchar[], $3::numeric[], $4::numeric[], $5::int[])
+                AS l(pair, side, price, quantity, order_count)
+            ON CONFLICT (pair, side, price) DO UPDATE
+            SET quantity = EXCLUDED.quantity,
+                order_count = EXCLUDED.order_count,
+                updated_at = EXCLUDED.updated_at
+        """, [l[0] for l in live], [l[1] for l in live], [l[2] for l in live],
+            [l[3] for l in live], [l[4] for l in live])
@@ -0,0 +1,239 @@
+"""
+CantonDEX Ticker
+Keeps rolling 24h statistics per pair from fills as they execute and writes them to market_data in batches
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Deque, Dict, List, Optional, Set
+
+from cache import invalidate_soon, ticker_key
+from database import acquire
+from instruments import get_pair_spec
+from order_book import Fill
+
+TICKER_WINDOW = timedelta(hours=24)
+
+# Largest value market_data.price_change_percent_24h (DECIMAL(10, 4)) holds;
+# a pair that first trades at a stray tick can rise further than that
+MAX_CHANGE_PERCENT = Decimal('999999.9999')
+
+# Trades are kept per whole second; the window slides a second at a time
+SLOT = timedelta(seconds=1)
+
+REBUILD_SQL = """
+    SELECT pair,
+           date_trunc('second', matched_at) AS slot,
+           (array_agg(price ORDER BY matched_at, trade_seq))[1] AS open,
+           max(price) AS high,
+           min(price) AS low,
+           (array_agg(price ORDER BY matched_at DESC, trade_seq DESC))[1] AS close,
+           sum(quantity) AS volume
+    FROM trades
+    WHERE matched_at >= $1 AND ($2::varchar[] IS NULL OR pair = ANY($2))
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+
+def slot_of(at: datetime) -> datetime:
+    return at.replace(microsecond=0)
+
+
+class RollingWindow:
+    """
+    One pair's trades over the last TICKER_WINDOW, a slot per second.
+
+    High and low come from monotonic deques and volume from a running sum,
+    so adding a batch and expiring a slot are amortised O(1), and so is
+    reading any statistic.
+    """
+
+    __slots__ = ("slots", "highs", "lows", "volume", "last")
+
+    def __init__(self):
+        # [slot, first price, volume], oldest first
+        self.slots: Deque[List] = deque()
+        # (slot, price) with prices falling (highs) or rising (lows) from the left
+        self.highs: Deque[tuple] = deque()
+        self.lows: Deque[tuple] = deque()
+        self.volume = 0
+        # Last traded price, in or out of the window
+        self.last: Optional[int] = None
+
+    def add(self, slot: datetime, first: int, high: int, low: int, close: int, volume: int):
+        """Add a batch of trades, in ticks and lots, that executed in `slot`"""
+        slots = self.slots
+        if slots and slots[-1][0] >= slot:
+            # Same second, or a batch stamped a moment before the newest one
+            slot = slots[-1][0]
+            slots[-1][2] += volume
+        else:
+            slots.append([slot, first, volume])
+
+        highs, lows = self.highs, self.lows
+        while highs and highs[-1][1] <= high:
+            highs.pop()
+        if not highs or highs[-1][0] != slot:
+            highs.append((slot, high))
+        while lows and lows[-1][1] >= low:
+            lows.pop()
+        if not lows or lows[-1][0] != slot:
+            lows.append((slot, low))
+
+        self.volume += volume
+        self.last = close
+
+    def expire(self, cutoff: datetime) -> bool:
+        """Drop the slots at or before `cutoff`, returning whether any were"""
+        slots = self.slots
+        if not slots or slots[0][0] > cutoff:
+            return False
+        while slots and slots[0][0] <= cutoff:
+            self.volume -= slots.popleft()[2]
+        while self.highs and self.highs[0][0] <= cutoff:
+            self.highs.popleft()
+        while self.lows and self.lows[0][0] <= cutoff:
+            self.lows.popleft()
+        return True
+
+    def stats(self, spec) -> dict:
+        """The market_data columns, as Decimals; None where the window has no trades"""
+        last = None if self.last is None else spec.price(self.last)
+        if not self.slots:
+            return {
+                'last_price': last, 'price_change_24h': None, 'price_change_percent_24h': None,
+                'high_24h': None, 'low_24h': None, 'volume_24h': Decimal(0),
+            }
+        first = spec.price(self.slots[0][1])
+        change = last - first
+        return {
+            'last_price': last,
+            'price_change_24h': change,
+            'price_change_percent_24h': min(change / first * 100, MAX_CHANGE_PERCENT).quantize(Decimal('0.0001')),
+            'high_24h': spec.price(self.highs[0][1]),
+            'low_24h': spec.price(self.lows[0][1]),
+            'volume_24h': spec.quantity(self.volume),
+        }
+
+
+class TickerBoard:
+    """
+    Rolling 24h statistics of every traded pair.
+
+    Fills are added as the engine persists them; flush() slides every
+    window up to the database clock and writes the pairs that changed to
+    market_data in one statement, however many trades came in between.
+    volume_24h is in the pair's base asset, like trades.quantity.
+    """
+
+    def __init__(self):
+        self._windows: Dict[str, RollingWindow] = {}
+        # Pairs to write on the next flush
+        self._changed: Set[str] = set()
+
+    def add(self, fills: List[Fill], matched_at: datetime):
+        """Add a persisted batch of fills, all of one pair and stamped `matched_at`"""
+        if not fills:
+            return
+        pair = fills[0].pair
+        window = self._windows.get(pair)
+        if window is None:
+            window = self._windows[pair] = RollingWindow()
+        prices = [fill.price for fill in fills]
+        window.add(slot_of(matched_at), prices[0], max(prices), min(prices), prices[-1],
+                   sum(fill.quantity for fill in fills))
+        self._changed.add(pair)
+
+    def ticker(self, pair: str) -> Optional[dict]:
+        """A pair's current statistics, or None if it has not traded"""
+        window = self._windows.get(pair)
+        if window is None or window.last is None:
+            return None
+        return {'pair': pair, **window.stats(get_pair_spec(pair))}
+
+    async def load(self, conn, pairs: Optional[Set[str]] = None):
+        """Rebuild the windows, of every pair or only of `pairs`, from the last day of trades"""
+        now = await conn.fetchval("SELECT LOCALTIMESTAMP")
+        if pairs is None:
+            self._windows = {}
+        else:
+            for pair in pairs:
+                self.drop(pair)
+        selected = None if pairs is None else list(pairs)
+        for row in await conn.fetch(REBUILD_SQL, slot_of(now - TICKER_WINDOW) + SLOT, selected):
+            spec = get_pair_spec(row['pair'])
+            window = self._windows.get(row['pair'])
+            if window is None:
+                window = self._windows[row['pair']] = RollingWindow()
+            window.add(row['slot'], spec.to_ticks(row['open']), spec.to_ticks(row['high']),
+                       spec.to_ticks(row['low']), spec.to_ticks(row['close']), spec.to_lots(row['volume']))
+        # Pairs quiet for a day keep showing their last price
+        for row in await conn.fetch("""
+            SELECT pair, last_price FROM market_data
+            WHERE last_price IS NOT NULL AND ($1::varchar[] IS NULL OR pair = ANY($1))
+        """, selected):
+            if row['pair'] not in self._windows:
+                window = self._windows[row['pair']] = RollingWindow()
+                window.last = get_pair_spec(row['pair']).to_ticks(row['last_price'])
+        if pairs is None:
+            self._changed = set(self._windows)
+        else:
+            self._changed |= set(pairs) & set(self._windows)
+
+    def drop(self, pair: str):
+        """Forget a pair's window"""
+        self._windows.pop(pair, None)
+        self._changed.discard(pair)
+
+    async def flush(self, conn=None) -> int:
+        """Slide the windows forward and write the pairs that changed, returning how many"""
+        if not self._windows:
+            return 0
+        if conn is None:
+            async with acquire() as conn:
+                return await self._write_changed(conn)
+        return await self._write_changed(conn)
+
+    async def _write_changed(self, conn) -> int:
+        now = await conn.fetchval("SELECT LOCALTIMESTAMP")
+        cutoff = slot_of(now - TICKER_WINDOW)
+        for pair, window in self._windows.items():
+            if window.expire(cutoff):
+                self._changed.add(pair)
+        if not self._changed:
+            return 0
+
+        changed, self._changed = self._changed, set()
+        rows = [(pair, self._windows[pair].stats(get_pair_spec(pair))) for pair in changed]
+        try:
+            await conn.execute("""
+                INSERT INTO market_data (
+                    pair, last_price, price_change_24h, price_change_percent_24h,
+                    high_24h, low_24h, volume_24h, updated_at
+                )
+                SELECT t.*, NOW()
+                FROM unnest($1::varchar[], $2::numeric[], $3::numeric[], $4::numeric[],
+                            $5::numeric[], $6::numeric[], $7::numeric[]) AS t
+                ON CONFLICT (pair) DO UPDATE
+                SET last_price = EXCLUDED.last_price,
+                    price_change_24h = EXCLUDED.price_change_24h,
+                    price_change_percent_24h = EXCLUDED.price_change_percent_24h,
+                    high_24h = EXCLUDED.high_24h,
+                    low_24h = EXCLUDED.low_24h,
+                    volume_24h = EXCLUDED.volume_24h,
+                    updated_at = EXCLUDED.updated_at
+            """,
+                [pair for pair, _ in rows],
+                *([stats[column] for _, stats in rows] for column in (
+                    'last_price', 'price_change_24h', 'price_change_percent_24h',
+                    'high_24h', 'low_24h', 'volume_24h',
+                )),
+            )
+        except Exception:
+            self._changed |= changed
+            raise
+        # Replicas serving these pairs from market_data read the new rows
+        invalidate_soon(ticker_key(pair) for pair in changed)
+        return len(rows)
@@ -0,0 +1,172 @@
+"""
+Query-plan regression checks for the matching engine's and history hot queries.
+
+Seeds a large, mostly historical orders table inside a transaction that is
+rolled back afterwards, and fails if EXPLAIN shows any hot query scanning
+the whole table. Runs against the database named by the DB_* variables,
+which must have database/schema.sql applied; skipped when none is reachable.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'cantondex-backend', 'trading-service'))
+
+asyncpg = pytest.importorskip("asyncpg")
+
+import history
+import matching_engine
+
+SEED_ROWS = int(os.getenv("PLAN_CHECK_ROWS", "1000000"))
+PARTY = 'plan-check::party'
+# Owns the 99% of seeded rows that PARTY's history queries must skip
+BULK_PARTY = 'plan-check::bulk'
+CURSOR = f"{(datetime.now() - timedelta(days=15)).isoformat()},{uuid.uuid4()}"
+
+# name -> (query, parameters, indexes any of which the plan should use)
+HOT_QUERIES = {
+    # A bitmap scan of the status index is as good for the whole live set
+    'load_books': (matching_engine.LIVE_ORDERS_SQL, (), {'idx_orders_live_book', 'idx_orders_status'}),
+    'reload_book': (matching_engine.PAIR_ORDERS_SQL, ('PLAN3/USDT',), {'idx_orders_live_book'}),
+    'sweep': (matching_engine.CHANGED_ORDERS_SQL, (datetime.now() - timedelta(seconds=30),), {'idx_orders_updated'}),
+    'orders_by_id': (matching_engine.ORDERS_BY_ID_SQL, ([uuid.uuid4(), uuid.uuid4()],), {'orders_pkey'}),
+    'takers': (matching_engine.TAKERS_SQL, (['IOC', 'FOK'], None), {'idx_orders_live_takers'}),
+    'pair_takers': (matching_engine.TAKERS_SQL, (['IOC', 'FOK'], 'PLAN3/USDT'), {'idx_orders_live_takers'}),
+    'trades_by_id': (matching_engine.TRADES_BY_ID_SQL, ([uuid.uuid4()],), {'trades_pkey'}),
+    'order_history': (*history.build_query(history.SOURCES['orders'], PARTY, CURSOR, limit=101),
+                      {'idx_orders_party'}),
+    'trade_history': (*history.build_query(history.SOURCES['trades'], PARTY, CURSOR, limit=101),
+                      {'idx_trades_maker_party', 'idx_trades_taker_party'}),
+    'transaction_history': (*history.build_query(history.SOURCES['transactions'], PARTY, CURSOR, limit=101),
+                            {'idx_transactions_party'}),
+}
+
+
+def seq_scans(plan, empty=frozenset()):
+    """Relations the plan reads with a sequential scan, other than empty ones"""
+    scanned = plan['Node Type'] == 'Seq Scan' and plan['Relation Name'] not in empty
+    found = [plan['Relation Name']] if scanned else []
+    for child in plan.get('Plans', []):
+        found += seq_scans(child, empty)
+    return found
+
+
+def indexes(plan, parents):
+    """Indexes the plan reads, partition indexes named after their parent index"""
+    found = {parents.get(plan['Index Name'], plan['Index Name'])} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        found |= indexes(child, parents)
+    return found
+
+
+async def collect_plans():
+    try:
+        conn = await asyncpg.connect(
+            user=os.getenv("DB_USER", "cantondex"),
+            password=os.getenv("DB_PASSWORD", "cantondex"),
+            database=os.getenv("DB_NAME", "cantondex"),
+            host=os.getenv("DB_HOST", "localhost"),
+            port=os.getenv("DB_PORT", "5432"),
+            timeout=5,
+        )
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        pytest.skip(f"no database to plan against: {e}")
+
+    plans = {}
+    tx = conn.transaction()
+    await tx.start()
+    try:
+        # Keep a million rows from queueing a million notifications
+        await conn.execute("SELECT set_config('cantondex.writer', 'matching_engine', true)")
+        await conn.execute("INSERT INTO parties (party_id, display_name) VALUES ($1, 'Plan check'), ($2, 'Bulk')",
+                           PARTY, BULK_PARTY)
+        account_id = await conn.fetchval(
+            "INSERT INTO trading_accounts (party_id) VALUES ($1) RETURNING account_id", PARTY)
+        # Trades and transactions are partitioned by month; the seed goes back 30 days
+        await conn.execute("SELECT ensure_monthly_partitions('trades', 0, 1)")
+        await conn.execute("SELECT ensure_monthly_partitions('transactions', 0, 1)")
+
+        # ~2% live orders over 20 pairs, the rest filled or cancelled history,
+        # spread over the past month
+        await conn.execute("""
+            INSERT INTO orders (account_id, party_id, pair, side, order_type, time_in_force,
+                                quantity, price, stop_price, filled_quantity, status,
+                                created_at, updated_at, triggered_at)
+            SELECT $1, CASE WHEN g % 100 = 0 THEN $2 ELSE $4 END, 'PLAN' || (g % 20) || '/USDT',
+                   CASE WHEN g % 2 = 0 THEN 'BUY' ELSE 'SELL' END,
+                   CASE g % 50 WHEN 0 THEN 'MARKET' WHEN 1 THEN 'STOP' ELSE 'LIMIT' END,
+                   CASE WHEN g % 7 = 0 THEN 'IOC' ELSE 'GTC' END,
+                   1,
+                   CASE WHEN g % 50 = 0 THEN NULL ELSE 100 + (g % 1000) * 0.01 END,
+                   CASE WHEN g % 50 = 1 THEN 99 END,
+                   0,
+                   CASE WHEN g % 97 = 0 THEN 'OPEN'
+                        WHEN g % 97 = 1 THEN 'PARTIALLY_FILLED'
+                        WHEN g % 2 = 0 THEN 'FILLED'
+                        ELSE 'CANCELLED' END,
+                   LOCALTIMESTAMP - (($3 - g) * interval '30 days' / $3),
+                   LOCALTIMESTAMP - (($3 - g) * interval '30 days' / $3),
+                   NULL
+            FROM generate_series(1, $3) g
+        """, account_id, PARTY, SEED_ROWS, BULK_PARTY)
+        # One trade per filled order
+        await conn.execute("""
+            INSERT INTO trades (maker_order_id, taker_order_id, maker_party_id, taker_party_id,
+                                pair, quantity, price, maker_side, matched_at)
+            SELECT o.order_id, o.order_id, o.party_id, o.party_id, o.pair, 1, 100, o.side, o.created_at
+            FROM orders o WHERE o.account_id = $1 AND o.status = 'FILLED'
+        """, account_id)
+        # And the ledger entry each trade leaves behind
+        await conn.execute("""
+            INSERT INTO transactions (account_id, party_id, tx_type, asset_symbol, amount,
+                                      balance_after, trade_id, created_at)
+            SELECT $1, t.maker_party_id, 'TRADE', 'USDT', -100, 0, t.trade_id, t.matched_at
+            FROM trades t JOIN orders o ON o.order_id = t.maker_order_id WHERE o.account_id = $1
+        """, account_id)
+        await conn.execute("ANALYZE orders")
+        await conn.execute("ANALYZE trades")
+        await conn.execute("ANALYZE transactions")
+
+        for name, (query, args, _) in HOT_QUERIES.items():
+            plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+            plans[name] = json.loads(plan)[0]['Plan']
+        # Future partitions have nothing in them, so scanning them is free
+        empty = {row[0] for row in await conn.fetch(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relpages = 0")}
+        parents = dict(await conn.fetch("""
+            SELECT c.relname, p.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relkind = 'i'
+        """))
+    finally:
+        await tx.rollback()
+        await conn.close()
+    return plans, parents, empty
+
+
+@pytest.fixture(scope="module")
+def plans():
+    return asyncio.run(collect_plans())
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+class TestHotQueryPlans:
+    """Every hot matching query is served by an index."""
+
+    @pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+    def test_no_sequential_scan(self, plans, name):
+        plans, _, empty = plans
+        assert seq_scans(plans[name], empty) == [], json.dumps(plans[name], indent=2)
+
+    @pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+    def test_uses_intended_index(self, plans, name):
+        plans, parents, _ = plans
+        assert HOT_QUERIES[name][2] & indexes(plans[name], parents), json.dumps(plans[name], indent=2)
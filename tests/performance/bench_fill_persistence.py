@@ -0,0 +1,134 @@
+"""
+Fill persistence benchmark for the trading-service.
+
+Measures fills/s for batches of 1, 10, 100 and 1000 through the batched
+`persist_fills` path, next to the old one-fill-at-a-time statements.
+Every round runs in a transaction that is rolled back, so the target
+database is left untouched. Uses the same DB_* variables as the service.
+
+    python tests/performance/bench_fill_persistence.py --rounds 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'cantondex-backend', 'trading-service'))
+
+from instruments import get_pair_spec
+from order_book import BookOrder, Fill, BUY, SELL
+from persistence import persist_fills, balance_deltas
+
+PAIR = 'BTC/USDT'
+PARTY = 'bench::fill-persistence'
+
+
+async def persist_fills_one_by_one(conn, fills):
+    """The pre-batching write path: seven statements per fill"""
+    spec = get_pair_spec(PAIR)
+    for fill in fills:
+        for order in (fill.buyer, fill.seller):
+            await conn.execute("""
+                UPDATE orders
+                SET filled_quantity = filled_quantity + $1,
+                    status = CASE WHEN filled_quantity + $1 >= quantity THEN 'FILLED' ELSE 'PARTIALLY_FILLED' END,
+                    updated_at = NOW()
+                WHERE order_id = $2
+            """, spec.quantity(fill.quantity), order.order_id)
+        await conn.execute("""
+            INSERT INTO trades (
+                trade_id, pair, price, quantity, maker_order_id, taker_order_id,
+                maker_party_id, taker_party_id, maker_side, settlement_status, executed_at
+            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, 'SETTLED', NOW())
+        """, fill.trade_id, fill.pair, spec.price(fill.price), spec.quantity(fill.quantity),
+            fill.maker.order_id, fill.taker.order_id,
+            fill.maker.party_id, fill.taker.party_id, fill.maker.side)
+        for (account_id, asset), (available, locked) in balance_deltas([fill]).items():
+            await conn.execute("""
+                UPDATE balances SET available = available + $1, locked = locked + $2
+                WHERE account_id = $3 AND asset_symbol = $4
+            """, available, locked, account_id, asset)
+
+
+async def seed_fills(conn, batch_size):
+    """Create two accounts and one maker/taker order pair per fill"""
+    buyer, seller = await conn.fetch("""
+        INSERT INTO trading_accounts (party_id) SELECT $1 FROM generate_series(1, 2)
+        RETURNING account_id
+    """, PARTY)
+    buyer, seller = buyer['account_id'], seller['account_id']
+    await conn.execute("""
+        INSERT INTO balances (account_id, asset_symbol, available, locked)
+        VALUES ($1, 'BTC', 0, 0), ($1, 'USDT', 0, 1e12), ($2, 'BTC', 0, 1e6), ($2, 'USDT', 0, 0)
+    """, buyer, seller)
+
+    spec = get_pair_spec(PAIR)
+    price, quantity = Decimal('92500'), Decimal('0.01')
+    ticks, lots = spec.to_ticks(price), spec.to_lots(quantity)
+    makers = [BookOrder(uuid.uuid4(), seller, PARTY, PAIR, SELL, ticks, lots) for _ in range(batch_size)]
+    takers = [BookOrder(uuid.uuid4(), buyer, PARTY, PAIR, BUY, ticks, lots) for _ in range(batch_size)]
+    orders = makers + takers
+    await conn.execute("""
+        INSERT INTO orders (order_id, account_id, party_id, pair, side, order_type, quantity, price)
+        SELECT o.order_id, o.account_id, $1, $2, o.side, 'LIMIT', $3, $4
+        FROM unnest($5::uuid[], $6::uuid[], $7::varchar[]) AS o(order_id, account_id, side)
+    """, PARTY, PAIR, quantity, price,
+        [o.order_id for o in orders], [o.account_id for o in orders], [o.side for o in orders])
+
+    return [Fill(PAIR, maker, taker, ticks, lots) for maker, taker in zip(makers, takers)]
+
+
+async def run_round(conn, writer, batch_size):
+    tx = conn.transaction()
+    await tx.start()
+    try:
+        fills = await seed_fills(conn, batch_size)
+        started = time.perf_counter()
+        await writer(conn, fills)
+        return time.perf_counter() - started
+    finally:
+        await tx.rollback()
+
+
+async def main(args):
+    conn = await asyncpg.connect(
+        user=os.getenv("DB_USER", "cantondex"),
+        password=os.getenv("DB_PASSWORD", "cantondex"),
+        database=os.getenv("DB_NAME", "cantondex"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432")
+    )
+    await conn.execute("""
+        INSERT INTO parties (party_id, display_name) VALUES ($1, 'Benchmark')
+        ON CONFLICT (party_id) DO NOTHING
+    """, PARTY)
+
+    writers = [("batched", persist_fills)]
+    if not args.skip_baseline:
+        writers.append(("one-by-one", persist_fills_one_by_one))
+
+    print(f"{'path':<12} {'batch':>6} {'median ms':>10} {'fills/s':>12}")
+    try:
+        for batch_size in args.batches:
+            for name, writer in writers:
+                timings = [await run_round(conn, writer, batch_size) for _ in range(args.rounds)]
+                median = statistics.median(timings)
+                print(f"{name:<12} {batch_size:>6} {median * 1000:>10.2f} {batch_size / median:>12,.0f}")
+    finally:
+        await conn.execute("DELETE FROM parties WHERE party_id = $1", PARTY)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--skip-baseline", action="store_true", help="only time the batched path")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,446 @@
+"""
+Matching engine benchmark and order-flow replay for the trading-service.
+
+Generates a reproducible stream of order entries and cancels across
+several pairs and feeds it to `MatchingEngine.process_pair`, one event
+(or --batch events) at a time, the way a pair worker does. Reports
+orders/s, fills/s and p50/p99/p999 match latency.
+
+By default the engine talks to an in-memory stand-in for its database
+connection that keeps order rows and balance totals and discards trade
+rows, so the numbers isolate the engine itself. With --postgres it runs
+against the database named by the same DB_* variables as the service, on
+throwaway BENCH*/USDT pairs that are deleted afterwards unless --keep is
+given.
+
+A flow can be saved with --record and fed back with --replay, so two
+engine builds see exactly the same orders. --output appends each run's
+parameters and results as one JSON line for run-to-run comparison.
+
+    python tests/performance/bench_matching_engine.py --orders 100000 --pairs 4
+    python tests/performance/bench_matching_engine.py --record flow.jsonl --orders 50000
+    python tests/performance/bench_matching_engine.py --replay flow.jsonl --postgres
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'cantondex-backend', 'trading-service'))
+
+from instruments import PAIR_SPECS, PairSpec
+from matching_engine import ORDERS_BY_ID_SQL, PAIR_ORDERS_SQL, TAKERS_SQL, MatchingEngine
+from order_book import BUY, SELL
+from persistence import APPLY_BALANCES_SQL, EXPIRE_ORDERS_SQL, FILL_ORDERS_SQL, MARK_TRIGGERED_SQL
+
+PARTY = 'bench::matching-engine'
+TICK = Decimal('0.01')
+LOT = Decimal('0.01')
+MID = 10000  # ticks, i.e. 100.00
+ACCOUNTS = 8
+
+
+# ---------------------------------------------------------------------------
+# Order flow
+# ---------------------------------------------------------------------------
+
+def price_offset(rng: random.Random, args) -> int:
+    """Distance from the mid in ticks, at least one"""
+    if args.price_dist == 'uniform':
+        return rng.randint(1, max(1, int(args.price_sigma * 3)))
+    if args.price_dist == 'exponential':
+        return 1 + int(rng.expovariate(1 / args.price_sigma))
+    return max(1, round(abs(rng.gauss(0, args.price_sigma))))
+
+
+def generate_flow(args):
+    """
+    Build a list of order events.
+
+    Each pair is first given --depth passive orders, marked as warm-up and
+    left out of the statistics. After that every event is a cancel of a
+    random earlier order with probability --cancel-ratio, and otherwise a
+    new order that crosses the mid (an aggressor) with probability
+    --aggressor-ratio. A --market-ratio share of aggressors are MARKET;
+    market buys carry a max_cost of twice their quantity at the mid.
+    """
+    rng = random.Random(args.seed)
+    pairs = [f"BENCH{i}/USDT" for i in range(args.pairs)]
+    placed = {pair: [] for pair in pairs}
+    events = []
+
+    def new_order(pair, aggressive, warmup=False):
+        side = rng.choice((BUY, SELL))
+        direction = 1 if side == BUY else -1
+        offset = price_offset(rng, args)
+        order_type = 'LIMIT'
+        ticks = MID + direction * offset if aggressive else MID - direction * offset
+        if aggressive and rng.random() < args.market_ratio:
+            order_type = 'MARKET'
+        order_id = str(uuid.uuid4())
+        placed[pair].append(order_id)
+        quantity = rng.randint(1, args.max_lots) * LOT
+        events.append({
+            'op': 'new', 'id': order_id, 'pair': pair, 'side': side, 'type': order_type,
+            'price': None if order_type == 'MARKET' else str(ticks * TICK),
+            'quantity': str(quantity),
+            'max_cost': str(quantity * 2 * MID * TICK) if order_type == 'MARKET' and side == BUY else None,
+            'account': rng.randrange(ACCOUNTS), 'warmup': warmup,
+        })
+
+    for pair in pairs:
+        for _ in range(args.depth):
+            new_order(pair, aggressive=False, warmup=True)
+
+    for _ in range(args.orders):
+        pair = rng.choice(pairs)
+        live = placed[pair]
+        if live and rng.random() < args.cancel_ratio:
+            i = rng.randrange(len(live))
+            live[i], live[-1] = live[-1], live[i]
+            events.append({'op': 'cancel', 'id': live.pop(), 'pair': pair, 'warmup': False})
+        else:
+            new_order(pair, aggressive=rng.random() < args.aggressor_ratio)
+    return events
+
+
+def load_flow(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_flow(path, events):
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+# ---------------------------------------------------------------------------
+# Order stores: where the engine reads orders from
+# ---------------------------------------------------------------------------
+
+class MemoryConnection:
+    """
+    Enough of an asyncpg connection for `MatchingEngine.process_pair`.
+
+    Statements are told apart by their text. Order rows are served and
+    updated by fills and expiries the way the database would, and balance
+    deltas are applied to in-memory totals that start as generously locked
+    as PostgresStore's. Trades and transactions rows are counted and
+    dropped, so fills never reach a database. Works with the balance
+    ledger off (MATCHING_BALANCE_FLUSH_SECONDS=0) as well as on.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.balances = {}
+        self.statements = 0
+        self.copied = 0
+
+    def _live(self, row):
+        return row['status'] in ('OPEN', 'PARTIALLY_FILLED')
+
+    def _sorted(self, rows):
+        return sorted(rows, key=lambda row: (row['created_at'], row['order_id']))
+
+    async def fetch(self, query, *args):
+        self.statements += 1
+        if query == ORDERS_BY_ID_SQL:
+            return self._sorted(self.rows[order_id] for order_id in args[0] if order_id in self.rows)
+        if query == PAIR_ORDERS_SQL:
+            return self._sorted(row for row in self.rows.values()
+                                if row['pair'] == args[0] and self._live(row) and row['order_type'] != 'MARKET')
+        if query == TAKERS_SQL:
+            # Every bench order is GTC, so only market orders can be waiting to take
+            return self._sorted(row for row in self.rows.values()
+                                if self._live(row) and row['order_type'] == 'MARKET'
+                                and args[1] in (None, row['pair']))
+        if query == FILL_ORDERS_SQL:
+            filled = []
+            for order_id, quantity in zip(*args):
+                row = self.rows[order_id]
+                if self._live(row):
+                    row['filled_quantity'] += quantity
+                    row['status'] = 'FILLED' if row['filled_quantity'] >= row['quantity'] else 'PARTIALLY_FILLED'
+                    filled.append(row)
+            return filled
+        if query == EXPIRE_ORDERS_SQL:
+            expired = [self.rows[order_id] for order_id in args[0] if self._live(self.rows[order_id])]
+            for row in expired:
+                row['status'] = 'CANCELLED'
+            return expired
+        if query == APPLY_BALANCES_SQL:
+            rows = []
+            for account_id, asset, available, locked in zip(*args):
+                balance = self.balances.setdefault((account_id, asset), [Decimal(0), Decimal('1e15')])
+                balance[0] += available
+                balance[1] += locked
+                rows.append({'account_id': account_id, 'asset_symbol': asset, 'total': sum(balance)})
+            return rows
+        raise NotImplementedError(f"MemoryConnection cannot answer: {query.strip().splitlines()[0]}")
+
+    async def execute(self, query, *args):
+        self.statements += 1
+        if query == MARK_TRIGGERED_SQL:
+            return f"UPDATE {len(args[0])}"
+        # ENSURE_BALANCES_SQL and the writer setting: nothing to keep
+        return "SELECT 1"
+
+    async def fetchval(self, query, *args):
+        # persist_fills reads back its trades' matched_at
+        self.statements += 1
+        return datetime.utcnow()
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.statements += 1
+        self.copied += len(records)
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+
+class MemoryStore:
+    def __init__(self):
+        self.conn = MemoryConnection()
+        self.accounts = [uuid.uuid4() for _ in range(ACCOUNTS)]
+        self.clock = datetime(2026, 1, 1)
+
+    async def apply(self, events):
+        for event in events:
+            order_id = uuid.UUID(event['id'])
+            if event['op'] == 'cancel':
+                row = self.conn.rows.get(order_id)
+                if row is not None:
+                    row['status'] = 'CANCELLED'
+                continue
+            self.clock += timedelta(microseconds=1)
+            self.conn.rows[order_id] = {
+                'order_id': order_id, 'account_id': self.accounts[event['account']],
+                'party_id': PARTY, 'pair': event['pair'], 'side': event['side'],
+                'order_type': event['type'], 'time_in_force': 'GTC',
+                'quantity': Decimal(event['quantity']),
+                'price': None if event['price'] is None else Decimal(event['price']),
+                'stop_price': None, 'display_quantity': None,
+                'max_cost': None if event.get('max_cost') is None else Decimal(event['max_cost']),
+                'filled_quantity': Decimal(0), 'status': 'OPEN',
+                'created_at': self.clock, 'updated_at': self.clock, 'triggered_at': None,
+            }
+
+    async def close(self, keep):
+        pass
+
+
+class PostgresStore:
+    """Writes the flow into a real database the engine then reads and fills"""
+
+    def __init__(self, conn, engine_conn):
+        self.conn = engine_conn
+        self._writer = conn
+        self.accounts = []
+
+    @classmethod
+    async def connect(cls, pairs):
+        import asyncpg
+        from database import TradingConnection, init_connection
+
+        def connect(**kwargs):
+            return asyncpg.connect(
+                user=os.getenv("DB_USER", "cantondex"),
+                password=os.getenv("DB_PASSWORD", "cantondex"),
+                database=os.getenv("DB_NAME", "cantondex"),
+                host=os.getenv("DB_HOST", "localhost"),
+                port=os.getenv("DB_PORT", "5432"),
+                **kwargs
+            )
+
+        # Set up like a pooled connection, with the engine's hot statements prepared
+        engine_conn = await connect(connection_class=TradingConnection)
+        await init_connection(engine_conn)
+        store = cls(await connect(), engine_conn)
+        await store._setup(pairs)
+        return store
+
+    async def _setup(self, pairs):
+        conn = self._writer
+        await conn.execute("""
+            INSERT INTO parties (party_id, display_name) VALUES ($1, 'Benchmark')
+            ON CONFLICT (party_id) DO NOTHING
+        """, PARTY)
+        rows = await conn.fetch("""
+            INSERT INTO trading_accounts (party_id) SELECT $1 FROM generate_series(1, $2)
+            RETURNING account_id
+        """, PARTY, ACCOUNTS)
+        self.accounts = [row['account_id'] for row in rows]
+        assets = sorted({asset for pair in pairs for asset in pair.split('/')})
+        # Generous reservations, so no fill runs out of locked funds
+        await conn.execute("""
+            INSERT INTO balances (account_id, asset_symbol, available, locked)
+            SELECT a, s, 0, 1e15 FROM unnest($1::uuid[]) a, unnest($2::varchar[]) s
+        """, self.accounts, assets)
+
+    async def apply(self, events):
+        new = [e for e in events if e['op'] == 'new']
+        cancels = [uuid.UUID(e['id']) for e in events if e['op'] == 'cancel']
+        if new:
+            await self._writer.execute("""
+                INSERT INTO orders (order_id, account_id, party_id, pair, side, order_type, quantity, price, max_cost)
+                SELECT o.order_id, o.account_id, $1, o.pair, o.side, o.order_type, o.quantity, o.price, o.max_cost
+                FROM unnest($2::uuid[], $3::uuid[], $4::varchar[], $5::varchar[], $6::varchar[],
+                            $7::numeric[], $8::numeric[], $9::numeric[])
+                    AS o(order_id, account_id, pair, side, order_type, quantity, price, max_cost)
+            """, PARTY,
+                [uuid.UUID(e['id']) for e in new], [self.accounts[e['account']] for e in new],
+                [e['pair'] for e in new], [e['side'] for e in new], [e['type'] for e in new],
+                [Decimal(e['quantity']) for e in new],
+                [None if e['price'] is None else Decimal(e['price']) for e in new],
+                [None if e.get('max_cost') is None else Decimal(e['max_cost']) for e in new])
+        if cancels:
+            await self._writer.execute("""
+                UPDATE orders SET status = 'CANCELLED', updated_at = NOW()
+                WHERE order_id = ANY($1::uuid[]) AND status NOT IN ('FILLED', 'CANCELLED')
+            """, cancels)
+
+    async def close(self, keep):
+        conn = self._writer
+        try:
+            if not keep:
+                await conn.execute("DELETE FROM transactions WHERE party_id = $1", PARTY)
+                await conn.execute("DELETE FROM trades WHERE maker_party_id = $1", PARTY)
+                await conn.execute("DELETE FROM orders WHERE party_id = $1", PARTY)
+                await conn.execute("DELETE FROM balances WHERE account_id = ANY($1::uuid[])", self.accounts)
+                await conn.execute("DELETE FROM trading_accounts WHERE party_id = $1", PARTY)
+                await conn.execute("DELETE FROM parties WHERE party_id = $1", PARTY)
+        finally:
+            await conn.close()
+            await self.conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def replay(engine, store, events, batch_size):
+    """Feed events to the engine; return (latencies, orders, fills, errors, engine seconds)"""
+    latencies, fills, orders, errors = [], 0, 0, 0
+    engine_time = 0.0
+
+    for start in range(0, len(events), batch_size):
+        batch = events[start:start + batch_size]
+        await store.apply(batch)
+
+        by_pair = {}
+        for event in batch:
+            by_pair.setdefault(event['pair'], set()).add(uuid.UUID(event['id']))
+        measured = not all(event['warmup'] for event in batch)
+
+        for pair, order_ids in by_pair.items():
+            started = time.perf_counter()
+            try:
+                pair_fills = await engine.process_pair(store.conn, pair, order_ids)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"first error: {e}", file=sys.stderr)
+                pair_fills = []
+            elapsed = time.perf_counter() - started
+            if measured:
+                latencies.append(elapsed)
+                engine_time += elapsed
+                fills += len(pair_fills)
+        if measured:
+            orders += len(batch)
+
+    return latencies, orders, fills, errors, engine_time
+
+
+async def main(args):
+    events = load_flow(args.replay) if args.replay else generate_flow(args)
+    for pair in {event['pair'] for event in events}:
+        # Listed for the run only, so the engine accepts them
+        PAIR_SPECS.setdefault(pair, PairSpec(pair, TICK, LOT))
+    if args.record:
+        save_flow(args.record, events)
+        print(f"Recorded {len(events)} events to {args.record}")
+
+    pairs = sorted({event['pair'] for event in events})
+    engine = MatchingEngine(journal_dir=args.journal or "")
+    store = await PostgresStore.connect(pairs) if args.postgres else MemoryStore()
+
+    started = time.perf_counter()
+    try:
+        # The engine prints every executed batch; keep that out of the timings
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            latencies, orders, fills, errors, engine_time = await replay(engine, store, events, args.batch)
+            if args.postgres and engine.ledger is not None:
+                # Settle what the engine left PENDING, as its periodic flush would
+                await engine.ledger.flush(store.conn)
+    finally:
+        await store.close(args.keep)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'backend': 'postgres' if args.postgres else 'memory',
+        'pairs': len(pairs),
+        'events': len(events),
+        'orders': orders,
+        'fills': fills,
+        'errors': errors,
+        'orders_per_s': orders / engine_time if engine_time else 0.0,
+        'fills_per_s': fills / engine_time if engine_time else 0.0,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'p999_us': percentile(latencies, 0.999) * 1e6,
+        'wall_s': wall,
+        'resting': sum(len(book) for book in engine.books.values()),
+    }
+
+    print(f"{result['backend']}: {orders} orders, {fills} fills on {len(pairs)} pair(s), "
+          f"{errors} error(s), {result['resting']} left resting")
+    print(f"{'orders/s':>12} {'fills/s':>12} {'p50 us':>10} {'p99 us':>10} {'p999 us':>10}")
+    print(f"{result['orders_per_s']:>12,.0f} {result['fills_per_s']:>12,.0f} "
+          f"{result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {result['p999_us']:>10.1f}")
+
+    if args.output:
+        params = {k: v for k, v in vars(args).items() if k not in ('output', 'record')}
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({'params': params, 'result': result}) + '\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    flow = parser.add_argument_group('synthetic flow')
+    flow.add_argument("--orders", type=int, default=20000, help="measured events")
+    flow.add_argument("--pairs", type=int, default=4)
+    flow.add_argument("--depth", type=int, default=1000, help="warm-up resting orders per pair")
+    flow.add_argument("--price-dist", choices=["normal", "uniform", "exponential"], default="normal")
+    flow.add_argument("--price-sigma", type=float, default=20, help="spread of prices around the mid, in ticks")
+    flow.add_argument("--cancel-ratio", type=float, default=0.3)
+    flow.add_argument("--aggressor-ratio", type=float, default=0.2)
+    flow.add_argument("--market-ratio", type=float, default=0.1, help="share of aggressors sent as MARKET")
+    flow.add_argument("--max-lots", type=int, default=10)
+    flow.add_argument("--seed", type=int, default=1)
+    flow.add_argument("--record", help="write the flow to this JSONL file")
+    flow.add_argument("--replay", help="replay a flow written by --record instead of generating one")
+
+    run = parser.add_argument_group('engine')
+    run.add_argument("--batch", type=int, default=1, help="events handed to process_pair together")
+    run.add_argument("--postgres", action="store_true", help="run against the DB_* database")
+    run.add_argument("--keep", action="store_true", help="leave the benchmark rows in the database")
+    run.add_argument("--journal", help="journal directory, to include journaling in the timings")
+    run.add_argument("--output", help="append the results to this JSONL file")
+    asyncio.run(main(parser.parse_args()))
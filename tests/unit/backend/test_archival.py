@@ -0,0 +1,88 @@
+"""
+Unit tests for trading-service partition archival.
+"""
+
+import asyncio
+import gzip
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+import archival
+from archival import archive_cutoff, archive_partition, partition_month
+
+
+@pytest.mark.unit
+class TestPartitionNames:
+    """Only monthly partitions of the partitioned tables are recognised."""
+
+    @pytest.mark.parametrize("name, expected", [
+        ('trades_y2026m01', ('trades', date(2026, 1, 1))),
+        ('transactions_y2025m12', ('transactions', date(2025, 12, 1))),
+        ('orders_y2026m01', None),
+        ('trades_y2026m1', None),
+        ('trades_y2026m01_pkey', None),
+    ])
+    def test_partition_month(self, name, expected):
+        assert partition_month(name) == expected
+
+
+@pytest.mark.unit
+class TestArchiveCutoff:
+    """The cutoff keeps whole months online before the current one."""
+
+    @pytest.mark.parametrize("today, months, cutoff", [
+        (date(2026, 10, 17), 12, date(2025, 10, 1)),
+        (date(2026, 1, 31), 1, date(2025, 12, 1)),
+        (date(2026, 3, 1), 0, date(2026, 3, 1)),
+        (date(2026, 12, 5), 23, date(2025, 1, 1)),
+    ])
+    def test_cutoff(self, today, months, cutoff):
+        assert archive_cutoff(today, months) == cutoff
+
+
+class CopyConnection:
+    """Streams a fixed CSV for any table and records the statements run"""
+
+    def __init__(self, csv: bytes, events: list):
+        self.csv = csv
+        self.events = events
+
+    async def copy_from_table(self, table, output, **kwargs):
+        for line in self.csv.splitlines(keepends=True):
+            await output(line)
+        return f"COPY {len(self.csv.splitlines()) - 1}"
+
+    async def execute(self, query, *args):
+        self.events.append(query)
+
+
+@pytest.mark.unit
+class TestArchivePartition:
+    """The archive is complete and on disk before the partition is dropped."""
+
+    def test_synced_before_drop(self, tmp_path, monkeypatch):
+        events = []
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            events.append('fsync')
+            real_fsync(fd)
+
+        monkeypatch.setattr(archival, 'ARCHIVE_DIR', str(tmp_path))
+        monkeypatch.setattr(os, 'fsync', fsync)
+        csv = b"trade_id,price\nt1,100\nt2,101\n"
+        conn = CopyConnection(csv, events)
+
+        path = asyncio.run(archive_partition(conn, 'trades', 'trades_y2025m01', state='detached'))
+
+        assert path == str(tmp_path / 'trades_y2025m01.csv.gz')
+        with gzip.open(path) as archive:
+            assert archive.read() == csv
+        assert not os.path.exists(path + '.partial')
+        # The file, then the directory holding the rename, then the drop
+        assert events == ['fsync', 'fsync', 'DROP TABLE "trades_y2025m01"']
@@ -0,0 +1,111 @@
+"""
+Unit tests for the trading-service cache.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from cache import Cache, FakeRedis, balances_key, party_keys
+
+
+class Loader:
+    """Counts loads and returns the current `value`"""
+
+    def __init__(self, value):
+        self.value = value
+        self.loads = 0
+
+    async def __call__(self):
+        self.loads += 1
+        return self.value
+
+
+@pytest.mark.unit
+class TestCache:
+    """Entries are served until an event invalidates them."""
+
+    def test_loaded_once(self):
+        cache, load = Cache(FakeRedis()), Loader([{'asset_symbol': 'BTC', 'available': 1.5}])
+
+        async def run():
+            return [await cache.get_or_load('k', load) for _ in range(3)]
+
+        assert asyncio.run(run()) == [load.value] * 3
+        assert load.loads == 1
+        assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+    def test_invalidate_reloads(self):
+        cache, load = Cache(FakeRedis()), Loader('old')
+
+        async def run():
+            await cache.get_or_load('k', load)
+            load.value = 'new'
+            await cache.invalidate(['k'])
+            return await cache.get_or_load('k', load)
+
+        assert asyncio.run(run()) == 'new'
+        assert load.loads == 2
+
+    def test_entry_loaded_before_an_invalidation_never_matches(self):
+        cache = Cache(FakeRedis())
+
+        async def stale_load():
+            # The change commits and is invalidated while this read is out
+            await cache.invalidate(['k'])
+            return 'stale'
+
+        async def run():
+            await cache.get_or_load('k', stale_load)
+            return await cache.get_or_load('k', Loader('fresh'))
+
+        assert asyncio.run(run()) == 'fresh'
+
+    def test_none_is_cached(self):
+        cache, load = Cache(FakeRedis()), Loader(None)
+
+        async def run():
+            return [await cache.get_or_load('k', load) for _ in range(2)]
+
+        assert asyncio.run(run()) == [None, None]
+        assert load.loads == 1
+
+    def test_invalidate_soon_coalesces(self):
+        redis = FakeRedis()
+        cache = Cache(redis)
+
+        async def run():
+            cache.invalidate_soon(['a', 'b'])
+            cache.invalidate_soon(['b', 'c'])
+            await cache.close()
+
+        asyncio.run(run())
+        assert [int(asyncio.run(redis.get(f"{key}:gen"))) for key in 'abc'] == [1, 1, 1]
+
+    def test_unreachable_redis_falls_through(self):
+        class Down(FakeRedis):
+            async def mget(self, *keys):
+                raise ConnectionError("refused")
+
+        cache, load = Cache(Down()), Loader('value')
+
+        async def run():
+            return [await cache.get_or_load('k', load) for _ in range(2)]
+
+        assert asyncio.run(run()) == ['value', 'value']
+        assert load.loads == 2
+        assert cache.stats.errors == 2
+
+
+@pytest.mark.unit
+class TestKeys:
+    """An order or fill event invalidates each party's balances and open orders once."""
+
+    def test_party_keys(self):
+        keys = party_keys(['alice', 'bob', 'alice'])
+        assert len(keys) == 4
+        assert balances_key('alice') in keys
@@ -0,0 +1,89 @@
+"""
+Unit tests for trading-service candle aggregation.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from candles import CandleBuilder, bar_open_time, fetch_candles
+from instruments import get_pair_spec
+from order_book import BookOrder, Fill, BUY, SELL
+
+SPEC = get_pair_spec('BTC/USDT')
+T0 = datetime(2026, 10, 17, 12, 0, 0)
+
+
+def make_fill(price, quantity=1):
+    def order(order_id, side):
+        return BookOrder(order_id, 'acct', 'party', 'BTC/USDT', side, SPEC.to_ticks(Decimal(str(price))), 1)
+    return Fill('BTC/USDT', order('m', SELL), order('t', BUY),
+                SPEC.to_ticks(Decimal(str(price))), SPEC.to_lots(Decimal(str(quantity))))
+
+
+@pytest.mark.unit
+class TestBarOpenTime:
+    """Bars are aligned to whole multiples of their length."""
+
+    @pytest.mark.parametrize("at, length, expected", [
+        (datetime(2026, 10, 17, 12, 34, 56, 789), timedelta(seconds=1), datetime(2026, 10, 17, 12, 34, 56)),
+        (datetime(2026, 10, 17, 12, 34, 56), timedelta(minutes=5), datetime(2026, 10, 17, 12, 30)),
+        (datetime(2026, 10, 17, 23, 59, 59), timedelta(days=1), datetime(2026, 10, 17)),
+    ])
+    def test_open_time(self, at, length, expected):
+        assert bar_open_time(at, length) == expected
+
+
+@pytest.mark.unit
+class TestCandleBuilder:
+    """Fills land in one bar per resolution, in execution order."""
+
+    def test_ohlcv(self):
+        builder = CandleBuilder()
+        builder.add([make_fill(100, 1), make_fill(105, 2)], T0)
+        builder.add([make_fill(95, 1), make_fill(101, 3)], T0 + timedelta(seconds=30))
+
+        [bar] = builder.series('BTC/USDT', '1m')
+        assert bar.to_dict(SPEC) == {
+            'open_time': T0, 'open': '100.00', 'high': '105.00', 'low': '95.00',
+            'close': '101.00', 'volume': '7.00000000', 'trade_count': 4,
+        }
+        assert len(builder.series('BTC/USDT', '1s')) == 2
+
+    def test_late_batch_joins_its_own_bar(self):
+        builder = CandleBuilder()
+        builder.add([make_fill(100)], T0)
+        builder.add([make_fill(110)], T0 + timedelta(seconds=2))
+        builder.add([make_fill(90)], T0 + timedelta(seconds=1))
+
+        series = builder.series('BTC/USDT', '1s')
+        assert [bar.open_time.second for bar in series] == [0, 1, 2]
+        assert series[1].close == SPEC.to_ticks(Decimal(90))
+
+    def test_memory_keeps_most_recent_bars(self):
+        builder = CandleBuilder(memory_bars=3)
+        for second in range(5):
+            builder.add([make_fill(100 + second)], T0 + timedelta(seconds=second))
+        # Too old to be kept or to update the table's copy
+        builder.add([make_fill(1)], T0)
+
+        assert [bar.open_time.second for bar in builder.series('BTC/USDT', '1s')] == [2, 3, 4]
+        assert builder.series('BTC/USDT', '1m')[0].trade_count == 6
+
+    def test_recent_range_served_from_memory(self):
+        builder = CandleBuilder()
+        for second in range(5):
+            builder.add([make_fill(100 + second)], T0 + timedelta(seconds=second))
+
+        bars = asyncio.run(fetch_candles(builder, 'BTC/USDT', '1s', T0 + timedelta(seconds=1),
+                                         T0 + timedelta(seconds=4), 10))
+        assert [bar['close'] for bar in bars] == ['101.00', '102.00', '103.00']
+
+        bars = asyncio.run(fetch_candles(builder, 'BTC/USDT', '1s', None, None, 2))
+        assert [bar['close'] for bar in bars] == ['103.00', '104.00']
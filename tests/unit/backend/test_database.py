@@ -0,0 +1,191 @@
+"""
+Unit tests for trading-service database pool creation.
+"""
+
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+import database
+
+
+@pytest.mark.unit
+class TestPoolCreation:
+    """The pool is created once, however many tasks ask for it."""
+
+    def test_concurrent_callers_share_one_pool(self, monkeypatch):
+        created = []
+
+        async def create_pool(**kwargs):
+            await asyncio.sleep(0.01)
+            created.append(kwargs)
+            return object()
+
+        async def run():
+            return await asyncio.gather(*(database.get_db_pool() for _ in range(10)))
+
+        monkeypatch.setattr(database, 'db_pool', None)
+        monkeypatch.setattr(database.asyncpg, 'create_pool', create_pool)
+        pools = asyncio.run(run())
+
+        assert len(created) == 1
+        assert all(pool is pools[0] for pool in pools)
+        assert created[0]['init'] is database.init_connection
+        assert created[0]['connection_class'] is database.TradingConnection
+
+    def test_metrics_before_creation(self, monkeypatch):
+        monkeypatch.setattr(database, 'db_pool', None)
+        assert database.pool_metrics() == {"status": "not initialised"}
+
+
+@pytest.mark.unit
+class TestHotQueries:
+    """Order entry and fill persistence statements are prepared on every connection."""
+
+    def test_registered(self):
+        import orders
+        import persistence
+
+        for query in (orders.INSERT_ORDERS_SQL, orders.CANCEL_ORDERS_SQL,
+                      persistence.RESERVE_BALANCES_SQL, persistence.INSERT_TRADES_SQL):
+            assert query in database.HOT_QUERIES
+
+    def test_prepared_as_a_connection_opens(self, monkeypatch):
+        prepared = []
+
+        class Connection:
+            def add_query_logger(self, logger):
+                pass
+
+            def _count_query(self, record):
+                pass
+
+            async def prepare(self, query):
+                prepared.append(query)
+
+        monkeypatch.setattr(database, 'HOT_QUERIES', {'SELECT 1', 'SELECT 2'})
+        monkeypatch.setattr(database, '_connections', set())
+        asyncio.run(database.init_connection(Connection()))
+
+        assert sorted(prepared) == ['SELECT 1', 'SELECT 2']
+
+    def test_not_prepared_without_a_statement_cache(self, monkeypatch):
+        prepared = []
+
+        class Connection:
+            def add_query_logger(self, logger):
+                pass
+
+            def _count_query(self, record):
+                pass
+
+            async def prepare(self, query):
+                prepared.append(query)
+
+        monkeypatch.setattr(database, 'HOT_QUERIES', {'SELECT 1'})
+        monkeypatch.setattr(database, 'DB_STATEMENT_CACHE_SIZE', 0)
+        monkeypatch.setattr(database, '_connections', set())
+        asyncio.run(database.init_connection(Connection()))
+
+        assert prepared == []
+
+
+class FakePool:
+    """Hands out one connection whose lag lookup answers `lag`"""
+
+    def __init__(self, name, lag=0.0):
+        self.name = name
+        self.lag = lag
+        self.lookups = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def fetchval(self, query):
+        self.lookups += 1
+        return self.lag
+
+
+@pytest.mark.unit
+class TestReadRouting:
+    """Replica-safe reads go to the replica while it keeps up, else to the primary."""
+
+    @pytest.fixture
+    def pools(self, monkeypatch):
+        primary, replica = FakePool('primary'), FakePool('replica')
+        monkeypatch.setattr(database, 'db_pool', primary)
+        monkeypatch.setattr(database, 'replica_pool', replica)
+        monkeypatch.setattr(database, 'replica_lag', database.ReplicaLag())
+        monkeypatch.setattr(database, 'DB_REPLICA_HOST', 'replica')
+        monkeypatch.setattr(database, 'DB_REPLICA_MAX_LAG_SECONDS', 5.0)
+        return primary, replica
+
+    @staticmethod
+    def read(times=1):
+        async def run():
+            served = []
+            for _ in range(times):
+                async with database.acquire_read() as conn:
+                    served.append(conn.name)
+            return served
+
+        return asyncio.run(run())
+
+    def test_no_replica_reads_the_primary(self, pools, monkeypatch):
+        monkeypatch.setattr(database, 'DB_REPLICA_HOST', '')
+        assert self.read() == ['primary']
+        assert pools[1].lookups == 0
+
+    def test_caught_up_replica(self, pools):
+        assert self.read() == ['replica']
+        assert database.replica_lag.fallbacks == 0
+
+    def test_lagging_replica_falls_back(self, pools):
+        pools[1].lag = 30.0
+        assert self.read() == ['primary']
+        assert database.replica_lag.fallbacks == 1
+
+    def test_unreachable_replica_falls_back(self, pools, monkeypatch):
+        async def create_pool(**kwargs):
+            raise OSError("connection refused")
+
+        monkeypatch.setattr(database, 'replica_pool', None)
+        monkeypatch.setattr(database.asyncpg, 'create_pool', create_pool)
+        assert self.read() == ['primary']
+        assert database.replica_lag.seconds is None
+
+    def test_lag_looked_up_once_per_interval(self, pools, monkeypatch):
+        monkeypatch.setattr(database, 'DB_REPLICA_LAG_CHECK_SECONDS', 60.0)
+        assert self.read(5) == ['replica'] * 5
+        assert pools[1].lookups == 1
+
+    def test_metrics_report_lag(self, pools, monkeypatch):
+        monkeypatch.setattr(database, '_occupancy', lambda pool, stats: {'size': 1})
+        pools[1].lag = 30.0
+        self.read()
+        replica = database.pool_metrics()['replica']
+        assert replica == {'size': 1, 'lag_seconds': 30.0, 'usable': False, 'fallbacks': 1}
+
+    def test_reads_do_not_wait_on_a_hanging_lookup(self, pools, monkeypatch):
+        async def run():
+            started = asyncio.Event()
+
+            async def fetchval(query):
+                started.set()
+                await asyncio.sleep(60)
+
+            monkeypatch.setattr(pools[1], 'fetchval', fetchval)
+            lookup = asyncio.create_task(database.replica_lag.refresh())
+            await started.wait()
+            async with database.acquire_read() as conn:
+                served = conn.name
+            lookup.cancel()
+            return served
+
+        assert asyncio.run(asyncio.wait_for(run(), 5)) == 'primary'
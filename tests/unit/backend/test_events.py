@@ -0,0 +1,124 @@
+"""
+Unit tests for trading-service order and trade events and the outbox relay.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from events import EventSchema, order_event, schema, trade_events
+from instruments import get_pair_spec
+from order_book import BookOrder, Fill
+from outbox import FakeBroker, FakeProducer, publish
+
+
+def order_row(**overrides):
+    row = {
+        'order_id': uuid.uuid4(), 'account_id': uuid.uuid4(), 'pair': 'BTC/USDT', 'side': 'BUY',
+        'order_type': 'LIMIT', 'price': Decimal('92450.000000000000000000'),
+        'quantity': Decimal('0.5'), 'filled_quantity': Decimal('0'), 'status': 'OPEN',
+        'time_in_force': 'GTC',
+    }
+    row.update(overrides)
+    return row
+
+
+def order_event_record():
+    _, _, payload = order_event('OrderCreated', order_row())
+    return schema('order-event-schema.json').decode(payload)
+
+
+@pytest.mark.unit
+class TestEventSchema:
+    """Records round-trip through Avro's binary encoding."""
+
+    def test_round_trip(self):
+        avro = EventSchema({'name': 'T', 'fields': [
+            {'name': 's', 'type': 'string'},
+            {'name': 'n', 'type': 'long'},
+            {'name': 'b', 'type': 'boolean'},
+            {'name': 'e', 'type': {'type': 'enum', 'name': 'E', 'symbols': ['X', 'Y']}},
+        ]})
+        for record in ({'s': 'été', 'n': -1, 'b': True, 'e': 'Y'},
+                       {'s': '', 'n': 2 ** 62, 'b': False, 'e': 'X'}):
+            assert avro.decode(avro.encode(record)) == record
+
+    def test_known_encoding(self):
+        # From the Avro spec: longs zig-zag, strings are length-prefixed
+        avro = EventSchema({'name': 'T', 'fields': [{'name': 'n', 'type': 'long'}, {'name': 's', 'type': 'string'}]})
+        assert avro.encode({'n': -64, 's': 'foo'}) == bytes([0x7f, 0x06]) + b'foo'
+
+    def test_unknown_symbol(self):
+        with pytest.raises(ValueError):
+            schema('order-event-schema.json').encode({**order_event_record(), 'side': 'BUY'})
+
+    def test_unsupported_type(self):
+        with pytest.raises(ValueError):
+            EventSchema({'name': 'T', 'fields': [{'name': 'x', 'type': 'double'}]})
+
+
+@pytest.mark.unit
+class TestEvents:
+    """Events carry the schemas' fields, scaled like the API, keyed by pair."""
+
+    def test_order_event(self):
+        row = order_row(order_type='MARKET', price=None, status='PARTIALLY_FILLED', filled_quantity=Decimal('0.2'))
+        topic, key, payload = order_event('OrderFilled', row)
+        record = schema('order-event-schema.json').decode(payload)
+
+        assert (topic, key) == ('cantondex.orders', 'BTC/USDT')
+        assert record['event_type'] == 'OrderFilled'
+        assert record['order_id'] == str(row['order_id'])
+        assert (record['side'], record['order_type']) == ('Buy', 'Market')
+        assert record['price'] == ''
+        assert record['filled_quantity'] == str(Decimal('0.2').quantize(get_pair_spec('BTC/USDT').lot_size))
+
+    def test_trade_events(self):
+        spec = get_pair_spec('BTC/USDT')
+        maker = BookOrder(uuid.uuid4(), uuid.uuid4(), 'alice', 'BTC/USDT', 'SELL', spec.to_ticks(Decimal('92450')), 10)
+        taker = BookOrder(uuid.uuid4(), uuid.uuid4(), 'bob', 'BTC/USDT', 'BUY', spec.to_ticks(Decimal('92500')), 10)
+        fill = Fill('BTC/USDT', maker, taker, maker.price, 4)
+
+        [(topic, key, payload)] = trade_events([fill], datetime(2026, 1, 1))
+        record = schema('trade-event-schema.json').decode(payload)
+
+        assert (topic, key) == ('cantondex.trades', 'BTC/USDT')
+        assert record['trade_id'] == str(fill.trade_id)
+        assert (record['buy_order_id'], record['sell_order_id']) == (str(taker.order_id), str(maker.order_id))
+        assert record['price'] == str(spec.price(maker.price))
+        assert record['trade_timestamp'] == 1767225600000
+
+
+@pytest.mark.unit
+class TestPublish:
+    """Each pair's events reach one partition, in outbox order."""
+
+    @staticmethod
+    def rows(count):
+        pairs = ['BTC/USDT', 'ETH/USDT', 'SOL/USDT']
+        return [
+            {'topic': 'cantondex.trades', 'event_key': pairs[n % 3], 'payload': f"{pairs[n % 3]}:{n}".encode()}
+            for n in range(count)
+        ]
+
+    def test_per_pair_order(self):
+        broker = FakeBroker(partitions=2)
+        rows = self.rows(30)
+        assert asyncio.run(publish(FakeProducer(broker), rows)) == 30
+
+        for pair in ('BTC/USDT', 'ETH/USDT', 'SOL/USDT'):
+            sent = [row['payload'] for row in rows if row['event_key'] == pair]
+            assert broker.messages('cantondex.trades', pair.encode()) == sent
+
+    def test_broker_down_fails_the_round(self):
+        broker = FakeBroker()
+        broker.down = True
+        with pytest.raises(ConnectionError):
+            asyncio.run(publish(FakeProducer(broker), self.rows(3)))
@@ -0,0 +1,61 @@
+"""
+Unit tests for trading-service history cursors and queries.
+"""
+
+import os
+import sys
+import uuid
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from history import SOURCES, build_query, make_cursor, parse_cursor
+
+PARTY = 'alice::1220'
+ROW_ID = uuid.UUID('00000000-0000-0000-0000-00000000002a')
+
+
+@pytest.mark.unit
+class TestCursor:
+    """Cursors round-trip and reject garbage."""
+
+    def test_round_trip(self):
+        matched_at = datetime(2026, 5, 1, 12, 30, 0, 123456)
+        cursor = make_cursor(SOURCES['trades'], {'matched_at': matched_at, 'trade_id': ROW_ID})
+        assert parse_cursor(cursor) == (matched_at, ROW_ID)
+
+    @pytest.mark.parametrize("cursor", ["", "yesterday", "2026-05-01T12:30:00", "2026-05-01T12:30:00,nope"])
+    def test_rejected(self, cursor):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            parse_cursor(cursor)
+
+
+@pytest.mark.unit
+class TestBuildQuery:
+    """Keyset queries and their parameter numbering."""
+
+    def test_first_page(self):
+        query, args = build_query(SOURCES['orders'], PARTY, limit=101)
+        assert args == [PARTY, 101]
+        assert "WHERE party_id = $1 ORDER BY created_at DESC, order_id DESC LIMIT $2" in query
+
+    def test_after_cursor_and_status(self):
+        query, args = build_query(SOURCES['orders'], PARTY, f"2026-05-01T12:30:00,{ROW_ID}", 'FILLED', 101)
+        assert args == [PARTY, datetime(2026, 5, 1, 12, 30), ROW_ID, 'FILLED', 101]
+        assert "(created_at, order_id) < ($2, $3) AND status = $4" in query
+        assert query.endswith("LIMIT $5")
+
+    def test_export_has_no_limit(self):
+        query, args = build_query(SOURCES['transactions'], PARTY)
+        assert args == [PARTY]
+        assert "LIMIT" not in query
+
+    def test_trades_scan_each_side_once(self):
+        query, _ = build_query(SOURCES['trades'], PARTY, limit=11)
+        assert query.count("UNION ALL") == 1
+        assert "WHERE maker_party_id = $1 ORDER BY" in query
+        # A self-trade comes back from the maker branch only
+        assert "WHERE taker_party_id = $1 AND maker_party_id <> $1 ORDER BY" in query
+        assert query.count("LIMIT $2") == 3
@@ -0,0 +1,230 @@
+"""
+Unit tests for the matching engine's snapshot and journal recovery.
+"""
+
+import os
+import shutil
+import sys
+import uuid
+import zlib
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from journal import JournalFormatError, MatchJournal, PairJournal
+from order_book import OrderBook, BookOrder, BUY, SELL
+
+PAIR = 'BTC/USDT'
+
+
+def make_order(side, price, quantity, created_at, filled=0):
+    return BookOrder(uuid.uuid4(), uuid.uuid4(), 'party::alice', PAIR, side, price, quantity,
+                     filled, datetime(2026, 1, 1, 12, 0, created_at))
+
+
+def book_state(book):
+    """Every resting order in priority order, with its quantities"""
+    return [
+        (o.order_id, o.account_id, o.party_id, o.side, o.price, o.quantity, o.filled_quantity, o.created_at)
+        for side in (book.bids, book.asks) for level in side.levels() for o in level
+    ]
+
+
+def apply(book, journal, order):
+    book.add(order)
+    journal.record_order(order)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return PairJournal(str(tmp_path), PAIR, fsync=False)
+
+
+@pytest.mark.unit
+class TestReplay:
+    """Rebuilding a book from the snapshot and journal tail."""
+
+    def test_journal_only(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        for i, (side, price) in enumerate([(BUY, 100), (BUY, 100), (SELL, 102), (BUY, 99)]):
+            apply(book, journal, make_order(side, price, 5, i))
+        journal.flush()
+
+        recovered, last_trade_id = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert book_state(recovered) == book_state(book)
+        assert last_trade_id is None
+
+    def test_fills_and_removals(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        apply(book, journal, make_order(SELL, 100, 2, 0))
+        apply(book, journal, make_order(SELL, 101, 2, 1))
+        cancelled = make_order(SELL, 103, 1, 2)
+        apply(book, journal, cancelled)
+        book.remove(cancelled.order_id)
+        journal.record_remove(cancelled.order_id)
+        apply(book, journal, make_order(BUY, 101, 3, 3))
+        fills = book.match()
+        journal.record_fills(fills)
+        journal.flush()
+
+        recovered, last_trade_id = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert book_state(recovered) == book_state(book)
+        assert last_trade_id == fills[-1].trade_id
+
+    def test_snapshot_plus_tail(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        for i in range(10):
+            apply(book, journal, make_order(BUY if i % 2 else SELL, 100 + (i % 3) * (1 if i % 2 else -1) * 5, 4, i))
+        journal.write_snapshot(book)
+        apply(book, journal, make_order(BUY, 200, 1, 20))
+        journal.flush()
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert book_state(recovered) == book_state(book)
+
+    def test_records_covered_by_snapshot_are_skipped(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        apply(book, journal, make_order(BUY, 100, 1, 0))
+        journal.flush()
+        stale = str(tmp_path / 'stale')
+        shutil.copy(journal.journal_path, stale)
+        book.fill(book.best_bid(), 1)
+        journal.write_snapshot(book)
+        # Crash between writing the snapshot and truncating the journal
+        shutil.copy(stale, journal.journal_path)
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert len(recovered) == 0
+
+    def test_sequence_continues_after_recovery(self, tmp_path, journal):
+        apply(OrderBook(PAIR), journal, make_order(BUY, 100, 1, 0))
+        journal.flush()
+
+        reopened = PairJournal(str(tmp_path), PAIR)
+        book, _ = reopened.recover()
+        apply(book, reopened, make_order(BUY, 101, 1, 1))
+        reopened.flush()
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+        assert book_state(recovered) == book_state(book)
+
+    def test_stops_and_icebergs(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        stop = make_order(SELL, None, 3, 0)
+        stop.stop_price = 95
+        apply(book, journal, stop)
+        iceberg = BookOrder(uuid.uuid4(), uuid.uuid4(), 'party::bob', PAIR, BUY, 100, 10, 0,
+                            datetime(2026, 1, 1), time_in_force='GTC', display_quantity=2)
+        apply(book, journal, iceberg)
+        apply(book, journal, make_order(BUY, 100, 1, 1))
+        journal.record_fills(book.execute(make_order(SELL, 100, 3, 2)))
+        journal.write_snapshot(book)
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert book_state(recovered) == book_state(book)
+        assert recovered.get(iceberg.order_id).shown == 2
+        assert recovered.bids.best().hidden == 6
+        assert recovered.stops.get(stop.order_id).stop_price == 95
+
+    def test_stop_market_buy_keeps_its_budget(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        stop = make_order(BUY, None, 3, 0)
+        stop.stop_price = 105
+        stop.budget = 10 ** 15
+        apply(book, journal, stop)
+        journal.flush()
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert recovered.stops.get(stop.order_id).budget == 10 ** 15
+
+
+@pytest.mark.unit
+class TestTornWrites:
+    """Partial records left by a crash."""
+
+    def test_torn_tail_is_dropped(self, tmp_path, journal):
+        book = OrderBook(PAIR)
+        apply(book, journal, make_order(BUY, 100, 1, 0))
+        journal.flush()
+        good_size = os.path.getsize(journal.journal_path)
+        journal.record_order(make_order(BUY, 101, 1, 1))
+        journal.flush()
+        with open(journal.journal_path, 'r+b') as f:
+            f.truncate(os.path.getsize(journal.journal_path) - 3)
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert book_state(recovered) == book_state(book)
+        assert os.path.getsize(journal.journal_path) == good_size
+
+    def test_corrupt_snapshot_rejected(self, tmp_path, journal):
+        journal.write_snapshot(OrderBook(PAIR))
+        with open(journal.snapshot_path, 'r+b') as f:
+            f.seek(10)
+            f.write(b'\xff')
+
+        with pytest.raises(ValueError):
+            PairJournal(str(tmp_path), PAIR).recover()
+
+    def test_torn_header_is_dropped(self, tmp_path, journal):
+        journal.record_order(make_order(BUY, 100, 1, 0))
+        journal.flush()
+        with open(journal.journal_path, 'r+b') as f:
+            f.truncate(3)
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+
+        assert len(recovered) == 0
+        assert os.path.getsize(journal.journal_path) == 0
+
+    def test_older_formats_rejected(self, tmp_path, journal):
+        journal.record_order(make_order(BUY, 100, 1, 0))
+        journal.flush()
+        with open(journal.journal_path, 'r+b') as f:
+            f.write(b'CDXJRNL2')
+
+        with pytest.raises(JournalFormatError):
+            PairJournal(str(tmp_path), PAIR).recover()
+
+        journal.write_snapshot(OrderBook(PAIR))
+        with open(journal.snapshot_path, 'rb') as f:
+            data = bytearray(f.read())
+        data[:8] = b'CDXBOOK2'
+        data[-4:] = zlib.crc32(data[:-4]).to_bytes(4, 'little')
+        with open(journal.snapshot_path, 'wb') as f:
+            f.write(data)
+
+        with pytest.raises(JournalFormatError):
+            PairJournal(str(tmp_path), PAIR).recover()
+
+    def test_unflushed_records_are_not_written(self, tmp_path, journal):
+        journal.record_order(make_order(BUY, 100, 1, 0))
+        journal.discard()
+        journal.flush()
+
+        recovered, _ = PairJournal(str(tmp_path), PAIR).recover()
+        assert len(recovered) == 0
+
+
+@pytest.mark.unit
+class TestMatchJournal:
+    """Directory layout and the sync checkpoint."""
+
+    def test_pairs_and_checkpoint(self, tmp_path):
+        journal = MatchJournal(str(tmp_path), fsync=False)
+        journal.for_pair('BTC/USDT').write_snapshot(OrderBook('BTC/USDT'))
+        journal.for_pair('tTBILL/USDT').write_snapshot(OrderBook('tTBILL/USDT'))
+        assert journal.read_checkpoint() is None
+
+        journal.write_checkpoint(datetime(2026, 1, 1, 12, 30, 5, 123456))
+
+        assert journal.pairs() == ['BTC/USDT', 'tTBILL/USDT']
+        assert journal.read_checkpoint() == datetime(2026, 1, 1, 12, 30, 5, 123456)
@@ -0,0 +1,183 @@
+"""
+Unit tests for trading-service pair leases.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+import ledger
+import matching_engine
+from leases import PairLeases, fair_share
+from matching_engine import MatchingEngine
+
+
+@pytest.mark.unit
+class TestFairShare:
+    """Pairs are split evenly, the remainder going to the replicas that sort first."""
+
+    def test_even_split(self):
+        replicas = ['a', 'b']
+        assert [fair_share(4, replicas, r) for r in replicas] == [2, 2]
+
+    def test_remainder(self):
+        replicas = ['c', 'a', 'b']
+        assert [fair_share(4, replicas, r) for r in ('a', 'b', 'c')] == [2, 1, 1]
+
+    def test_shares_cover_every_pair(self):
+        for pairs in range(10):
+            replicas = [f"replica-{n}" for n in range(4)]
+            assert sum(fair_share(pairs, replicas, r) for r in replicas) == pairs
+
+    def test_more_replicas_than_pairs(self):
+        replicas = ['a', 'b', 'c']
+        assert [fair_share(1, replicas, r) for r in replicas] == [1, 0, 0]
+
+    def test_not_yet_counted(self):
+        # Before its first heartbeat is visible a replica claims nothing
+        assert fair_share(4, ['a'], 'b') == 0
+
+
+@pytest.mark.unit
+class TestPairLeases:
+    """A pair nobody has leased yet brings the next round forward."""
+
+    def test_new_pair_wakes_the_next_round(self):
+        leases = PairLeases('a')
+
+        async def wake():
+            leases.saw('BTC/USDT')
+            await leases.wait(60)
+
+        asyncio.run(asyncio.wait_for(wake(), 1))
+
+    def test_known_pair_does_not(self):
+        leases = PairLeases('a')
+        leases._known = {'BTC/USDT'}
+        leases.saw('BTC/USDT')
+
+        assert not leases._wake.is_set()
+
+
+def order_row(pair, side):
+    return {
+        'order_id': uuid.uuid4(), 'account_id': uuid.uuid4(), 'party_id': f"party::{side.lower()}",
+        'pair': pair, 'side': side, 'order_type': 'LIMIT', 'time_in_force': 'GTC',
+        'quantity': Decimal('1'), 'price': Decimal('100'), 'stop_price': None, 'display_quantity': None,
+        'max_cost': None, 'filled_quantity': Decimal('1'), 'status': 'FILLED',
+        'created_at': datetime(2026, 1, 1), 'updated_at': datetime(2026, 1, 1), 'triggered_at': None,
+    }
+
+
+class TradesConnection:
+    """Trades and orders a replica wrote before it died, answered like the database"""
+
+    def __init__(self):
+        self.orders = {}
+        self.trades = []
+
+    def add_trade(self, pair):
+        maker, taker = order_row(pair, 'SELL'), order_row(pair, 'BUY')
+        self.orders.update({maker['order_id']: maker, taker['order_id']: taker})
+        trade = {
+            'trade_id': uuid.uuid4(), 'pair': pair, 'price': Decimal('100'), 'quantity': Decimal('1'),
+            'maker_order_id': maker['order_id'], 'taker_order_id': taker['order_id'],
+            'settlement_status': 'PENDING',
+        }
+        self.trades.append(trade)
+        return trade
+
+    async def fetch(self, query, *args):
+        if query is matching_engine.PENDING_TRADES_SQL:
+            pairs, _ = args
+            return [t for t in self.trades
+                    if t['settlement_status'] == 'PENDING' and (pairs is None or t['pair'] in pairs)]
+        if query is matching_engine.ORDERS_BY_ID_SQL:
+            return [self.orders[order_id] for order_id in args[0]]
+        raise AssertionError(query)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+@pytest.mark.unit
+class TestTakeover:
+    """A replica that takes over a dead one's pair settles the trades it left pending."""
+
+    @pytest.fixture
+    def conn(self, monkeypatch):
+        conn = TradesConnection()
+
+        @asynccontextmanager
+        async def acquire():
+            yield conn
+
+        async def mark_settled(_, trade_ids):
+            settled = set()
+            for trade in conn.trades:
+                if trade['trade_id'] in trade_ids and trade['settlement_status'] == 'PENDING':
+                    trade['settlement_status'] = 'SETTLED'
+                    settled.add(trade['trade_id'])
+            return settled
+
+        async def settle_balances(*_):
+            pass
+
+        monkeypatch.setattr(matching_engine, 'acquire', acquire)
+        monkeypatch.setattr(ledger, 'mark_settled', mark_settled)
+        monkeypatch.setattr(ledger, 'settle_balances', settle_balances)
+        return conn
+
+    @pytest.fixture
+    def engine(self, monkeypatch):
+        engine = MatchingEngine()
+        engine.leases = PairLeases('b')
+        rebuilt = engine.rebuilt = []
+
+        class Worker:
+            def __init__(self, pair):
+                self.pair = pair
+
+            def rebuild(self):
+                rebuilt.append(self.pair)
+
+        async def load(conn, pairs=None):
+            pass
+
+        monkeypatch.setattr(engine.candles, 'load', load)
+        monkeypatch.setattr(engine.ticker, 'load', load)
+        monkeypatch.setattr(engine, '_worker', Worker)
+        return engine
+
+    def test_dead_replicas_trades_settled_on_takeover(self, conn, engine, monkeypatch):
+        orphaned = conn.add_trade('BTC/USDT')
+        live = conn.add_trade('ETH/USDT')
+
+        async def balance(_):
+            # Replica a died holding BTC/USDT; its lease lapsed and b claims it
+            return {'BTC/USDT'}, set()
+
+        monkeypatch.setattr(engine.leases, 'balance', balance)
+        asyncio.run(engine.balance_leases())
+
+        assert orphaned['settlement_status'] == 'SETTLED'
+        # Another replica still holds ETH/USDT and settles its own
+        assert live['settlement_status'] == 'PENDING'
+        assert engine.rebuilt == ['BTC/USDT']
+        assert len(engine.ledger) == 0
+
+    def test_sweep_settles_trades_of_pairs_nobody_takes_over(self, conn, engine):
+        orphaned = conn.add_trade('BTC/USDT')
+
+        assert asyncio.run(engine.settle_pending_trades(min_age=60)) == 1
+        assert orphaned['settlement_status'] == 'SETTLED'
+        assert asyncio.run(engine.settle_pending_trades(min_age=60)) == 0
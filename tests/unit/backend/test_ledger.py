@@ -0,0 +1,163 @@
+"""
+Unit tests for trading-service fill settlement and the balance ledger.
+"""
+
+import asyncio
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from instruments import get_pair_spec
+from ledger import BalanceLedger
+from order_book import BookOrder, Fill, BUY, SELL
+from persistence import (
+    TRANSACTION_COLUMNS, balance_deltas, release_deltas, transaction_legs, write_transactions
+)
+
+SPEC = get_pair_spec('BTC/USDT')
+
+
+def make_order(order_id, side, price, quantity):
+    return BookOrder(
+        order_id=order_id,
+        account_id=f"acct-{order_id}",
+        party_id=f"party-{order_id}",
+        pair='BTC/USDT',
+        side=side,
+        price=SPEC.to_ticks(Decimal(str(price))),
+        quantity=SPEC.to_lots(Decimal(str(quantity))),
+    )
+
+
+def make_fill(buy_price, fill_price, quantity=1):
+    maker = make_order('sell', SELL, fill_price, quantity)
+    taker = make_order('buy', BUY, buy_price, quantity)
+    return Fill('BTC/USDT', maker, taker, SPEC.to_ticks(Decimal(str(fill_price))), SPEC.to_lots(Decimal(str(quantity))))
+
+
+@pytest.mark.unit
+class TestBalanceDeltas:
+    """A fill moves locked funds to the counterparty's available funds."""
+
+    def test_fill_at_limit_price(self):
+        deltas = balance_deltas([make_fill(100, 100, 2)])
+
+        assert deltas[('acct-buy', 'USDT')] == [0, Decimal(-200)]
+        assert deltas[('acct-buy', 'BTC')] == [Decimal(2), 0]
+        assert deltas[('acct-sell', 'BTC')] == [0, Decimal(-2)]
+        assert deltas[('acct-sell', 'USDT')] == [Decimal(200), 0]
+
+    def test_price_improvement_is_unlocked(self):
+        deltas = balance_deltas([make_fill(105, 100, 2)])
+
+        # Reserved 210, spent 200
+        assert deltas[('acct-buy', 'USDT')] == [Decimal(10), Decimal(-210)]
+
+    def test_market_buy_spends_locked_budget(self):
+        fill = make_fill(100, 100, 2)
+        fill.taker.price = None
+        deltas = balance_deltas([fill])
+
+        # No limit, so no price improvement; the unspent budget is released on expiry
+        assert deltas[('acct-buy', 'USDT')] == [0, Decimal(-200)]
+
+    def test_legs_match_total_change(self):
+        fill = make_fill(105, 100, 2)
+        deltas = balance_deltas([fill])
+        totals = {}
+        for account_id, _, asset, amount, _, trade_id in transaction_legs([fill]):
+            assert trade_id == fill.trade_id
+            totals[(account_id, asset)] = totals.get((account_id, asset), 0) + amount
+
+        assert totals == {key: available + locked for key, (available, locked) in deltas.items()}
+
+
+@pytest.mark.unit
+class TestReleaseDeltas:
+    """Cancelling an order frees what it still holds."""
+
+    def test_limit_buy_releases_remainder_at_limit(self):
+        order = make_order('buy', BUY, 100, 3)
+        order.filled_quantity = SPEC.to_lots(Decimal(1))
+
+        assert release_deltas([order])[('acct-buy', 'USDT')] == [Decimal(200), Decimal(-200)]
+
+    def test_market_buy_releases_unspent_budget(self):
+        order = make_order('buy', BUY, 100, 3)
+        order.price = None
+        order.filled_quantity = order.quantity
+        order.budget = SPEC.to_cost(Decimal('12.5'))
+
+        assert release_deltas([order])[('acct-buy', 'USDT')] == [Decimal('12.5'), Decimal('-12.5')]
+
+    def test_market_buy_without_budget_releases_nothing(self):
+        order = make_order('buy', BUY, 100, 3)
+        order.price = None
+        order.budget = 0
+
+        assert release_deltas([order]) == {}
+
+
+class CopyConnection:
+    """Records what is copied instead of copying it"""
+
+    def __init__(self):
+        self.copied = []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.append((table, list(records), columns))
+
+
+@pytest.mark.unit
+class TestWriteTransactions:
+    """Transactions rows are copied with each leg's running balance."""
+
+    def test_balance_after_worked_back_from_totals(self):
+        legs = [
+            ('acct', 'party', 'USDT', Decimal(-100), 'o1', 't1'),
+            ('acct', 'party', 'USDT', Decimal(-50), 'o1', 't2'),
+            ('acct', 'party', 'BTC', Decimal(1), 'o1', 't1'),
+        ]
+        conn = CopyConnection()
+        asyncio.run(write_transactions(conn, legs, {('acct', 'USDT'): Decimal(850), ('acct', 'BTC'): Decimal(3)}))
+
+        [(table, records, columns)] = conn.copied
+        assert table == 'transactions' and columns == TRANSACTION_COLUMNS
+        rows = [dict(zip(columns, record)) for record in records]
+        assert [row['balance_after'] for row in rows] == [Decimal(900), Decimal(850), Decimal(3)]
+        assert {row['tx_type'] for row in rows} == {'TRADE'}
+        assert [row['trade_id'] for row in rows] == ['t1', 't2', 't1']
+
+    def test_nothing_to_write(self):
+        conn = CopyConnection()
+        asyncio.run(write_transactions(conn, [], {}))
+        assert conn.copied == []
+
+
+@pytest.mark.unit
+class TestBalanceLedger:
+    """Held fills are counted once and only credit what they pay out."""
+
+    def test_add_is_idempotent(self):
+        ledger = BalanceLedger()
+        fill = make_fill(100, 100)
+        ledger.add([fill])
+        ledger.add([fill])
+
+        assert len(ledger) == 1
+        assert ledger.pending()[('acct-sell', 'USDT')] == [Decimal(100), 0]
+
+    def test_has_credit(self):
+        ledger = BalanceLedger()
+        assert not ledger.has_credit([('acct-sell', 'USDT')])
+
+        ledger.add([make_fill(100, 100)])
+
+        assert ledger.has_credit([('acct-sell', 'USDT')])
+        assert ledger.has_credit([('acct-buy', 'BTC')])
+        # The buyer's quote only leaves the account
+        assert not ledger.has_credit([('acct-buy', 'USDT'), ('acct-sell', 'BTC')])
@@ -0,0 +1,533 @@
+"""
+Unit tests for the trading-service in-memory order book.
+"""
+
+import asyncio
+import os
+import random
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from instruments import PAIR_SPECS, UnknownPairError, get_pair_spec
+from order_book import OrderBook, BookOrder, SortedKeys, BUY, SELL
+from persistence import StaleOrderError, mark_triggered
+
+
+def make_order(order_id, side, price, quantity, filled=0, created_at=0):
+    return BookOrder(
+        order_id=order_id,
+        account_id=f"acct-{order_id}",
+        party_id=f"party-{order_id}",
+        pair='BTC/USDT',
+        side=side,
+        price=Decimal(str(price)),
+        quantity=Decimal(str(quantity)),
+        filled_quantity=Decimal(str(filled)),
+        created_at=created_at,
+    )
+
+
+@pytest.fixture
+def book():
+    return OrderBook('BTC/USDT')
+
+
+@pytest.mark.unit
+class TestPricePriority:
+    """Best bid/ask selection."""
+
+    def test_best_bid_is_highest_price(self, book):
+        for i, price in enumerate([92400, 92450, 92350]):
+            book.add(make_order(f"b{i}", BUY, price, 1))
+
+        assert book.best_bid().order_id == 'b1'
+
+    def test_best_ask_is_lowest_price(self, book):
+        for i, price in enumerate([92650, 92550, 92600]):
+            book.add(make_order(f"a{i}", SELL, price, 1))
+
+        assert book.best_ask().order_id == 'a1'
+
+    def test_empty_book(self, book):
+        assert book.best_bid() is None
+        assert book.best_ask() is None
+
+    def test_levels_iterate_best_first(self, book):
+        for i, price in enumerate([3, 1, 2]):
+            book.add(make_order(f"a{i}", SELL, price, 1))
+
+        assert [level.price for level in book.asks.levels()] == [1, 2, 3]
+
+
+@pytest.mark.unit
+class TestTimePriority:
+    """FIFO queues within a price level."""
+
+    def test_fifo_within_level(self, book):
+        book.add(make_order('first', BUY, 100, 1))
+        book.add(make_order('second', BUY, 100, 1))
+
+        assert book.best_bid().order_id == 'first'
+        book.remove('first')
+        assert book.best_bid().order_id == 'second'
+
+    def test_level_quantity_tracks_fills(self, book):
+        first = make_order('first', BUY, 100, 2)
+        book.add(first)
+        book.add(make_order('second', BUY, 100, 3))
+
+        book.fill(first, Decimal('0.5'))
+        assert book.bids.best().quantity == Decimal('4.5')
+
+        book.fill(first, Decimal('1.5'))
+        assert 'first' not in book
+        assert book.bids.best().quantity == Decimal('3')
+
+    def test_emptied_level_is_dropped(self, book):
+        book.add(make_order('a', SELL, 101, 1))
+        book.add(make_order('b', SELL, 102, 1))
+
+        book.remove('a')
+        assert len(book.asks) == 1
+        assert book.best_ask().order_id == 'b'
+
+
+@pytest.mark.unit
+class TestBookMaintenance:
+    """Adding, removing and refreshing persisted orders."""
+
+    def test_duplicate_order_rejected(self, book):
+        book.add(make_order('a', BUY, 100, 1))
+
+        with pytest.raises(ValueError):
+            book.add(make_order('a', BUY, 100, 1))
+
+    def test_upsert_keeps_queue_position(self, book):
+        book.add(make_order('a', BUY, 100, 2))
+        book.add(make_order('b', BUY, 100, 2))
+
+        book.upsert(make_order('a', BUY, 100, 2, filled=1))
+
+        assert book.best_bid().order_id == 'a'
+        assert book.best_bid().remaining == 1
+        assert book.bids.best().quantity == 3
+
+    def test_upsert_price_change_requeues(self, book):
+        book.add(make_order('a', BUY, 100, 1))
+        book.add(make_order('b', BUY, 99, 1))
+
+        book.upsert(make_order('a', BUY, 98, 1))
+
+        assert book.best_bid().order_id == 'b'
+        assert book.bids.level(Decimal('100')) is None
+
+    def test_upsert_fully_filled_removes(self, book):
+        book.add(make_order('a', SELL, 100, 1))
+
+        book.upsert(make_order('a', SELL, 100, 1, filled=1))
+
+        assert 'a' not in book
+        assert book.best_ask() is None
+
+
+@pytest.mark.unit
+class TestMatching:
+    """Uncrossing the book in a single pass."""
+
+    def test_no_cross_no_fills(self, book):
+        book.add(make_order('b', BUY, 99, 1, created_at=1))
+        book.add(make_order('a', SELL, 100, 1, created_at=2))
+
+        assert book.match() == []
+        assert len(book) == 2
+
+    def test_sweeps_every_crossable_level(self, book):
+        book.add(make_order('a1', SELL, 100, 1, created_at=1))
+        book.add(make_order('a2', SELL, 101, 1, created_at=2))
+        book.add(make_order('a3', SELL, 102, 1, created_at=3))
+        book.add(make_order('a4', SELL, 105, 1, created_at=4))
+        book.add(make_order('taker', BUY, 103, 5, created_at=5))
+
+        fills = book.match()
+
+        assert [f.price for f in fills] == [100, 101, 102]
+        assert all(f.taker.order_id == 'taker' for f in fills)
+        assert book.best_bid().remaining == 2
+        assert book.best_ask().order_id == 'a4'
+
+    def test_maker_sets_price(self, book):
+        book.add(make_order('bid', BUY, 105, 1, created_at=1))
+        book.add(make_order('ask', SELL, 100, 1, created_at=2))
+
+        (fill,) = book.match()
+
+        assert fill.price == 105
+        assert fill.maker.order_id == 'bid'
+        assert fill.buyer.order_id == 'bid'
+        assert fill.seller.order_id == 'ask'
+
+    def test_maker_is_first_to_rest_without_timestamps(self, book):
+        # Orders recovered from the journal may carry no created_at
+        book.add(make_order('ask', SELL, 100, 1, created_at=None))
+        book.add(make_order('bid', BUY, 105, 1, created_at=None))
+
+        (fill,) = book.match()
+
+        assert fill.maker.order_id == 'ask'
+        assert fill.price == 100
+
+    def test_taker_exhausted_stops_sweep(self, book):
+        book.add(make_order('a1', SELL, 100, 2, created_at=1))
+        book.add(make_order('a2', SELL, 100, 2, created_at=2))
+        book.add(make_order('taker', BUY, 100, 3, created_at=3))
+
+        fills = book.match()
+
+        assert [(f.maker.order_id, f.quantity) for f in fills] == [('a1', 2), ('a2', 1)]
+        assert book.best_bid() is None
+        assert book.best_ask().remaining == 1
+
+
+@pytest.mark.unit
+class TestFixedPoint:
+    """Integer ticks and lots in the match loop."""
+
+    def test_round_trip(self):
+        spec = get_pair_spec('BTC/USDT')
+
+        assert spec.to_ticks(Decimal('92450.01')) == 9245001
+        assert spec.price(9245001) == Decimal('92450.01')
+        assert spec.to_lots('0.5') == 50000000
+        assert spec.quantity(50000000) == Decimal('0.5')
+
+    def test_off_grid_values_rejected(self):
+        spec = get_pair_spec('BTC/USDT')
+
+        with pytest.raises(ValueError):
+            spec.to_ticks(Decimal('92450.001'))
+        with pytest.raises(ValueError):
+            spec.to_lots(Decimal('0.000000001'))
+
+    def test_float_input_is_not_rounded_binary(self):
+        assert get_pair_spec('BTC/USDT').to_lots(0.1) == 10000000
+
+    def test_unlisted_pair_rejected(self):
+        with pytest.raises(UnknownPairError):
+            get_pair_spec('XYZ/USDT')
+
+        assert 'XYZ/USDT' not in PAIR_SPECS
+
+    def test_match_on_integers(self, book):
+        spec = get_pair_spec('BTC/USDT')
+        book.add(make_int_order('a', SELL, spec.to_ticks('100.01'), spec.to_lots('0.3'), 1))
+        book.add(make_int_order('b', BUY, spec.to_ticks('100.02'), spec.to_lots('0.1'), 2))
+
+        (fill,) = book.match()
+
+        assert spec.price(fill.price) == Decimal('100.01')
+        assert spec.quantity(fill.quantity) == Decimal('0.1')
+        assert book.best_ask().remaining == spec.to_lots('0.2')
+
+
+
+@pytest.mark.unit
+class TestExecution:
+    """Market, immediate-or-cancel and fill-or-kill takers."""
+
+    @pytest.fixture
+    def asks(self, book):
+        for i, (price, quantity) in enumerate([(100, 1), (101, 2), (103, 4)]):
+            book.add(make_order(f"a{i}", SELL, price, quantity, created_at=i))
+        return book
+
+    def test_market_sweeps_any_price(self, asks):
+        taker = make_order('mkt', BUY, 0, 5)
+        taker.price = None
+
+        fills = asks.execute(taker)
+
+        assert [(f.maker.order_id, f.price, f.quantity) for f in fills] == [
+            ('a0', 100, 1), ('a1', 101, 2), ('a2', 103, 2)]
+        assert taker.remaining == 0
+        assert asks.best_ask().remaining == 2
+
+    def test_market_buy_stops_at_its_budget(self, asks):
+        taker = make_order('mkt', BUY, 0, 5)
+        taker.price = None
+        taker.budget = 100 + 2 * 101 + 150
+
+        fills = asks.execute(taker)
+
+        # 150 left after the first two levels buys one lot at 103, not two
+        assert [(f.maker.order_id, f.price, f.quantity) for f in fills] == [
+            ('a0', 100, 1), ('a1', 101, 2), ('a2', 103, 1)]
+        assert taker.budget == 150 - 103
+
+    def test_market_buy_without_budget_takes_nothing(self, asks):
+        taker = make_order('mkt', BUY, 0, 5)
+        taker.price = None
+        taker.budget = 0
+
+        assert asks.execute(taker) == []
+        assert len(asks) == 3
+
+    def test_fok_market_buy_killed_over_budget(self, asks):
+        taker = make_order('fok', BUY, 0, 4)
+        taker.price = None
+        taker.budget = 100 + 2 * 101 + 102
+
+        assert asks.execute(taker, fill_or_kill=True) == []
+        assert taker.budget == 100 + 2 * 101 + 102
+
+    def test_ioc_stops_at_limit_and_never_rests(self, asks):
+        taker = make_order('ioc', BUY, 102, 5)
+
+        fills = asks.execute(taker)
+
+        assert sum(f.quantity for f in fills) == 3
+        assert taker.remaining == 2
+        assert 'ioc' not in asks
+        assert asks.best_bid() is None
+
+    def test_fok_killed_without_enough_depth(self, asks):
+        taker = make_order('fok', BUY, 102, 4)
+
+        assert asks.execute(taker, fill_or_kill=True) == []
+        assert taker.filled_quantity == 0
+        assert len(asks) == 3
+
+    def test_fok_fills_with_enough_depth(self, asks):
+        taker = make_order('fok', BUY, 103, 4)
+
+        fills = asks.execute(taker, fill_or_kill=True)
+
+        assert sum(f.quantity for f in fills) == 4
+        assert all(f.taker is taker for f in fills)
+
+    def test_sell_taker_hits_bids(self, book):
+        book.add(make_order('b0', BUY, 99, 1, created_at=0))
+        book.add(make_order('b1', BUY, 98, 1, created_at=1))
+
+        fills = book.execute(make_order('ioc', SELL, 99, 2))
+
+        assert [f.maker.order_id for f in fills] == ['b0']
+
+    def test_depth_stops_counting_at_quantity(self, asks):
+        assert asks.depth(BUY, 101, 10) == 3
+        assert asks.depth(BUY, None, 2) == 3
+        assert asks.depth(SELL, None, 1) == 0
+        assert asks.depth(BUY, None, 10, budget=100 + 101 + 50) == 2
+
+
+
+def make_stop(order_id, side, stop_price, quantity=1, price=None):
+    return BookOrder(order_id, f"acct-{order_id}", f"party-{order_id}", 'BTC/USDT',
+                     side, price, quantity, stop_price=stop_price)
+
+
+@pytest.mark.unit
+class TestStops:
+    """Stop trigger index."""
+
+    def test_stops_wait_outside_the_book(self, book):
+        book.add(make_stop('s', BUY, 105))
+
+        assert 's' in book.stops
+        assert 's' not in book
+        assert book.best_bid() is None
+
+    def test_buy_stops_trigger_at_or_above(self, book):
+        for i, stop in enumerate([103, 101, 105, 102]):
+            book.add(make_stop(f"s{i}", BUY, stop))
+
+        triggered = book.trigger_stops(high=103, low=100)
+
+        assert [o.order_id for o in triggered] == ['s1', 's3', 's0']
+        assert all(o.stop_price is None for o in triggered)
+        assert len(book.stops) == 1
+
+    def test_sell_stops_trigger_at_or_below(self, book):
+        for i, stop in enumerate([97, 99, 95]):
+            book.add(make_stop(f"s{i}", SELL, stop))
+
+        triggered = book.trigger_stops(high=100, low=97)
+
+        assert [o.order_id for o in triggered] == ['s1', 's0']
+
+    def test_equal_stops_trigger_oldest_first(self, book):
+        for i in range(3):
+            book.add(make_stop(f"s{i}", SELL, 99))
+
+        assert [o.order_id for o in book.trigger_stops(99, 99)] == ['s0', 's1', 's2']
+
+    def test_cancelled_stop_never_triggers(self, book):
+        book.add(make_stop('a', BUY, 101))
+        book.add(make_stop('b', BUY, 101))
+
+        book.remove('a')
+
+        assert [o.order_id for o in book.trigger_stops(101, 101)] == ['b']
+
+    def test_upsert_moves_triggered_stop_onto_book(self, book):
+        book.add(make_stop('s', BUY, 101, price=100))
+
+        book.upsert(make_stop('s', BUY, None, price=100))
+
+        assert 's' not in book.stops
+        assert book.best_bid().order_id == 's'
+
+
+class UpdateConnection:
+    """Answers every statement as if `updated` rows matched"""
+
+    def __init__(self, updated):
+        self.updated = updated
+
+    async def execute(self, query, *args):
+        return f"UPDATE {self.updated}"
+
+
+@pytest.mark.unit
+class TestMarkTriggered:
+    """A stop that stopped being live before it was stamped sends the batch back to the database."""
+
+    def test_all_live(self):
+        stops = [make_stop(f"s{n}", SELL, 1) for n in range(2)]
+        asyncio.run(mark_triggered(UpdateConnection(2), stops))
+
+    def test_cancelled_meanwhile(self):
+        stops = [make_stop(f"s{n}", SELL, 1) for n in range(2)]
+        with pytest.raises(StaleOrderError):
+            asyncio.run(mark_triggered(UpdateConnection(1), stops))
+
+
+def make_iceberg(order_id, side, price, quantity, display, created_at=0):
+    return BookOrder(order_id, f"acct-{order_id}", f"party-{order_id}", 'BTC/USDT',
+                     side, price, quantity, 0, created_at, display_quantity=display)
+
+
+@pytest.mark.unit
+class TestIceberg:
+    """Display slices and replenishment."""
+
+    def test_only_slice_is_displayed(self, book):
+        book.add(make_iceberg('ice', SELL, 100, 10, 2))
+
+        level = book.asks.best()
+        assert level.quantity == 2
+        assert level.hidden == 8
+
+    def test_replenished_slice_loses_time_priority(self, book):
+        book.add(make_iceberg('ice', SELL, 100, 10, 2, created_at=0))
+        book.add(make_order('plain', SELL, 100, 3, created_at=1))
+
+        fills = book.execute(make_order('t', BUY, 100, 3, created_at=2))
+
+        assert [(f.maker.order_id, f.quantity) for f in fills] == [('ice', 2), ('plain', 1)]
+        assert [o.order_id for o in book.asks.best()] == ['plain', 'ice']
+        assert book.asks.best().quantity == 2 + 2
+        assert book.asks.best().hidden == 6
+
+    def test_taker_works_through_hidden_quantity(self, book):
+        book.add(make_iceberg('ice', SELL, 100, 5, 2))
+
+        fills = book.execute(make_order('t', BUY, 100, 5))
+
+        assert [f.quantity for f in fills] == [2, 2, 1]
+        assert len(book) == 0
+        assert book.asks.best() is None
+
+    def test_fok_counts_hidden_depth(self, book):
+        book.add(make_iceberg('ice', SELL, 100, 5, 1))
+
+        fills = book.execute(make_order('t', BUY, 100, 4), fill_or_kill=True)
+
+        assert sum(f.quantity for f in fills) == 4
+
+    def test_crossing_iceberg_matches_in_slices(self, book):
+        book.add(make_order('a', SELL, 100, 5, created_at=0))
+        book.add(make_iceberg('ice', BUY, 101, 4, 1, created_at=1))
+
+        fills = book.match()
+
+        assert sum(f.quantity for f in fills) == 4
+        assert book.best_ask().remaining == 1
+        assert 'ice' not in book
+
+
+def make_int_order(order_id, side, ticks, lots, created_at):
+    return BookOrder(order_id, f"acct-{order_id}", f"party-{order_id}", 'BTC/USDT',
+                     side, ticks, lots, 0, created_at)
+
+
+@pytest.mark.unit
+class TestLevelChanges:
+    """Aggregated depth and the levels changed since the last flush."""
+
+    def test_top_levels_best_first(self, book):
+        for i, price in enumerate([99, 101, 100, 101]):
+            book.add(make_order(f'b{i}', BUY, price, 1))
+
+        top = book.bids.top(2)
+
+        assert [(level.price, level.quantity, len(level)) for level in top] == [
+            (Decimal('101'), Decimal('2'), 2), (Decimal('100'), Decimal('1'), 1)]
+        assert len(book.bids.top(10)) == 3
+
+    def test_changes_are_taken_once(self, book):
+        book.add(make_order('b', BUY, 100, 2))
+        book.add(make_order('a', SELL, 102, 1))
+
+        assert sorted(book.take_changes()) == [(BUY, Decimal('100'), Decimal('2'), 1),
+                                               (SELL, Decimal('102'), Decimal('1'), 1)]
+        assert book.take_changes() == []
+
+    def test_fill_and_emptied_level(self, book):
+        book.add(make_order('b', BUY, 100, 2))
+        book.add(make_order('a', SELL, 101, 1))
+        book.take_changes()
+        version = book.asks.version
+
+        book.execute(make_order('t', SELL, 100, 1))
+        book.execute(make_order('t2', BUY, 101, 1))
+
+        assert sorted(book.take_changes()) == [(BUY, Decimal('100'), Decimal('1'), 1),
+                                               (SELL, Decimal('101'), 0, 0)]
+        assert book.asks.version > version
+
+
+@pytest.mark.unit
+class TestSortedKeys:
+    """Chunked keys stay sorted through adds and removals anywhere."""
+
+    def test_matches_sorted_list(self):
+        rng = random.Random(7)
+        keys, expected = SortedKeys(), set()
+        for _ in range(5000):
+            if expected and rng.random() < 0.4:
+                key = rng.choice(sorted(expected)) if rng.random() < 0.5 else max(expected)
+                keys.remove(key)
+                expected.discard(key)
+            else:
+                key = rng.randrange(-10_000, 10_000)
+                if key not in expected:
+                    keys.add(key)
+                    expected.add(key)
+
+        assert len(keys) == len(expected)
+        assert list(reversed(keys)) == sorted(expected, reverse=True)
+        assert keys.last() == max(expected)
+
+    def test_many_levels(self, book):
+        for price in range(1, 1001):
+            book.add(make_int_order(f'a{price}', SELL, price, 1, price))
+        for price in range(1, 1001, 2):
+            book.remove(f'a{price}')
+
+        assert book.asks.best().price == 2
+        assert [level.price for level in book.asks.top(3)] == [2, 4, 6]
+        assert len(book.asks) == 500
@@ -0,0 +1,83 @@
+"""
+Unit tests for trading-service order entry validation and reservations.
+"""
+
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from models import CreateOrderRequest
+from orders import validate_order
+
+ACCOUNT = '00000000-0000-0000-0000-000000000001'
+
+
+def make_request(**fields):
+    values = dict(account_id=ACCOUNT, pair='ETH/USDT', side='BUY', order_type='LIMIT',
+                  quantity=Decimal('2'), price=Decimal('3000.50'))
+    values.update(fields)
+    return CreateOrderRequest(**values)
+
+
+@pytest.mark.unit
+class TestReservations:
+    """What each accepted order locks."""
+
+    def test_limit_buy_reserves_quote_at_limit_price(self):
+        assert validate_order(make_request()) == ('USDT', Decimal('6001.00'))
+
+    def test_sell_reserves_base_quantity(self):
+        assert validate_order(make_request(side='SELL')) == ('ETH', Decimal('2'))
+
+    def test_market_sell_reserves_base_quantity(self):
+        assert validate_order(make_request(side='SELL', order_type='MARKET', price=None)) == ('ETH', Decimal('2'))
+
+    def test_stop_limit_buy_reserves_at_limit_price(self):
+        request = make_request(order_type='STOP', stop_price=Decimal('2990'))
+        assert validate_order(request) == ('USDT', Decimal('6001.00'))
+
+    def test_market_buy_reserves_max_cost(self):
+        request = make_request(order_type='MARKET', price=None, max_cost=Decimal('6500'))
+        assert validate_order(request) == ('USDT', Decimal('6500'))
+
+    def test_stop_market_buy_reserves_max_cost(self):
+        request = make_request(order_type='STOP', price=None, stop_price=Decimal('2990'), max_cost=Decimal('6500'))
+        assert validate_order(request) == ('USDT', Decimal('6500'))
+
+    def test_iceberg_reserves_full_quantity(self):
+        request = make_request(side='SELL', order_type='ICEBERG', display_quantity=Decimal('0.5'))
+        assert validate_order(request) == ('ETH', Decimal('2'))
+
+
+@pytest.mark.unit
+class TestRejections:
+    """Orders refused before they reach the database."""
+
+    @pytest.mark.parametrize("fields, error", [
+        (dict(pair='ETHUSDT'), "BASE/QUOTE"),
+        (dict(pair='XYZ/USDT'), "not listed"),
+        (dict(side='HOLD'), "side"),
+        (dict(order_type='TRAILING'), "order_type"),
+        (dict(time_in_force='DAY'), "time_in_force"),
+        (dict(quantity=Decimal('0')), "quantity must be positive"),
+        (dict(price=Decimal('3000.505')), "not a multiple"),
+        (dict(price=None), "need a price"),
+        (dict(order_type='MARKET'), "take no price"),
+        (dict(order_type='MARKET', price=None), "need a max_cost"),
+        (dict(order_type='MARKET', price=None, max_cost=Decimal('0')), "max_cost must be positive"),
+        (dict(order_type='MARKET', price=None, max_cost=Decimal('1e30')), "too large"),
+        (dict(max_cost=Decimal('6500')), "only buy orders without a price"),
+        (dict(side='SELL', order_type='MARKET', price=None, max_cost=Decimal('1')), "only buy orders"),
+        (dict(order_type='STOP'), "stop_price must be positive"),
+        (dict(stop_price=Decimal('2990')), "only STOP"),
+        (dict(order_type='ICEBERG'), "display_quantity must be positive"),
+        (dict(order_type='ICEBERG', display_quantity=Decimal('3')), "cannot exceed"),
+        (dict(display_quantity=Decimal('1')), "only ICEBERG"),
+    ])
+    def test_rejected(self, fields, error):
+        with pytest.raises(ValueError, match=error):
+            validate_order(make_request(**fields))
@@ -0,0 +1,74 @@
+"""
+Unit tests for trading-service rolling 24h ticker statistics.
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cantondex-backend', 'trading-service'))
+
+from instruments import get_pair_spec
+from ticker import MAX_CHANGE_PERCENT, RollingWindow, TICKER_WINDOW, slot_of
+
+SPEC = get_pair_spec('BTC/USDT')
+T0 = datetime(2026, 10, 17, 12, 0, 0)
+
+
+@pytest.mark.unit
+class TestRollingWindow:
+    """Statistics match a full recomputation as the window slides."""
+
+    def test_stats(self):
+        window = RollingWindow()
+        window.add(T0, 10000, 10500, 9500, 10100, 300)
+        window.add(T0 + timedelta(seconds=1), 10100, 10200, 9900, 9900, 200)
+
+        assert window.stats(SPEC) == {
+            'last_price': Decimal('99.00'),
+            'price_change_24h': Decimal('-1.00'),
+            'price_change_percent_24h': Decimal('-1.0000'),
+            'high_24h': Decimal('105.00'),
+            'low_24h': Decimal('95.00'),
+            'volume_24h': Decimal('0.00000500'),
+        }
+
+    def test_change_percent_fits_its_column(self):
+        window = RollingWindow()
+        window.add(T0, 1, 1, 1, 1, 1)
+        window.add(T0 + timedelta(seconds=1), 10 ** 12, 10 ** 12, 10 ** 12, 10 ** 12, 1)
+
+        assert window.stats(SPEC)['price_change_percent_24h'] == MAX_CHANGE_PERCENT
+
+    def test_expired_window_keeps_last_price(self):
+        window = RollingWindow()
+        window.add(T0, 10000, 10000, 10000, 10000, 1)
+
+        assert window.expire(T0)
+        stats = window.stats(SPEC)
+        assert stats['last_price'] == Decimal('100.00')
+        assert stats['high_24h'] is None and stats['volume_24h'] == 0
+
+    def test_matches_recomputation(self):
+        rng = random.Random(7)
+        window = RollingWindow()
+        batches = []
+        at = T0
+        for _ in range(2000):
+            at += timedelta(seconds=rng.choice([0, 1, 30, 600]))
+            prices = [rng.randint(9000, 11000) for _ in range(rng.randint(1, 3))]
+            batch = (slot_of(at), prices[0], max(prices), min(prices), prices[-1], rng.randint(1, 100))
+            window.add(*batch)
+            batches.append(batch)
+
+            cutoff = slot_of(at - TICKER_WINDOW)
+            window.expire(cutoff)
+            live = [b for b in batches if b[0] > cutoff]
+            assert window.highs[0][1] == max(b[2] for b in live)
+            assert window.lows[0][1] == min(b[3] for b in live)
+            assert window.volume == sum(b[5] for b in live)
+            assert window.slots[0][1] == live[0][1]